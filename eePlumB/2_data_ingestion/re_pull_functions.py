@@ -1,3 +1,7 @@
+import collections
+import datetime
+import json
+
 import ee
 
 # function to add date to properties
@@ -14,6 +18,48 @@ def set_date(feature):
     date = feature.get('date')
     return feature.set({'system:time_start': ee.Date(date)})
 
+# function to index the images of a collection by label date
+def build_date_index(collection, dates):
+    """
+    Builds a local date -> image ID index for the label dates in one request,
+    so the per-date loop does not need a getInfo() call per date.
+
+    Args:
+        collection (ee.ImageCollection): The image stack.
+        dates (ee.List or list): The label dates ('YYYY-MM-dd').
+
+    Returns:
+        collections.OrderedDict: Sorted label dates -> list of the system:index
+        values of the images acquired (UTC) on that date. Dates without images
+        have an empty list.
+    """
+    info = ee.Dictionary({
+        'dates': dates,
+        'ids': collection.aggregate_array('system:index'),
+        'times': collection.aggregate_array('system:time_start')}).getInfo()
+    index = collections.OrderedDict((d, []) for d in sorted(info['dates']))
+    for image_id, t in zip(info['ids'], info['times']):
+        day = datetime.datetime.fromtimestamp(
+            t / 1000, datetime.timezone.utc).strftime('%Y-%m-%d')
+        if day in index:
+            index[day].append(image_id)
+    return index
+
+
+# function to get the images of one date from the index
+def date_images(collection, image_ids):
+    """
+    Selects the images of one date with a single filter on system:index.
+
+    Args:
+        collection (ee.ImageCollection): The image stack the index was built on.
+        image_ids (list): The image IDs of the date, from build_date_index().
+
+    Returns:
+        ee.ImageCollection: The images of that date.
+    """
+    return collection.filter(ee.Filter.inList('system:index', image_ids))
+
 # function to apply scaling factors to LS5/7
 def applyScaleFactors(image):
     """
@@ -202,10 +248,67 @@ def extract_qa_bits(qa_band, start_bit, end_bit, band_name):
     # (0 or 1 for single bit,  0-3 or 0-N for multiple bits)
     .rightShift(start_bit))
 
+# QA bit fields: (band name, start bit, end bit (not inclusive), mask at). 'mask
+# at' is the field value from which the mask_* functions mask a pixel, None for
+# fields that are only flagged. Copies of these tables are in
+# gee_functions.py and local_functions.py, which the notebooks load on
+# their own; tests/test_gee_functions.py checks that the copies agree.
+QA_PIXEL_SPEC = [
+  ('cirrus_conf', 14, 16, 3),
+  ('snowice_conf', 12, 14, 3),
+  ('cloudshad_conf', 10, 12, 3),
+  ('cloud_conf', 8, 10, 3),
+  ('dialated_cloud', 1, 2, None)]
+QA_AEROSOL_SPEC = [('aero_level', 6, 8, 3)]
+QA60_SPEC = [
+  ('cirrus', 11, 12, 1),
+  ('opaque', 10, 11, 1)]
+
+
+# function to decode every QA bit field in a spec at once
+def decode_qa_bits(qa_band, spec):
+  """
+  Extracts all the QA bit fields of a spec table from a QA band in one
+  expression: the QA band is shifted by a constant image holding every start
+  bit and masked by a constant image holding every field width, so the graph
+  does not grow with the number of fields.
+
+  Args:
+      qa_band (ee.Image): The earth engine image QA band to extract the bits from.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      ee.Image: One band per field, named as in the spec.
+  """
+  return (qa_band
+    .select([0])
+    .rightShift(ee.Image.constant([f[1] for f in spec]))
+    .bitwiseAnd(ee.Image.constant([(1 << (f[2] - f[1])) - 1 for f in spec]))
+    .rename([f[0] for f in spec]))
+
+
+# function to make a mask from every maskable QA bit field in a spec
+def qa_mask(qa_band, spec):
+  """
+  Builds a mask that is 1 where every field of the spec with a 'mask at' value
+  is below that value.
+
+  Args:
+      qa_band (ee.Image): The earth engine image QA band.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      ee.Image: A single band 1/0 mask.
+  """
+  fields = [f for f in spec if f[3] is not None]
+  return (decode_qa_bits(qa_band, fields)
+    .lt(ee.Image.constant([f[3] for f in fields]))
+    .reduce(ee.Reducer.min()))
+
 # function to flag high aerosol pixels
 def flag_high_aerosol(image):
   qa_aero = image.select("SR_QA_AEROSOL")
-  aero = extract_qa_bits(qa_aero, 6, 8, 'aero_level')
+  aero = decode_qa_bits(qa_aero, QA_AEROSOL_SPEC)
   return image.addBands(aero)
  
 # Bit 1: Dilated Cloud
@@ -244,18 +347,8 @@ def flag_qa_conf(image):
       is high, except dialated cloud which is 0 none, 1 present
   """
   qa = image.select('QA_PIXEL')
-  # where cirrus confidence is high
-  cirrus_conf = extract_qa_bits(qa, 14, 16, 'cirrus_conf')
-  snowice_conf = extract_qa_bits(qa, 12, 14, 'snowice_conf')
-  cloudshad_conf = extract_qa_bits(qa, 10, 12, 'cloudshad_conf')
-  cloud_conf = extract_qa_bits(qa, 8, 10, 'cloud_conf')
-  dialated = extract_qa_bits(qa, 1, 2, 'dialated_cloud')
-  return (image
-    .addBands(cirrus_conf)
-    .addBands(snowice_conf)
-    .addBands(cloudshad_conf)
-    .addBands(cloud_conf)
-    .addBands(dialated))
+  # cirrus, snow/ice, cloud shadow and cloud confidence and dilated cloud
+  return image.addBands(decode_qa_bits(qa, QA_PIXEL_SPEC))
     
 
 # Bit 10: Opaque clouds
@@ -278,10 +371,8 @@ def flag_cirrus_opaque(image):
       ee.Image: The image with the to add a cirrus flag to.
   """
   qa = image.select('QA60')
-  # where cirrus confidence is high
-  cirrus = extract_qa_bits(qa, 11, 12, 'cirrus')
-  opaque = extract_qa_bits(qa, 10, 11, 'opaque')
-  return image.addBands(cirrus).addBands(opaque)
+  # cirrus and opaque cloud presence
+  return image.addBands(decode_qa_bits(qa, QA60_SPEC))
 
 ## Remove geometries
 def remove_geo(image):
@@ -294,3 +385,419 @@ def remove_geo(image):
       ee.Image with the geometry removed
   """
   return image.setGeometry(None)
+
+
+####--------------------------####
+#### fused re-pull pipelines  ####
+####--------------------------####
+
+# bands used downstream of the re-pull per mission group, by the reducer used
+# for the per-date composite
+PIPELINE_BANDS = {
+    'LS57': {
+        'mean': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'],
+        'max': ['cirrus_conf', 'snowice_conf', 'cloudshad_conf', 'cloud_conf',
+                'dialated_cloud', 'SR_ATMOS_OPACITY'],
+        'min': ['ST_CDIST']},
+    'LS89': {
+        'mean': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7'],
+        'max': ['cirrus_conf', 'snowice_conf', 'cloudshad_conf', 'cloud_conf',
+                'dialated_cloud', 'aero_level'],
+        'min': ['ST_CDIST']},
+    'S2': {
+        'mean': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7',
+                 'SR_B8', 'SR_B8A', 'SR_B9', 'SR_B11', 'SR_B12'],
+        'max': ['MSK_CLDPRB', 'MSK_SNWPRB', 'cirrus', 'opaque', 'dark_pixel',
+                'cloud_shadow', 'water', 'low_prob_cloud', 'med_prob_cloud',
+                'hi_prob_cloud', 'cirrus_scl', 'snow_ice'],
+        'min': []}}
+
+# SCL classes parsed by add_qa_info_s2
+SCL_CLASSES = [('dark_pixel', 2), ('cloud_shadow', 3), ('water', 6),
+               ('low_prob_cloud', 7), ('med_prob_cloud', 8),
+               ('hi_prob_cloud', 9), ('cirrus_scl', 10), ('snow_ice', 11)]
+
+
+# Fused stages. Each one reads the raw image and returns only the bands (or the
+# mask) it contributes, so a pipeline concatenates their outputs once instead of
+# re-adding bands to the full image after every stage.
+def scaled_bands_57(image):
+    """
+    Scaled optical, atmospheric opacity and cloud distance bands of Landsat 5/7.
+    """
+    return ee.Image.cat([
+        image.select(PIPELINE_BANDS['LS57']['mean']).multiply(0.0000275).add(-0.2),
+        image.select('SR_ATMOS_OPACITY').multiply(0.001),
+        image.select('ST_CDIST').multiply(0.01)])
+
+
+def scaled_bands_89(image):
+    """
+    Scaled optical and cloud distance bands of Landsat 8/9.
+    """
+    return ee.Image.cat([
+        image.select(PIPELINE_BANDS['LS89']['mean']).multiply(0.0000275).add(-0.2),
+        image.select('ST_CDIST').multiply(0.01)])
+
+
+def scaled_bands_S2(image):
+    """
+    Scaled optical bands of Sentinel 2 with the "SR_" prefix, plus the cloud and
+    snow probability bands.
+    """
+    old_names = [b[3:] for b in PIPELINE_BANDS['S2']['mean']]
+    return ee.Image.cat([
+        image.select(old_names, PIPELINE_BANDS['S2']['mean']).multiply(0.0001),
+        image.select(['MSK_CLDPRB', 'MSK_SNWPRB'])])
+
+
+def radsat_mask(image):
+    """
+    Mask of unsaturated pixels in a Landsat image.
+    """
+    return image.select('QA_RADSAT').eq(0)
+
+
+def sat_defect_mask(image):
+    """
+    Mask of pixels that are not saturated/defective according to the SCL band.
+    """
+    return image.select('SCL').neq(1)
+
+
+def qa_conf_bands(image):
+    """
+    QA_PIXEL confidence bands, as added by flag_qa_conf.
+    """
+    return decode_qa_bits(image.select('QA_PIXEL'), QA_PIXEL_SPEC)
+
+
+def aerosol_bands(image):
+    """
+    Aerosol level band, as added by flag_high_aerosol.
+    """
+    return decode_qa_bits(image.select('SR_QA_AEROSOL'), QA_AEROSOL_SPEC)
+
+
+def scl_bands(image):
+    """
+    SCL presence/absence bands, as added by add_qa_info_s2, in one comparison.
+    """
+    return (image.select('SCL')
+        .eq(ee.Image.constant([c[1] for c in SCL_CLASSES]))
+        .rename([c[0] for c in SCL_CLASSES]))
+
+
+def cirrus_opaque_bands(image):
+    """
+    QA60 cirrus and opaque cloud bands, as added by flag_cirrus_opaque.
+    """
+    return decode_qa_bits(image.select('QA60'), QA60_SPEC)
+
+
+# ordered (name, kind, function) stages per mission group. 'bands' stages add
+# bands, 'mask' stages are combined into one mask and 'image' stages run on the
+# assembled image (for properties).
+PIPELINES = {
+    'LS57': [('scale', 'bands', scaled_bands_57),
+             ('radsat', 'mask', radsat_mask),
+             ('qa_conf', 'bands', qa_conf_bands),
+             ('date', 'image', addImageDate)],
+    'LS89': [('scale', 'bands', scaled_bands_89),
+             ('radsat', 'mask', radsat_mask),
+             ('qa_conf', 'bands', qa_conf_bands),
+             ('aerosol', 'bands', aerosol_bands),
+             ('date', 'image', addImageDate)],
+    'S2': [('scale', 'bands', scaled_bands_S2),
+           ('sat_defect', 'mask', sat_defect_mask),
+           ('scl', 'bands', scl_bands),
+           ('cirrus_opaque', 'bands', cirrus_opaque_bands),
+           ('date', 'image', addImageDate_S2)]}
+
+# the chained .map() sequences of the re-pull notebooks, for comparison
+CHAINS = {
+    'LS57': [applyScaleFactors, apply_radsat_mask, flag_qa_conf, addImageDate],
+    'LS89': [applyScaleFactors_89, apply_radsat_mask, flag_qa_conf,
+             flag_high_aerosol, addImageDate],
+    'S2': [applyScaleFactors_S2, apply_sat_defect_mask, add_qa_info_s2,
+           flag_cirrus_opaque, addImageDate_S2]}
+
+
+def build_pipeline(stages, keep = None):
+    """
+    Composes an ordered list of stages into one per-image function.
+
+    Args:
+        stages (list): (name, kind, function) tuples, e.g. PIPELINES['LS89'].
+        keep (list): Optional band names to keep from the stage outputs.
+
+    Returns:
+        function: An ee.Image -> ee.Image function for ImageCollection.map(),
+        returning only the stage bands with the image properties.
+    """
+    def fused(image):
+        bands = [f(image) for name, kind, f in stages if kind == 'bands']
+        masks = [f(image) for name, kind, f in stages if kind == 'mask']
+        out = ee.Image.cat(bands)
+        if keep is not None:
+            out = out.select(keep)
+        if len(masks) == 1:
+            out = out.updateMask(masks[0])
+        elif masks:
+            out = out.updateMask(ee.Image.cat(masks).reduce(ee.Reducer.min()))
+        # an image with no bands keeps the properties and footprint of the input
+        out = image.select([]).addBands(out)
+        for name, kind, f in stages:
+            if kind == 'image':
+                out = f(out)
+        return out
+    return fused
+
+
+def fused_pipeline(mission, keep = None):
+    """
+    Builds the fused per-image function of a mission group.
+
+    Args:
+        mission (str): 'LS57', 'LS89' or 'S2'.
+        keep (list): Optional band names to keep.
+
+    Returns:
+        function: The per-image function.
+    """
+    return build_pipeline(PIPELINES[mission], keep)
+
+
+def graph_node_count(obj):
+    """
+    Counts the function invocations in the serialized expression graph of an ee
+    object. Shared subexpressions are counted once.
+
+    Args:
+        obj (ee.ComputedObject): The ee object.
+
+    Returns:
+        int: The number of invocation nodes.
+    """
+    graph = json.dumps(ee.serializer.encode(obj, for_cloud_api = True))
+    return graph.count('"functionInvocationValue"')
+
+
+def pipeline_report(image, missions = None):
+    """
+    Compares the expression graph size of the chained and fused pipelines for
+    one image.
+
+    Args:
+        image (ee.Image): A raw image of the mission group(s).
+        missions (list): Mission groups to report, defaults to all.
+
+    Returns:
+        list: Dictionaries with mission, chained and fused node counts.
+    """
+    report = []
+    for mission in missions or list(PIPELINES):
+        chained = image
+        for f in CHAINS[mission]:
+            chained = f(chained)
+        fused = fused_pipeline(mission)(image)
+        report.append({'mission': mission,
+                       'chained': graph_node_count(chained),
+                       'fused': graph_node_count(fused)})
+    return report
+
+
+####--------------------------####
+#### per-date composites      ####
+####--------------------------####
+
+# ee.Reducer names of the per-date composite and of the label point
+# extraction, by band group of PIPELINE_BANDS; the reducers are built when
+# used, so importing this module needs no initialized ee session
+COMPOSITE_REDUCERS = collections.OrderedDict([
+    ('mean', 'mean'), ('max', 'max'), ('min', 'min')])
+POINT_REDUCERS = collections.OrderedDict([
+    ('mean', 'median'), ('max', 'max'), ('min', 'min')])
+
+
+def make_reducer(name):
+    """
+    Builds an ee.Reducer by name, e.g. make_reducer('median').
+    """
+    return getattr(ee.Reducer, name)()
+
+
+def date_composite(images, bands):
+    """
+    Composites the images of one date in a single pass: the mean of the
+    reflectance bands, the max of the QA bands and the min of the cloud
+    distance band come from one combined reducer over the stack.
+
+    Args:
+        images (ee.ImageCollection): The images of one date.
+        bands (dict): Band lists by group ('mean', 'max', 'min'), e.g.
+            PIPELINE_BANDS['LS89'].
+
+    Returns:
+        ee.Image: The composite, with the original band names.
+    """
+    groups = [g for g in COMPOSITE_REDUCERS if bands.get(g)]
+    reducer = make_reducer(COMPOSITE_REDUCERS[groups[0]])
+    for g in groups[1:]:
+        reducer = reducer.combine(make_reducer(COMPOSITE_REDUCERS[g]),
+                                  sharedInputs = True)
+    all_bands = [b for g in groups for b in bands[g]]
+    # the combined reducer names its outputs <band>_<reducer>
+    return (images
+        .select(all_bands)
+        .reduce(reducer)
+        .select([b + '_' + g for g in groups for b in bands[g]], all_bands))
+
+
+def point_reducer(image, bands):
+    """
+    Builds the combined reducer for reduceRegions() over the label points: the
+    median of the reflectance bands, the max of the QA bands and the min of the
+    cloud distance band.
+
+    Args:
+        image (ee.Image): The per-date composite.
+        bands (dict): Band lists by group, e.g. PIPELINE_BANDS['LS89'].
+
+    Returns:
+        ee.Reducer: The combined reducer.
+    """
+    reducer = None
+    for g, r in POINT_REDUCERS.items():
+        if not bands.get(g):
+            continue
+        one = make_reducer(r).unweighted().forEachBand(image.select(bands[g]))
+        reducer = one if reducer is None else reducer.combine(one, sharedInputs = False)
+    return reducer
+
+
+####--------------------------####
+#### batched label extraction ####
+####--------------------------####
+
+def date_composites(collection, date_index, bands, dates = None):
+    """
+    Builds the per-date composites of the label dates as one collection,
+    mapping one composite function over the server-side list of dates, so the
+    graph does not grow with the number of dates. Each composite carries the
+    label date as 'date' and as system:time_start (midnight UTC, in
+    milliseconds), which extract_labels() joins on.
+
+    Args:
+        collection (ee.ImageCollection): The image stack the index was built on.
+        date_index (dict): From build_date_index().
+        bands (dict): Band lists by group, e.g. PIPELINE_BANDS['LS89'].
+        dates (list): Optional subset of the index dates.
+
+    Returns:
+        ee.ImageCollection: One composite per date that has images.
+    """
+    dates = [d for d in (dates if dates is not None else date_index)
+             if date_index[d]]
+    image_ids = ee.Dictionary({d: date_index[d] for d in dates})
+
+    def composite_of(date):
+        composite = date_composite(
+            date_images(collection, image_ids.get(date)), bands)
+        return composite.set({
+            'date': date,
+            'system:time_start': ee.Date(date).millis()})
+
+    return ee.ImageCollection(ee.List(dates).map(composite_of))
+
+
+def extract_labels(composites, labels, bands, scale = 30):
+    """
+    Samples every label at its own date's composite in one collection level
+    operation: labels are joined to the composite with the same
+    system:time_start, each composite reduces its joined labels, and the
+    results are flattened into one table. The join keeps all the labels of a
+    composite (ee.Join.saveAll), so each date needs a single reduceRegions().
+
+    Args:
+        composites (ee.ImageCollection): From date_composites().
+        labels (ee.FeatureCollection): Labels with a 'date' property
+            ('YYYY-MM-dd'), e.g. mapped with set_date().
+        bands (dict): Band lists by group, e.g. PIPELINE_BANDS['LS89'].
+        scale (int): Scale of the reduction, in meters.
+
+    Returns:
+        ee.FeatureCollection: The labels with the band values.
+    """
+    # set_date() stores system:time_start as an ee.Date, the composites store
+    # milliseconds; compare both as milliseconds
+    labels = labels.map(lambda feature: feature.set(
+        'system:time_start', ee.Date(feature.get('date')).millis()))
+    joined = ee.Join.saveAll('labels').apply(
+        primary = composites,
+        secondary = labels,
+        condition = ee.Filter.equals(leftField = 'system:time_start',
+                                     rightField = 'system:time_start'))
+
+    def reduce_date(image):
+        image = ee.Image(image)
+        return image.reduceRegions(
+            collection = ee.FeatureCollection(ee.List(image.get('labels'))),
+            reducer = point_reducer(image, bands),
+            scale = scale,
+            crs = image.geometry().projection().crs())
+
+    return ee.FeatureCollection(joined.map(reduce_date)).flatten()
+
+
+def partition_dates(date_index, by = None):
+    """
+    Splits the dates of an index into export partitions.
+
+    Args:
+        date_index (dict): From build_date_index().
+        by (str): None for a single partition, 'year' for one per year.
+
+    Returns:
+        collections.OrderedDict: Partition name ('' or 'YYYY') -> dates.
+    """
+    parts = collections.OrderedDict()
+    for one_date, image_ids in date_index.items():
+        if image_ids:
+            parts.setdefault('' if by is None else one_date[:4], []).append(one_date)
+    return parts
+
+
+def label_extraction_tasks(collection, labels, date_index, bands, prefix,
+                           folder, version, by = None, scale = 30):
+    """
+    Creates the (unstarted) table exports of the batched label extraction: one
+    table per mission, or one per partition.
+
+    Args:
+        collection (ee.ImageCollection): The processed image stack.
+        labels (ee.FeatureCollection): Labels with a 'date' property.
+        date_index (dict): From build_date_index().
+        bands (dict): Band lists by group, e.g. PIPELINE_BANDS['LS89'].
+        prefix (str): Mission prefix of the file names, e.g. 'LS8'.
+        folder (str): Drive folder.
+        version (str): Version date of the file names, e.g. '2024-04-25'.
+        by (str): Partitioning, see partition_dates().
+        scale (int): Scale of the reduction, in meters.
+
+    Returns:
+        list: ee.batch.Task objects, e.g. for task_functions.TaskScheduler.
+    """
+    tasks = []
+    for part, dates in partition_dates(date_index, by).items():
+        name = prefix + ('_' + part if part else '')
+        data = extract_labels(date_composites(collection, date_index, bands, dates),
+                              labels, bands, scale)
+        tasks.append(ee.batch.Export.table.toDrive(
+            collection = data,
+            description = name,
+            folder = folder,
+            fileNamePrefix = name + '_additional_vars_v' + version,
+            fileFormat = 'csv'))
+    return tasks
+
@@ -0,0 +1,465 @@
+# modules
+import collections
+import json
+import os
+
+import numpy as np
+
+# Registry of the AOI shapefiles in data/aoi/. Every shapefile is read once,
+# dissolved to one geometry in a meter based CRS and simplified once per pixel
+# size, and rasterized masks are kept per target grid, so clipping or masking
+# by an AOI is a dictionary lookup instead of a new polygon intersection.
+# Requires geopandas (and rasterio for masks, earthengine-api for ee
+# geometries). Precomputed mask layers (see the packed mask layers section)
+# store the shoreline masks as one bit per pixel and layer, so switching
+# between the full AOI and the AOI minus shoreline contamination is a bit test
+# instead of a clip.
+
+# AOI name -> shapefile, relative to the AOI directory
+AOI_FILES = collections.OrderedDict([
+  ('modeling', 'Superior_AOI_modeling.shp'),
+  ('minus_shoreline_contamination',
+   'Superior_AOI_minus_shoreline_contamination.shp'),
+  ('shoreline_contamination', 'Superior_shoreline_contamination.shp'),
+  ('tile_1', 'tiledAOI/SuperiorAOI_1.shp'),
+  ('tile_2', 'tiledAOI/SuperiorAOI_2.shp'),
+  ('tile_3', 'tiledAOI/SuperiorAOI_3.shp'),
+  ('tile_4', 'tiledAOI/SuperiorAOI_4.shp'),
+  ('tile_5', 'tiledAOI/SuperiorAOI_5.shp'),
+  ('tile_1_noharbor', 'tiledAOI/Superior_AOI_1_noharbor.shp'),
+  ('tile_2_no_bay', 'tiledAOI/Superior_AOI_2_no_bay.shp'),
+  ('tile_3_no_bay', 'tiledAOI/Superior_AOI_3_no_bay.shp')])
+
+# tiles covering the modeling AOI, with the harbor/bays removed as in
+# eePlumB/A_PrepAOI/02_Modeling_AOI.Rmd
+TILES = ['tile_1_noharbor', 'tile_2_no_bay', 'tile_3_no_bay', 'tile_4', 'tile_5']
+
+# pixel sizes in meters
+PIXEL_SIZE = {'LS5': 30, 'LS7': 30, 'LS8': 30, 'LS9': 30, 'S2': 10}
+
+# NAD83 / Great Lakes Albers, the meter based CRS the geometries are simplified in
+WORK_CRS = 'EPSG:3174'
+
+
+class AOIRegistry(object):
+  """
+  Loads the AOI shapefiles on first use and caches their geometries,
+  simplified geometries (at half the pixel size, so simplification moves no
+  edge by more than half a pixel) and rasterized masks.
+
+  Args:
+      aoi_dir (str): Directory of the AOI shapefiles.
+      max_masks (int): Number of rasterized masks kept, least recently used
+          masks are dropped first.
+  """
+
+  def __init__(self, aoi_dir = 'data/aoi', max_masks = 32):
+    self.aoi_dir = aoi_dir
+    self.max_masks = max_masks
+    self._geometries = {}
+    self._simplified = {}
+    self._ee_geometries = {}
+    self._masks = collections.OrderedDict()
+
+  def names(self):
+    return list(AOI_FILES)
+
+  def geometry(self, name):
+    """
+    Returns:
+        shapely geometry: The dissolved AOI in WORK_CRS.
+    """
+    if name not in self._geometries:
+      import geopandas as gpd
+      aoi = gpd.read_file(os.path.join(self.aoi_dir, AOI_FILES[name]))
+      self._geometries[name] = aoi.to_crs(WORK_CRS).union_all()
+    return self._geometries[name]
+
+  def simplified(self, name, scale = 30):
+    """
+    The AOI simplified with a tolerance of half a pixel.
+
+    Args:
+        name (str): The AOI name, a key of AOI_FILES.
+        scale (float): Pixel size in meters (30 for Landsat, 10 for Sentinel 2).
+
+    Returns:
+        shapely geometry: The simplified AOI in WORK_CRS.
+    """
+    key = (name, scale)
+    if key not in self._simplified:
+      self._simplified[key] = self.geometry(name).simplify(scale / 2.0,
+        preserve_topology = True)
+    return self._simplified[key]
+
+  def geojson(self, name, scale = 30, crs = 'EPSG:4326'):
+    """
+    Returns:
+        dict: GeoJSON geometry of the simplified AOI in `crs`.
+    """
+    import geopandas as gpd
+    series = gpd.GeoSeries([self.simplified(name, scale)], crs = WORK_CRS)
+    return series.to_crs(crs).iloc[0].__geo_interface__
+
+  def ee_geometry(self, name, scale = 30):
+    """
+    The simplified AOI as an ee.Geometry, built once per AOI and pixel size to
+    use in place of aoi_ee.geometry() in clip() and exports.
+
+    Returns:
+        ee.Geometry: The simplified AOI.
+    """
+    key = (name, scale)
+    if key not in self._ee_geometries:
+      import ee
+      self._ee_geometries[key] = ee.Geometry(self.geojson(name, scale))
+    return self._ee_geometries[key]
+
+  def mask(self, name, transform, shape, crs, scale = None):
+    """
+    Rasterizes the AOI on a target grid, True inside the AOI. Masks are cached
+    per AOI and grid. The mask is built from the simplified AOI at the grid's
+    pixel size.
+
+    Args:
+        name (str): The AOI name.
+        transform (affine.Affine): Transform of the target grid.
+        shape (tuple): (height, width) of the target grid.
+        crs: CRS of the target grid (anything geopandas accepts).
+        scale (float): Pixel size in meters the AOI is simplified at, defaults
+            to grid_scale(); required for grids in degrees.
+
+    Returns:
+        np.ndarray: Read-only boolean mask.
+    """
+    if scale is None:
+      scale = grid_scale(transform, crs)
+    key = (name, tuple(transform)[:6], tuple(shape), str(crs), scale)
+    if key in self._masks:
+      self._masks.move_to_end(key)
+      return self._masks[key]
+    import geopandas as gpd
+    from rasterio import features
+    geom = gpd.GeoSeries([self.simplified(name, scale)], crs = WORK_CRS)
+    mask = features.geometry_mask(geom.to_crs(crs), out_shape = shape,
+      transform = transform, invert = True)
+    mask.flags.writeable = False
+    self._masks[key] = mask
+    while len(self._masks) > self.max_masks:
+      self._masks.popitem(last = False)
+    return mask
+
+  def mask_image(self, image, name = 'modeling', scale = None):
+    """
+    Masks a local_functions.LocalImage read with read_bands() to an AOI, the
+    local counterpart of clipping an ee.Image.
+
+    Args:
+        image (local_functions.LocalImage): Image with a raster 'profile'
+            property.
+        name (str): The AOI name.
+        scale (float): Pixel size in meters, see mask().
+
+    Returns:
+        local_functions.LocalImage: The masked image.
+    """
+    profile = image.get('profile')
+    shape = (profile['height'], profile['width'])
+    return image.updateMask(self.mask(name, profile['transform'], shape,
+      profile['crs'], scale))
+
+
+def grid_scale(transform, crs):
+  """
+  Pixel width of a grid in meters, from its transform and the units of its
+  CRS.
+
+  Args:
+      transform (affine.Affine): Transform of the grid.
+      crs: CRS of the grid (anything pyproj accepts).
+
+  Returns:
+      float: The pixel size in meters.
+
+  Raises:
+      ValueError: If the CRS is not projected, e.g. a grid in degrees.
+  """
+  import pyproj
+  crs = pyproj.CRS.from_user_input(crs)
+  if not crs.is_projected:
+    raise ValueError('The grid CRS ' + crs.to_string() + ' is not projected, ' +
+      'pass the pixel size in meters as scale')
+  return abs(transform[0]) * crs.axis_info[0].unit_conversion_factor
+
+
+_registry = None
+
+
+def get_registry(aoi_dir = 'data/aoi'):
+  """
+  Returns:
+      AOIRegistry: The shared registry, created on first use.
+  """
+  global _registry
+  if _registry is None or _registry.aoi_dir != aoi_dir:
+    _registry = AOIRegistry(aoi_dir)
+  return _registry
+
+
+def set_registry(registry):
+  """
+  Replaces the shared registry, e.g. with one whose geometries are already
+  built.
+  """
+  global _registry
+  _registry = registry
+
+
+def clip(image, name = 'modeling', scale = 30):
+  """
+  Clips an ee.Image to the cached, simplified AOI, like gee_functions.clip().
+  """
+  return image.clip(get_registry().ee_geometry(name, scale))
+
+
+####--------------------------####
+#### packed mask layers       ####
+####--------------------------####
+
+# AOIs stored as mask layers, bit k of a layer code is MASK_LAYERS[k]
+MASK_LAYERS = ['modeling', 'minus_shoreline_contamination',
+               'shoreline_contamination']
+
+# UTM zone 15N, the CRS of the Landsat path 26 and Sentinel 2 15T scenes
+GRID_CRS = 'EPSG:32615'
+
+MASK_DIR = 'data/aoi/masks'
+
+
+def aoi_grid(scale, crs = GRID_CRS, name = 'modeling', origin = 0.0,
+             registry = None):
+  """
+  The grid of `scale` meter pixels covering an AOI, with pixel edges at
+  multiples of the scale (plus `origin`), e.g. the Sentinel 2 10 m grid or,
+  with origin = 15, the Landsat 30 m grid.
+
+  Returns:
+      tuple: (affine.Affine transform, (height, width))
+  """
+  import geopandas as gpd
+  from affine import Affine
+  registry = registry or get_registry()
+  bounds = gpd.GeoSeries([registry.geometry(name)], crs = WORK_CRS).to_crs(
+    crs).total_bounds
+  x0 = np.floor((bounds[0] - origin) / scale) * scale + origin
+  y1 = np.ceil((bounds[3] - origin) / scale) * scale + origin
+  width = int(np.ceil((bounds[2] - x0) / scale))
+  height = int(np.ceil((y1 - bounds[1]) / scale))
+  return Affine(scale, 0, x0, 0, -scale, y1), (height, width)
+
+
+def mask_grid(scale, crs = GRID_CRS, registry = None):
+  """
+  The grid of the stored mask layers of a pixel size: the AOI grid offset by
+  15 m for the Landsat 30 m pixels, unshifted for the Sentinel 2 grid.
+
+  Returns:
+      tuple: (affine.Affine transform, (height, width))
+  """
+  origin = 15.0 if scale == 30 else 0.0
+  return aoi_grid(scale, crs, origin = origin, registry = registry)
+
+
+class PackedMasks(object):
+  """
+  Mask layers of one grid stored with np.packbits, one bit per pixel and
+  layer. Masks are unpacked per window from the memory-mapped bits, so only
+  the rows of a window are read.
+
+  Args:
+      path (str): The .npy file written by build_mask_layers(); a .json file
+          with the same name holds the grid and the layer names.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.splitext(path)[0] + '.json') as f:
+      self.meta = json.load(f)
+    self.layers = self.meta['layers']
+    self.shape = tuple(self.meta['shape'])
+    self.transform = self.meta['transform']
+    self.crs = self.meta['crs']
+    self._packed = np.load(path, mmap_mode = 'r')
+
+  def check_grid(self, transform, shape, crs = None):
+    """
+    Raises a ValueError unless a grid is the grid of the stored layers.
+
+    Args:
+        transform: Affine transform (or its first 6 numbers) of the grid.
+        shape (tuple): (height, width) of the grid.
+        crs: CRS of the grid, not compared if None.
+    """
+    if transform is None:
+      raise ValueError('The grid has no transform to check against ' +
+        self.path)
+    same = (tuple(shape) == self.shape and np.allclose(list(transform)[:6],
+      self.transform[:6]) and (crs is None or str(crs) == self.crs))
+    if not same:
+      raise ValueError('Grid ' + str(list(transform)[:6]) + ', ' +
+        str(tuple(shape)) + ', ' + str(crs) + ' does not match the mask ' +
+        'layers in ' + self.path + ' (' + str(self.transform) + ', ' +
+        str(self.shape) + ', ' + self.crs + ')')
+
+  def mask(self, name, rows = None, cols = None):
+    """
+    Unpacks a window of a layer, reading only the packed bits of its rows.
+
+    Args:
+        name (str): The layer.
+        rows, cols (slice): Window, defaults to the full grid.
+
+    Returns:
+        np.ndarray: Boolean mask, True inside the AOI.
+    """
+    height, width = self.shape
+    r0, r1, _ = (rows or slice(None)).indices(height)
+    c0, c1, _ = (cols or slice(None)).indices(width)
+    start, stop = r0 * width, r1 * width
+    skip = start % 8
+    packed = self._packed[self.layers.index(name), start // 8:(stop + 7) // 8]
+    bits = np.unpackbits(packed, count = stop - start + skip)[skip:]
+    return bits.view(bool).reshape(r1 - r0, width)[:, c0:c1]
+
+  def codes(self, block_rows = 1024):
+    """
+    Returns:
+        np.ndarray: uint8 layer codes, bit k set where layer k is True.
+    """
+    codes = np.zeros(self.shape, dtype = np.uint8)
+    for r in range(0, self.shape[0], block_rows):
+      rows = slice(r, min(r + block_rows, self.shape[0]))
+      for k, name in enumerate(self.layers):
+        codes[rows] |= self.mask(name, rows).astype(np.uint8) << k
+    return codes
+
+  def mask_image(self, image, name = 'minus_shoreline_contamination'):
+    """
+    Masks a local_functions.LocalImage read with read_bands() to a layer; the
+    image's grid (its 'profile' property) must be the grid of the layers.
+    """
+    profile = image.get('profile')
+    if profile is None:
+      raise ValueError('The image has no profile to check the grid of')
+    self.check_grid(profile['transform'], (profile['height'],
+      profile['width']), profile.get('crs'))
+    return image.updateMask(self.mask(name))
+
+  def write_codes(self, path):
+    """
+    Writes the layer codes as a uint8 GeoTIFF, e.g. to upload as an ee asset
+    for ee_layer_mask(). Requires rasterio.
+    """
+    import rasterio
+    from affine import Affine
+    with rasterio.open(path, 'w', driver = 'GTiff', height = self.shape[0],
+        width = self.shape[1], count = 1, dtype = 'uint8', crs = self.crs,
+        transform = Affine(*self.transform), compress = 'deflate') as dst:
+      dst.write(self.codes(), 1)
+      dst.update_tags(layers = ','.join(self.layers))
+
+
+def mask_layers_path(scale, crs = GRID_CRS, mask_dir = MASK_DIR):
+  return os.path.join(mask_dir, 'aoi_masks_' + str(crs).replace(':', '') +
+    '_' + str(int(scale)) + 'm.npy')
+
+
+def build_mask_layers(transform, shape, crs = GRID_CRS, layers = MASK_LAYERS,
+                      path = None, registry = None, scale = None):
+  """
+  Rasterizes AOIs on a grid once and stores them bit packed.
+
+  Args:
+      transform (affine.Affine): Transform of the grid, e.g. from aoi_grid().
+      shape (tuple): (height, width) of the grid.
+      crs: CRS of the grid.
+      layers (list): AOI names, see MASK_LAYERS.
+      path (str): Output .npy file, defaults to mask_layers_path().
+      registry (AOIRegistry): Defaults to get_registry().
+      scale (float): Pixel size in meters, defaults to grid_scale().
+
+  Returns:
+      PackedMasks: The stored layers.
+  """
+  registry = registry or get_registry()
+  if scale is None:
+    scale = grid_scale(transform, crs)
+  path = path or mask_layers_path(scale, crs)
+  if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  packed = np.stack([np.packbits(registry.mask(name, transform, shape,
+    crs, scale).ravel()) for name in layers])
+  np.save(path, packed)
+  with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+    json.dump({'layers': list(layers), 'shape': list(shape),
+      'transform': list(transform)[:6], 'crs': str(crs)}, f, indent = 1)
+  return PackedMasks(path)
+
+
+def load_mask_layers(scale, crs = GRID_CRS, mask_dir = MASK_DIR):
+  """
+  Opens the stored mask layers of a pixel size, building them on the AOI grid
+  (mask_grid()) if they are missing.
+  """
+  path = mask_layers_path(scale, crs, mask_dir)
+  if not os.path.exists(path):
+    transform, shape = mask_grid(scale, crs)
+    build_mask_layers(transform, shape, crs, path = path, scale = scale)
+  return PackedMasks(path)
+
+
+def ee_layer_codes(feature_collections, scale = 30, crs = GRID_CRS,
+                   transform = None):
+  """
+  Paints ee.FeatureCollections into a uint8 layer code image (bit k for
+  layer k), e.g. for a one-time Export.image.toAsset().
+
+  Args:
+      feature_collections (list): ee.FeatureCollections in layer order, e.g.
+          [gf.aoi_ee, gf.aoi_no_sc_ee] for the first two MASK_LAYERS.
+      scale (float): Pixel size in meters.
+      crs (str): CRS of the grid.
+      transform: Affine transform of the grid, defaults to mask_grid() (the
+          grid of the local mask layers, so both have the same pixels).
+
+  Returns:
+      ee.Image: The 'aoi_layers' code band.
+  """
+  import ee
+  if transform is None:
+    transform = mask_grid(scale, crs)[0]
+  codes = ee.Image.constant(0).toByte()
+  for k, fc in enumerate(feature_collections):
+    layer = ee.Image.constant(0).toByte().paint(fc, 1 << k).toByte()
+    codes = codes.bitwiseOr(layer)
+  return codes.rename('aoi_layers').reproject(crs, list(transform)[:6])
+
+
+def ee_layer_mask(image, codes, name = 'minus_shoreline_contamination',
+                  layers = MASK_LAYERS):
+  """
+  Masks an ee.Image to a layer of a layer code image with one updateMask, in
+  place of clipping by the AOI polygons.
+
+  Args:
+      image (ee.Image): The image to mask.
+      codes (ee.Image or str): The layer code image or its asset ID.
+      name (str): The layer.
+      layers (list): Layer order of the code image.
+
+  Returns:
+      ee.Image: The masked image.
+  """
+  import ee
+  bit = 1 << layers.index(name)
+  return image.updateMask(ee.Image(codes).bitwiseAnd(bit).neq(0))
@@ -0,0 +1,648 @@
+# modules
+import argparse
+import contextlib
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+# Offline benchmarks. The Earth Engine side runs against a recording stand-in
+# for the ee module, which builds the expression graph without a server and
+# counts getInfo() calls, task list requests and started tasks, so graph size,
+# server round trips and task submissions can be measured for every function
+# in gee_functions.py and re_pull_functions.py and for the notebook loops. The
+# local backends are timed on synthetic QA/SR arrays, with peak memory from
+# tracemalloc. Only the deterministic fake-ee counts are gated against the
+# committed baseline; local timings depend on the machine, so they are kept in
+# a per-machine baseline outside of git and only reported. Run from the repo
+# root:
+#
+#   python modeling/benchmark_functions.py                 # compare to baseline
+#   python modeling/benchmark_functions.py --save          # write a new baseline
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GEE_FUNCTIONS = os.path.join(HERE, 'gee_functions.py')
+RE_PULL_FUNCTIONS = os.path.join(HERE, '..', 'eePlumB', '2_data_ingestion',
+  're_pull_functions.py')
+BASELINE = os.path.join(HERE, '..', 'data', 'benchmark', 'baseline.json')
+LOCAL_BASELINE = os.path.join(HERE, '..', 'data', 'benchmark', 'local',
+  platform.node() + '.json')
+
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+
+MISSIONS = [('LS5', 'LS57'), ('LS7', 'LS57'),
+  ('LS8', 'LS89'), ('LS9', 'LS89'), ('S2', 'S2')]
+
+# per-image functions measured for graph size, where present
+GEE_IMAGE_FUNCTIONS = ['apply_radsat_mask', 'applyScaleFactors', 'flag_qa_conf',
+  'mask_qa_flags', 'mask_high_atmos_opac', 'mask_high_aerosol',
+  'applyScaleFactors_S2', 'apply_sat_defect_mask', 'add_qa_info_s2',
+  'mask_SCL_qa', 'flag_cirrus_opaque', 'mask_cirrus_opaque', 'addImageDate',
+  'addImageDateSen', 'addImageDate_S2', 'extract_classes', 'extract_3classes',
+  'classifications_to_one_band', 'clip', 'remove_geo']
+RE_PULL_IMAGE_FUNCTIONS = ['applyScaleFactors', 'applyScaleFactors_89',
+  'applyScaleFactors_S2', 'apply_radsat_mask', 'apply_sat_defect_mask',
+  'add_qa_info_s2', 'addImageDate', 'addImageDate_S2', 'flag_high_aerosol',
+  'flag_qa_conf', 'flag_cirrus_opaque', 'remove_geo']
+
+
+####--------------------------####
+#### recording ee stand-in    ####
+####--------------------------####
+
+class Recorder(object):
+  """
+  Counts the server interactions of a fake ee module.
+
+  Attributes:
+      get_info (int): Number of getInfo() calls.
+      task_lists (int): Number of ee.data.getTaskList() calls.
+      exports (int): Number of export tasks created.
+      started (list): Descriptions of the started tasks.
+      respond (function): Optional node -> value function for getInfo().
+      tasks (list): Task dictionaries returned by ee.data.getTaskList().
+  """
+
+  def __init__(self):
+    self.reset()
+    self.respond = None
+    self.tasks = []
+
+  def reset(self):
+    self.get_info = 0
+    self.task_lists = 0
+    self.exports = 0
+    self.started = []
+
+  @property
+  def round_trips(self):
+    return self.get_info + self.task_lists
+
+
+class FakeNode(object):
+  """
+  An expression node: a function name with its arguments. Methods and
+  attributes return new nodes, callables passed as arguments (as to map())
+  are called once with placeholder arguments, like ee does.
+  """
+
+  def __init__(self, recorder, name, args = (), kwargs = None):
+    self._recorder = recorder
+    self._name = name
+    self._args = tuple(_lift(recorder, a) for a in args)
+    self._kwargs = {k: _lift(recorder, v) for k, v in (kwargs or {}).items()}
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return FakeMethod(self._recorder, name, self)
+
+  def getInfo(self):
+    self._recorder.get_info += 1
+    respond = self._recorder.respond
+    return respond(self) if respond is not None else None
+
+
+class FakeMethod(object):
+
+  def __init__(self, recorder, name, owner = None):
+    self._recorder = recorder
+    self._name = name
+    self._owner = owner
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return FakeMethod(self._recorder, self._name + '.' + name, self._owner)
+
+  def __call__(self, *args, **kwargs):
+    rec = self._recorder
+    if self._owner is None:
+      if self._name in ('Initialize', 'Authenticate', 'Reset'):
+        return None
+      if self._name.startswith('batch.Export.'):
+        rec.exports += 1
+        return FakeTask(rec, self._name, kwargs)
+      return FakeNode(rec, self._name, args, kwargs)
+    return FakeNode(rec, self._name, (self._owner,) + args, kwargs)
+
+
+class FakeData(object):
+  """
+  Stand-in for the ee.data module. getTaskList() is a real attribute, so it
+  can be patched like the function of the ee.data module; other functions
+  return nodes.
+  """
+
+  def __init__(self, recorder):
+    self._recorder = recorder
+
+  def __getattr__(self, name):
+    if name.startswith('__'):
+      raise AttributeError(name)
+    return FakeMethod(self._recorder, 'data.' + name)
+
+  def getTaskList(self):
+    self._recorder.task_lists += 1
+    return list(self._recorder.tasks)
+
+
+class FakeTask(object):
+
+  def __init__(self, recorder, name, kwargs):
+    self._recorder = recorder
+    self.name = name
+    self.config = dict(kwargs)
+    self.id = None
+
+  def start(self):
+    self._recorder.started.append(self.config.get('description'))
+    self.id = 'FAKE_' + str(len(self._recorder.started))
+
+  def status(self):
+    self._recorder.get_info += 1
+    return {'id': self.id, 'state': 'COMPLETED'}
+
+
+def _lift(recorder, value):
+  if isinstance(value, (FakeNode, FakeTask)):
+    return value
+  if isinstance(value, FakeMethod):
+    return FakeNode(recorder, value._name, () if value._owner is None
+      else (value._owner,))
+  if callable(value):
+    params = [p for p in inspect.signature(value).parameters.values()
+      if p.default is p.empty and p.kind in (p.POSITIONAL_ONLY,
+      p.POSITIONAL_OR_KEYWORD)]
+    placeholders = [FakeNode(recorder, 'argument', (i,))
+      for i in range(max(len(params), 1))]
+    return FakeNode(recorder, 'function', (value(*placeholders),))
+  if isinstance(value, (list, tuple)):
+    return [_lift(recorder, v) for v in value]
+  if isinstance(value, dict):
+    return {k: _lift(recorder, v) for k, v in value.items()}
+  return value
+
+
+def encode(obj, for_cloud_api = True):
+  """
+  Serializes a fake expression like ee.serializer.encode(): identical
+  subexpressions are stored once in 'values' and referenced by key.
+  """
+  values = {}
+  memo = {}
+
+  def enc(o):
+    if isinstance(o, FakeNode):
+      if id(o) in memo:
+        return memo[id(o)]
+      args = dict(('arg' + str(i), enc(a)) for i, a in enumerate(o._args))
+      args.update((k, enc(v)) for k, v in o._kwargs.items())
+      body = {'functionInvocationValue': {'functionName': o._name,
+        'arguments': args}}
+      key = hashlib.sha1(json.dumps(body, sort_keys = True,
+        default = str).encode('utf-8')).hexdigest()[:16]
+      values.setdefault(key, body)
+      memo[id(o)] = {'valueReference': key}
+      return memo[id(o)]
+    if isinstance(o, (list, tuple)):
+      return {'arrayValue': {'values': [enc(v) for v in o]}}
+    if isinstance(o, dict):
+      return {'dictionaryValue': {'values': {k: enc(v) for k, v in o.items()}}}
+    return {'constantValue': o}
+
+  return {'result': enc(obj), 'values': values}
+
+
+def node_count(obj):
+  """
+  Returns:
+      int: The number of distinct function invocations in an expression.
+  """
+  return len(encode(obj)['values'])
+
+
+def fake_ee(recorder = None):
+  """
+  Builds a recording stand-in for the ee module.
+
+  Returns:
+      module: The fake module, with the Recorder as `ee.recorder`.
+  """
+  recorder = recorder or Recorder()
+  module = types.ModuleType('ee')
+  module.recorder = recorder
+  module.serializer = types.SimpleNamespace(encode = encode)
+  module.data = FakeData(recorder)
+  module.__getattr__ = lambda name: FakeMethod(recorder, name)
+  return module
+
+
+@contextlib.contextmanager
+def using(module):
+  """
+  Installs a fake ee module for the duration of a with block.
+  """
+  previous = sys.modules.get('ee')
+  sys.modules['ee'] = module
+  try:
+    yield module
+  finally:
+    if previous is None:
+      sys.modules.pop('ee', None)
+    else:
+      sys.modules['ee'] = previous
+
+
+def load_module(path, name):
+  """
+  Loads a fresh copy of a functions module, e.g. while a fake ee is
+  installed.
+  """
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+####--------------------------####
+#### Earth Engine benchmarks   ####
+####--------------------------####
+
+class FakeRegistry(object):
+  """
+  AOI registry stand-in whose ee geometries are fake nodes, so the AOI
+  functions need no shapefiles or geopandas.
+  """
+
+  def __init__(self, ee, aoi_dir = 'data/aoi'):
+    self.aoi_dir = aoi_dir
+    self._ee = ee
+
+  def ee_geometry(self, name, scale = 30):
+    return self._ee.Geometry(name)
+
+
+def function_graph_sizes(module, names, ee):
+  """
+  Expression nodes each per-image function adds to one image.
+
+  Returns:
+      dict: function name -> node count (or an 'error: ...' string)
+  """
+  base = ee.Image('raw')
+  base_nodes = node_count(base)
+  sizes = {}
+  for name in names:
+    f = getattr(module, name, None)
+    if f is None:
+      continue
+    try:
+      sizes[name] = node_count(f(base)) - base_nodes
+    except Exception as e:
+      sizes[name] = 'error: ' + type(e).__name__
+  return sizes
+
+
+def pipeline_graph_sizes(rp, ee):
+  """
+  Graph size of the chained .map() sequences and the fused pipelines of the
+  re-pull notebooks.
+
+  Returns:
+      dict: mission group -> {'chained': nodes, 'fused': nodes}
+  """
+  sizes = {}
+  for group, chain in rp.CHAINS.items():
+    chained = ee.ImageCollection('raw')
+    for f in chain:
+      chained = chained.map(f)
+    fused = ee.ImageCollection('raw').map(rp.fused_pipeline(group))
+    sizes[group] = {'chained': node_count(chained), 'fused': node_count(fused)}
+  return sizes
+
+
+def label_extraction_costs(rp, ee, n_dates = 100, images_per_date = 2):
+  """
+  Round trips, task submissions and graph size of the re-pull label
+  extraction of one mission, from building the date index to the finished
+  exports.
+
+  Returns:
+      dict: mission -> costs
+  """
+  import task_functions as tf
+  rec = ee.recorder
+  dates = ['2020-%02d-%02d' % (4 + d // 28, 1 + d % 28) for d in range(n_dates)]
+  t0 = 1585699200000
+  info = {'dates': dates,
+    'ids': ['IMG_%d_%d' % (d, i) for d in range(n_dates)
+      for i in range(images_per_date)],
+    'times': [t0 + (int(dates[d][5:7]) - 4) * 28 * 86400000 +
+      (int(dates[d][8:]) - 1) * 86400000 for d in range(n_dates)
+      for i in range(images_per_date)]}
+  costs = {}
+  for mission, group in MISSIONS:
+    rec.reset()
+    rec.respond = lambda node: info
+    collection = ee.ImageCollection('raw').map(rp.fused_pipeline(group))
+    index = rp.build_date_index(collection, dates)
+    tasks = rp.label_extraction_tasks(collection, ee.FeatureCollection('labels'),
+      index, rp.PIPELINE_BANDS[group], mission, 'folder', 'v')
+    backend = tf.FakeTaskBackend()
+    scheduler = tf.TaskScheduler(backend = backend, sleep = lambda s: None)
+    scheduler.run(tasks)
+    costs[mission] = {'round_trips': rec.round_trips + backend.n_polls,
+      'get_info': rec.get_info, 'submissions': len(backend.started),
+      'nodes': sum(node_count(t.config['collection']) for t in tasks)}
+  rec.respond = None
+  return costs
+
+
+def gtb_export_costs(gf, ee, n_dates = 100):
+  """
+  Round trips and submissions of the per-date GTB export loop, as written in
+  the GTB scripts (getInfo() per date, maximum_no_of_tasks() before every
+  start), and through export_functions.run_manifest().
+
+  Returns:
+      dict: mission -> {'loop': costs, 'manifest': costs}
+  """
+  import export_functions as ef
+  import task_functions as tf
+  rec = ee.recorder
+  miss_dates = ['MISSION_2020-%02d-%02d' % (4 + d // 28, 1 + d % 28)
+    for d in range(n_dates)]
+  costs = {}
+  for mission, group in MISSIONS:
+    rec.reset()
+    rec.respond = lambda node: miss_dates
+    stack = ee.ImageCollection('classified')
+    unique = ee.List(miss_dates)
+    date_length = len(unique.getInfo())
+    rec.respond = lambda node: miss_dates[0]
+    for d in range(date_length):
+      md = unique.get(d)
+      md.getInfo()
+      image = stack.filter(ee.Filter.eq('missDate', md)).first()
+      task = ee.batch.Export.image.toDrive(image = image,
+        description = 'GTB_' + str(md.getInfo()))
+      gf.maximum_no_of_tasks(10, 0)
+      task.start()
+    loop = {'round_trips': rec.round_trips, 'submissions': len(rec.started)}
+
+    rec.reset()
+    rec.respond = lambda node: miss_dates
+    dates = ee.List(miss_dates).getInfo()
+    backend = tf.FakeTaskBackend()
+    scheduler = tf.TaskScheduler(backend = backend, sleep = lambda s: None)
+    with tempfile.TemporaryDirectory() as tmp:
+      manifest = ef.ExportManifest(os.path.join(tmp, 'manifest.jsonl'))
+      jobs = {manifest.key(mission, md, 'v'): (lambda md = md:
+        ee.batch.Export.image.toDrive(image = stack.filter(
+          ee.Filter.eq('missDate', md)).first(), description = 'GTB_' + md))
+        for md in dates}
+      ef.run_manifest(manifest, scheduler, jobs)
+    costs[mission] = {'loop': loop, 'manifest': {
+      'round_trips': rec.round_trips + backend.n_polls,
+      'submissions': len(backend.started)}}
+  rec.respond = None
+  return costs
+
+
+def ee_benchmarks(n_dates = 100):
+  """
+  Runs the Earth Engine benchmarks against the recording fake ee.
+
+  Returns:
+      dict: The results.
+  """
+  ee = fake_ee()
+  with using(ee):
+    for name in ('task_functions', 'aoi_functions', 'export_functions'):
+      sys.modules.pop(name, None)
+    gf = load_module(GEE_FUNCTIONS, 'bench_gee_functions')
+    gf.aoi.set_registry(FakeRegistry(ee))
+    rp = load_module(RE_PULL_FUNCTIONS, 'bench_re_pull_functions')
+    results = {
+      'gee_functions': function_graph_sizes(gf, GEE_IMAGE_FUNCTIONS, ee),
+      're_pull_functions': function_graph_sizes(rp, RE_PULL_IMAGE_FUNCTIONS,
+        ee),
+      'pipelines': pipeline_graph_sizes(rp, ee),
+      'label_extraction': label_extraction_costs(rp, ee, n_dates),
+      'gtb_export': gtb_export_costs(gf, ee, n_dates)}
+    for name in ('task_functions', 'aoi_functions', 'export_functions'):
+      sys.modules.pop(name, None)
+  return results
+
+
+####--------------------------####
+#### local benchmarks         ####
+####--------------------------####
+
+def synthetic_scene(group, size = 512, seed = 47):
+  """
+  Random raw bands of a mission group with the QA bands its functions read.
+
+  Returns:
+      local_functions.LocalImage: The scene.
+  """
+  import local_functions as lf
+  rng = np.random.default_rng(seed)
+
+  def dn(low = 7273, high = 20000):
+    return rng.integers(low, high, (size, size)).astype(np.uint16)
+
+  if group == 'S2':
+    names = ['B1', 'B2', 'B3', 'B4', 'B5', 'B6', 'B7', 'B8', 'B8A', 'B9',
+      'B11', 'B12']
+    bands = [(n, dn(0, 10000)) for n in names]
+    bands += [('SCL', rng.integers(0, 12, (size, size)).astype(np.uint8)),
+      ('QA60', (rng.integers(0, 2, (size, size)) << 10).astype(np.uint16))]
+  else:
+    optical = (['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7']
+      if group == 'LS57' else ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5',
+      'SR_B6', 'SR_B7'])
+    bands = [(n, dn()) for n in optical]
+    bands += [('ST_B6' if group == 'LS57' else 'ST_B10', dn()),
+      ('ST_CDIST', dn(0, 1000)),
+      ('QA_PIXEL', rng.integers(0, 2**16, (size, size)).astype(np.uint16)),
+      ('QA_RADSAT', (rng.random((size, size)) < 0.01).astype(np.uint16))]
+    if group == 'LS57':
+      bands.append(('SR_ATMOS_OPACITY', dn(0, 600)))
+    else:
+      bands.append(('SR_QA_AEROSOL',
+        rng.integers(0, 256, (size, size)).astype(np.uint8)))
+  return lf.LocalImage(bands)
+
+
+def _measure(f, n_pixels, repeats = 3):
+  # best time of the repeats, and peak traced memory of one run
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    f()
+    times.append(time.perf_counter() - start)
+  tracemalloc.start()
+  f()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return {'pixels_per_s': n_pixels / min(times), 'peak_mb': peak / 2.0**20}
+
+
+def local_benchmarks(size = 512, model_trees = 10):
+  """
+  Times the local backends on synthetic scenes.
+
+  Returns:
+      dict: backend -> {'pixels_per_s', 'peak_mb'}
+  """
+  import local_functions as lf
+  chains = {
+    'LS57': [lf.apply_radsat_mask, lf.applyScaleFactors_57, lf.flag_qa_conf],
+    'LS89': [lf.apply_radsat_mask, lf.applyScaleFactors_89, lf.flag_qa_conf,
+      lf.flag_high_aerosol],
+    'S2': [lf.applyScaleFactors_S2, lf.apply_sat_defect_mask,
+      lf.add_qa_info_s2, lf.flag_cirrus_opaque]}
+  n = size * size
+  results = {}
+  for group, chain in chains.items():
+    scene = synthetic_scene(group, size)
+    results['chain_' + group] = _measure(lambda: lf.run_chain(scene, chain), n)
+  qa = synthetic_scene('LS89', size).band('QA_PIXEL')
+  results['qa_mask'] = _measure(lambda: lf.qa_mask(qa, lf.QA_PIXEL_SPEC), n)
+
+  import gtb_functions as gtb
+  import inference_functions as inf
+  labels = gtb.load_labels('LS8', label_dir = os.path.join(HERE, '..', 'data',
+    'labels'))
+  features = gtb.MISSIONS['LS8']['features']
+  model = gtb.train_gtb(labels[features].values, labels['byte_property'].values,
+    features, gtb.CLASS_VALUES['5class'], n_trees = model_trees)
+  scaled = lf.run_chain(synthetic_scene('LS89', size), chains['LS89'])
+  results['classify_block'] = _measure(lambda: inf.classify_block(model, scaled),
+    n, repeats = 1)
+  reclassed = inf.classify_block(model, scaled)
+  results['class_counts'] = _measure(lambda: inf.class_counts(reclassed), n)
+  return results
+
+
+####--------------------------####
+#### baselines                ####
+####--------------------------####
+
+def run(n_dates = 100, size = 512):
+  """
+  Runs all benchmarks.
+
+  Returns:
+      dict: {'ee': ..., 'local': ..., 'meta': ...}
+  """
+  return {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+      'n_dates': n_dates, 'size': size, 'numpy': np.__version__,
+      'python': sys.version.split()[0]},
+    'ee': ee_benchmarks(n_dates),
+    'local': local_benchmarks(size)}
+
+
+def _flatten(d, prefix = ''):
+  out = {}
+  for k, v in d.items():
+    if isinstance(v, dict):
+      out.update(_flatten(v, prefix + k + '.'))
+    else:
+      out[prefix + k] = v
+  return out
+
+
+def compare(results, baseline):
+  """
+  Lists regressions of the deterministic fake-ee counts against a baseline:
+  any increase in node counts, round trips or submissions.
+
+  Returns:
+      list: (metric, baseline value, current value) tuples.
+  """
+  now = _flatten({'ee': results['ee']})
+  old = _flatten({'ee': baseline['ee']})
+  regressions = []
+  for key, value in sorted(now.items()):
+    if key not in old or not isinstance(value, (int, float)):
+      continue
+    if value > old[key]:
+      regressions.append((key, old[key], value))
+  return regressions
+
+
+def timing_changes(results, baseline, tolerance = 0.2):
+  """
+  Lists local throughput or peak memory more than `tolerance` worse than a
+  baseline of the same machine. These are reported, not gated.
+
+  Returns:
+      list: (metric, baseline value, current value) tuples.
+  """
+  now = _flatten({'local': results['local']})
+  old = _flatten({'local': baseline.get('local', {})})
+  changes = []
+  for key, value in sorted(now.items()):
+    if key not in old or not isinstance(value, (int, float)):
+      continue
+    before = old[key]
+    if key.endswith('pixels_per_s'):
+      worse = value < before * (1 - tolerance)
+    elif key.endswith('peak_mb'):
+      worse = value > before * (1 + tolerance)
+    else:
+      worse = False
+    if worse:
+      changes.append((key, before, value))
+  return changes
+
+
+def save(results, path = BASELINE, local_path = LOCAL_BASELINE):
+  """
+  Writes the fake-ee counts to the committed baseline and the local timings
+  to the baseline of this machine.
+  """
+  for out, keys in ((path, ('ee', 'meta')), (local_path, ('local', 'meta'))):
+    if not os.path.exists(os.path.dirname(out)):
+      os.makedirs(os.path.dirname(out))
+    with open(out, 'w') as f:
+      json.dump({k: results[k] for k in keys}, f, indent = 1, sort_keys = True)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = 'Offline benchmarks')
+  parser.add_argument('--save', action = 'store_true',
+    help = 'write the results as the new baseline')
+  parser.add_argument('--baseline', default = BASELINE)
+  parser.add_argument('--local-baseline', default = LOCAL_BASELINE)
+  parser.add_argument('--dates', type = int, default = 100)
+  parser.add_argument('--size', type = int, default = 512)
+  args = parser.parse_args()
+  results = run(args.dates, args.size)
+  print(json.dumps(results, indent = 1, sort_keys = True))
+  if args.save:
+    save(results, args.baseline, args.local_baseline)
+    sys.exit(0)
+  if os.path.exists(args.local_baseline):
+    with open(args.local_baseline) as f:
+      for key, before, value in timing_changes(results, json.load(f)):
+        print('SLOWER ' + key + ': ' + str(before) + ' -> ' + str(value))
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f))
+    for key, before, value in regressions:
+      print('REGRESSION ' + key + ': ' + str(before) + ' -> ' + str(value))
+    sys.exit(1 if regressions else 0)
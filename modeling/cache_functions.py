@@ -0,0 +1,136 @@
+# modules
+import hashlib
+import json
+import os
+import time
+
+import ee
+
+# On-disk cache of getInfo() results keyed by the hash of the serialized
+# expression graph. Re-running a notebook after a kernel restart then only goes
+# to the server for the expressions that changed. Only use it for
+# deterministic expressions (trained classifiers, error matrices, date lists,
+# projections); the cache cannot tell when an asset behind an expression
+# changes, which is what the optional TTL is for.
+
+
+def expression_key(obj):
+  """
+  Content hash of an ee object.
+
+  Args:
+      obj (ee.ComputedObject): The expression.
+
+  Returns:
+      str: sha256 hex digest of the serialized expression graph.
+  """
+  encoded = ee.serializer.encode(obj, for_cloud_api = True)
+  text = json.dumps(encoded, sort_keys = True, separators = (',', ':'))
+  return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class GetInfoCache(object):
+  """
+  Size-bounded LRU cache of getInfo() results, one JSON file per expression.
+  The modification time of a file is its last use; when the cache grows past
+  `max_bytes` the least recently used files are removed.
+
+  Args:
+      cache_dir (str): Cache directory, created if missing.
+      max_bytes (int): Size limit of the cache directory.
+      ttl (float): Age in seconds after which a result is fetched again, None
+          to keep results until they are evicted.
+  """
+
+  def __init__(self, cache_dir = 'data/cache/getinfo', max_bytes = 256 * 2**20,
+               ttl = None):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    if not os.path.exists(cache_dir):
+      os.makedirs(cache_dir)
+
+  def _path(self, key):
+    return os.path.join(self.cache_dir, key + '.json')
+
+  def get_info(self, obj):
+    """
+    Returns obj.getInfo(), from the cache if the same expression was evaluated
+    before.
+
+    Args:
+        obj (ee.ComputedObject): The expression.
+
+    Returns:
+        The result of obj.getInfo().
+    """
+    path = self._path(expression_key(obj))
+    if os.path.exists(path):
+      with open(path) as f:
+        entry = json.load(f)
+      if self.ttl is None or time.time() - entry['created'] <= self.ttl:
+        os.utime(path, None)
+        self.hits += 1
+        return entry['result']
+    self.misses += 1
+    result = obj.getInfo()
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+      json.dump({'created': time.time(), 'result': result}, f)
+    os.replace(tmp, path)
+    self.evict()
+    return result
+
+  def evict(self):
+    """
+    Removes least recently used results until the cache fits in max_bytes.
+    """
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if name.endswith('.json'):
+        st = os.stat(os.path.join(self.cache_dir, name))
+        entries.append((st.st_mtime, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    for _, size, name in sorted(entries):
+      if total <= self.max_bytes:
+        break
+      os.remove(os.path.join(self.cache_dir, name))
+      total -= size
+      self.evictions += 1
+
+  def clear(self):
+    for name in os.listdir(self.cache_dir):
+      if name.endswith('.json'):
+        os.remove(os.path.join(self.cache_dir, name))
+
+  def stats(self):
+    """
+    Returns:
+        dict: hits, misses, evictions, hit rate and the number and size of
+        cached results.
+    """
+    sizes = [os.path.getsize(os.path.join(self.cache_dir, n))
+      for n in os.listdir(self.cache_dir) if n.endswith('.json')]
+    calls = self.hits + self.misses
+    return {'hits': self.hits, 'misses': self.misses,
+      'evictions': self.evictions,
+      'hit_rate': self.hits / float(calls) if calls else None,
+      'entries': len(sizes), 'bytes': sum(sizes)}
+
+
+_cache = None
+
+
+def get_info(obj, cache_dir = 'data/cache/getinfo'):
+  """
+  getInfo() through a shared GetInfoCache, e.g.
+  `cf.get_info(trainedGTB_l5.explain())` in place of
+  `trainedGTB_l5.explain().getInfo()`.
+  """
+  global _cache
+  if _cache is None or _cache.cache_dir != cache_dir:
+    _cache = GetInfoCache(cache_dir)
+  return _cache.get_info(obj)
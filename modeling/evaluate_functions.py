@@ -0,0 +1,181 @@
+# modules
+import concurrent.futures
+import os
+import sys
+
+import ee
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import gtb_functions as gtb
+
+# Batch evaluation of independent ee expressions. The GTB notebooks call
+# getInfo() on the training confusion matrix, the test error matrix, its
+# accuracy, kappa and F-scores and the explain() importance one after another,
+# about 25 round trips per class scheme. Here the expressions of all missions
+# and schemes are evaluated together, either packed into one ee.Dictionary
+# (one request) or on a small thread pool, and the results are written as the
+# data/output CSV files with the table formats of gtb_functions.py. They go to
+# data/output/local by default so a batch run does not replace the committed
+# tables of the notebooks; pass out_dir = 'data/output' to write them there.
+
+# evaluation results per model, in the order of the notebooks
+EVALUATIONS = ['training', 'confusion', 'accuracy', 'kappa', 'fscore',
+               'importance']
+
+KEY_SEP = '|'
+
+
+def _key_string(key):
+  return KEY_SEP.join(key) if isinstance(key, tuple) else str(key)
+
+
+def get_info_batch(expressions, mode = 'dictionary', batch_size = None,
+                   max_workers = 4, cache = None):
+  """
+  Evaluates independent ee expressions.
+
+  Args:
+      expressions (dict): key -> ee.ComputedObject; keys are strings or tuples
+          of strings.
+      mode (str): 'dictionary' to pack the expressions into ee.Dictionary
+          requests, 'threads' to call getInfo() on a thread pool.
+      batch_size (int): Expressions per ee.Dictionary request, None for a
+          single request.
+      max_workers (int): Concurrent requests, for 'threads' and for the
+          ee.Dictionary batches.
+      cache (cache_functions.GetInfoCache): Optional cache for the requests.
+
+  Returns:
+      dict: key -> result of getInfo().
+  """
+  get_info = cache.get_info if cache is not None else (lambda o: o.getInfo())
+  keys = list(expressions)
+  if mode == 'threads':
+    requests = [[k] for k in keys]
+  elif mode == 'dictionary':
+    size = batch_size or max(len(keys), 1)
+    requests = [keys[i:i + size] for i in range(0, len(keys), size)]
+  else:
+    raise ValueError('mode must be "dictionary" or "threads", not ' + str(mode))
+
+  def evaluate(batch):
+    if mode == 'threads':
+      return {batch[0]: get_info(expressions[batch[0]])}
+    names = {_key_string(k): k for k in batch}
+    if len(names) != len(batch):
+      raise ValueError('Expression keys are not unique as strings')
+    info = get_info(ee.Dictionary({s: expressions[k] for s, k in names.items()}))
+    return {k: info[s] for s, k in names.items()}
+
+  results = {}
+  if len(requests) == 1:
+    results.update(evaluate(requests[0]))
+  else:
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+      for batch_results in pool.map(evaluate, requests):
+        results.update(batch_results)
+  return {k: results[k] for k in keys}
+
+
+def model_expressions(classifier, testing):
+  """
+  The evaluation expressions of one trained classifier, as in the GTB
+  notebooks.
+
+  Args:
+      classifier (ee.Classifier): The trained smileGradientTreeBoost model.
+      testing (ee.FeatureCollection): Test labels with 'byte_property'.
+
+  Returns:
+      dict: name (see EVALUATIONS) -> ee expression.
+  """
+  matrix = (testing
+    .classify(classifier)
+    .errorMatrix('byte_property', 'classification'))
+  return {
+    'training': classifier.confusionMatrix().array(),
+    'confusion': matrix.array(),
+    'accuracy': matrix.accuracy(),
+    'kappa': matrix.kappa(),
+    'fscore': matrix.fscore(),
+    'importance': ee.Dictionary(classifier.explain()).get('importance')}
+
+
+def evaluation_expressions(models):
+  """
+  The evaluation expressions of several models.
+
+  Args:
+      models (dict): (mission, scheme) -> (trained ee.Classifier, testing
+          ee.FeatureCollection), e.g. {('LS5', '5class'): (trainedGTB_ls5,
+          testing_ls5)}.
+
+  Returns:
+      dict: (mission, scheme, name) -> ee expression.
+  """
+  expressions = {}
+  for (mission, scheme), (classifier, testing) in models.items():
+    for name, expr in model_expressions(classifier, testing).items():
+      expressions[(mission, scheme, name)] = expr
+  return expressions
+
+
+def evaluation_tables(results, mission, scheme):
+  """
+  Formats the evaluation results of one model like the data/output files.
+
+  Args:
+      results (dict): (mission, scheme, name) -> value, from get_info_batch().
+      mission (str): 'LS5', 'LS7', 'LS8', 'LS9' or 'S2'.
+      scheme (str): '5class' or '3class'.
+
+  Returns:
+      dict: 'training', 'confusion', 'performance' and 'importance' tables.
+  """
+  info = gtb.MISSIONS[mission]
+  classes = gtb.CLASS_VALUES[scheme]
+  value = lambda name: results[(mission, scheme, name)]
+  importance = value('importance')
+  return {
+    'training': gtb.confusion_table(value('training'), classes, info['name']),
+    'confusion': gtb.confusion_table(value('confusion'), classes, info['name']),
+    'performance': gtb.performance_table(value('fscore'), value('accuracy'),
+      value('kappa'), classes, info['name']),
+    'importance': pd.DataFrame({'Band': list(importance),
+      'Feature_Importance': list(importance.values())})
+      .sort_values('Feature_Importance', ascending = False)}
+
+
+def evaluate_models(models, version = gtb.v_date, out_dir = gtb.LOCAL_OUT_DIR,
+                    overwrite = False, **kwargs):
+  """
+  Evaluates several trained models in one batch and writes their outputs.
+
+  Args:
+      models (dict): (mission, scheme) -> (classifier, testing), see
+          evaluation_expressions().
+      version (str): Model version date used in the file names.
+      out_dir (str): Output directory, None to skip writing. Defaults to
+          data/output/local, 'data/output' writes next to the notebook tables.
+      overwrite (bool): Replace existing output files, see
+          gtb_functions.write_tables().
+      **kwargs: Passed to get_info_batch().
+
+  Returns:
+      dict: (mission, scheme) -> dict of output tables.
+  """
+  if out_dir is not None and not overwrite:
+    # fail before the server requests
+    gtb.check_outputs([path for mission, scheme in models
+      for path in gtb.output_paths(mission, scheme, version, out_dir).values()])
+  results = get_info_batch(evaluation_expressions(models), **kwargs)
+  tables = {}
+  for mission, scheme in models:
+    tables[(mission, scheme)] = evaluation_tables(results, mission, scheme)
+    if out_dir is not None:
+      gtb.write_tables(tables[(mission, scheme)],
+        gtb.output_paths(mission, scheme, version, out_dir), overwrite = True)
+  return tables
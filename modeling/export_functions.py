@@ -0,0 +1,376 @@
+# modules
+import collections
+import json
+import os
+import sys
+import time
+
+import ee
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import aoi_functions as aoi
+
+# Export planning for the classified mission-date images. Instead of one export
+# of the whole AOI per date, every date is split into one shard per tiledAOI
+# tile. All shards use the same crs and crsTransform, so they fall on one pixel
+# grid and can be stitched back together locally without resampling.
+
+# value of pixels outside the AOI, same as the classifications_to_one_band()
+# default
+NODATA = -99
+
+
+def shard_regions(tiles = None, scale = 30, registry = None):
+  """
+  Export regions of the shards.
+
+  Args:
+      tiles (list): AOI names of the tiles, defaults to aoi_functions.TILES.
+      scale (float): Pixel size in meters, for the simplification tolerance.
+      registry (aoi_functions.AOIRegistry): AOI registry, defaults to the
+          shared one.
+
+  Returns:
+      OrderedDict: tile name -> ee.Geometry
+  """
+  registry = registry or aoi.get_registry()
+  return collections.OrderedDict((tile, registry.ee_geometry(tile, scale))
+    for tile in (tiles or aoi.TILES))
+
+
+def sharded_export_tasks(image, description, folder, crs, crs_transform,
+                         regions = None, **kwargs):
+  """
+  Makes one Export.image.toDrive task per shard of an image.
+
+  Args:
+      image (ee.Image): Image to export (e.g. the 'reclass' band).
+      description (str): Task description of the unsharded export, e.g.
+          'GTB_v2024-04-26_LANDSAT_5_1984-06-01'. Shards add '_<tile>'.
+      folder (str): Drive folder.
+      crs (str): CRS of the export grid, e.g. img_crs.crs().getInfo().
+      crs_transform (list): Affine transform of the export grid, e.g. the
+          img_crsTrans of the GTB scripts. Shared by all shards so they line
+          up pixel for pixel.
+      regions (dict): tile name -> ee.Geometry, defaults to shard_regions().
+      **kwargs: Passed to Export.image.toDrive().
+
+  Returns:
+      OrderedDict: tile name -> unstarted ee.batch.Task
+  """
+  regions = regions if regions is not None else shard_regions()
+  tasks = collections.OrderedDict()
+  for tile, region in regions.items():
+    # clip first and then unmask, so every pixel of the shard's bounding box
+    # outside the tile (or masked in the image) is written as NODATA and not
+    # as 0; shards overlap at their edges and are merged on NODATA
+    tasks[tile] = ee.batch.Export.image.toDrive(
+      image = image.clip(region).unmask(NODATA, False),
+      region = region,
+      description = description + '_' + tile,
+      folder = folder,
+      crs = crs,
+      crsTransform = crs_transform,
+      maxPixels = 1e13,
+      formatOptions = {'noData': NODATA},
+      **kwargs)
+  return tasks
+
+
+def submit_sharded(scheduler, tasks, **tags):
+  """
+  Queues the shards of one export on a task_functions.TaskScheduler, which
+  runs shards of many dates concurrently within its task limit.
+
+  Args:
+      scheduler (task_functions.TaskScheduler): The scheduler.
+      tasks (dict): tile name -> task, from sharded_export_tasks().
+      **tags: Stored with every job (e.g. mission, missDate).
+
+  Returns:
+      list: The job records.
+  """
+  return [scheduler.submit(task, tile = tile, **tags)
+    for tile, task in tasks.items()]
+
+
+####--------------------------####
+#### stitching                ####
+####--------------------------####
+
+def shard_paths(directory, description, tiles = None):
+  """
+  Finds the downloaded GeoTIFFs of the shards of one export. Drive splits
+  large exports into several files, which are all returned.
+
+  Returns:
+      list: Paths, in tile order.
+  """
+  import glob
+  paths = []
+  for tile in (tiles or aoi.TILES):
+    paths += sorted(glob.glob(os.path.join(directory,
+      description + '_' + tile + '*.tif')))
+  return paths
+
+
+def merge_shards(shards, shape, nodata = NODATA):
+  """
+  Merges shard arrays on a shared grid, keeping the first value that is not
+  `nodata` where shards overlap.
+
+  Args:
+      shards (list): (array of shape (bands, rows, cols), row offset, column
+          offset) of every shard on the merged grid.
+      shape (tuple): (bands, height, width) of the merged grid.
+      nodata: Value of pixels without data.
+
+  Returns:
+      np.ndarray: The merged array.
+  """
+  merged = None
+  for arr, r, c in shards:
+    if merged is None:
+      merged = np.full(shape, nodata, dtype = arr.dtype)
+    window = merged[:, r:r + arr.shape[1], c:c + arr.shape[2]]
+    fill = (window == nodata) & (arr != nodata)
+    window[fill] = arr[fill]
+  return merged
+
+
+def stitch_shards(paths, out_path = None):
+  """
+  Merges shard GeoTIFFs into one raster. Shards share one grid, so this only
+  copies pixels; where shards overlap the first valid (not NODATA) value is
+  kept (see merge_shards()). Requires rasterio.
+
+  Args:
+      paths (list): Shard GeoTIFFs, e.g. from shard_paths().
+      out_path (str): GeoTIFF to write, None to only return the result.
+
+  Returns:
+      tuple: (merged array of shape (bands, height, width), raster profile)
+  """
+  import rasterio
+  from rasterio.transform import rowcol
+  with rasterio.open(paths[0]) as src:
+    profile = dict(src.profile)
+    transform = src.transform
+  shards = []
+  bounds = []
+  for p in paths:
+    with rasterio.open(p) as src:
+      bounds.append(src.bounds)
+  left = min(b.left for b in bounds)
+  top = max(b.top for b in bounds)
+  transform = rasterio.Affine(transform.a, 0, left, 0, transform.e, top)
+  for p in paths:
+    with rasterio.open(p) as src:
+      arr = src.read()
+      if src.nodata is not None and src.nodata != NODATA:
+        arr[arr == src.nodata] = NODATA
+      r, c = rowcol(transform, src.bounds.left + transform.a / 2,
+        src.bounds.top + transform.e / 2)
+      shards.append((arr, int(r), int(c)))
+  height = max(r + a.shape[1] for a, r, c in shards)
+  width = max(c + a.shape[2] for a, r, c in shards)
+  merged = merge_shards(shards, (shards[0][0].shape[0], height, width))
+  profile.update(height = height, width = width, transform = transform,
+    nodata = NODATA)
+  if out_path is not None:
+    with rasterio.open(out_path, 'w', **profile) as dst:
+      dst.write(merged)
+  return merged, profile
+
+
+####--------------------------####
+#### export manifests         ####
+####--------------------------####
+
+# manifest states; jobs in the first two are in progress
+IN_PROGRESS = ('submitted', 'running')
+
+
+class ExportManifest(object):
+  """
+  Persistent record of export jobs, keyed by mission, missDate, model version
+  (v_date) and AOI, so that a re-run only submits what is missing. The
+  manifest is an append-only JSON lines file: every state change adds one
+  line and the last line of a key wins, so a crash loses at most the line
+  being written.
+
+  Failed jobs are retried up to `max_retries` times, waiting
+  `retry_wait * backoff ** (failures - 1)` seconds after each failure.
+
+  Args:
+      path (str): The manifest file, created if missing.
+      max_retries (int): Number of times a failed job is submitted again.
+      retry_wait (float): Wait after the first failure, in seconds.
+      backoff (float): Factor the wait grows by after every further failure.
+  """
+
+  def __init__(self, path, max_retries = 3, retry_wait = 60, backoff = 2):
+    self.path = path
+    self.max_retries = max_retries
+    self.retry_wait = retry_wait
+    self.backoff = backoff
+    self.entries = collections.OrderedDict()
+    if os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          if line.strip():
+            entry = json.loads(line)
+            self.entries[entry['key']] = entry
+    elif os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+
+  @staticmethod
+  def key(mission, missDate, v_date, aoi_name = 'modeling'):
+    return '|'.join([mission, missDate, v_date, aoi_name])
+
+  def state(self, key):
+    entry = self.entries.get(key)
+    return entry['state'] if entry else None
+
+  def record(self, key, state, **fields):
+    """
+    Appends a state change of a job.
+
+    Args:
+        key (str): The job key, from key().
+        state (str): 'submitted', 'running', 'completed' or 'failed'.
+        **fields: Extra fields to store (e.g. the task id).
+
+    Returns:
+        dict: The updated entry.
+    """
+    entry = dict(self.entries.get(key, {'key': key, 'failures': 0}))
+    entry.update(fields, state = state, time = time.time())
+    if state == 'failed':
+      entry['failures'] += 1
+    self.entries[key] = entry
+    with open(self.path, 'a') as f:
+      f.write(json.dumps(entry) + '\n')
+    return entry
+
+  def retry_at(self, key):
+    """
+    Returns:
+        float: Time a failed job may be submitted again, None if it has used
+        up its retries.
+    """
+    entry = self.entries[key]
+    if entry['failures'] > self.max_retries:
+      return None
+    wait = self.retry_wait * self.backoff ** (entry['failures'] - 1)
+    return entry['time'] + wait
+
+  def needs_export(self, key, now = None):
+    """
+    Whether a job should be submitted: it was never submitted, or it failed,
+    has retries left and its backoff has passed.
+    """
+    state = self.state(key)
+    if state is None:
+      return True
+    if state != 'failed':
+      return False
+    retry_at = self.retry_at(key)
+    return retry_at is not None and (now or time.time()) >= retry_at
+
+  def refresh(self, backend = None):
+    """
+    Updates the jobs left in progress by an earlier run from the task list,
+    e.g. after a kernel restart. A job whose task is not on the task list (or
+    that has no task id) can never finish, so it is recorded as failed and
+    resubmitted like any other failure.
+
+    Args:
+        backend: Task backend with list_states(), defaults to
+            task_functions.EETaskBackend().
+    """
+    if backend is None:
+      import task_functions as tf
+      backend = tf.EETaskBackend()
+    states = backend.list_states()
+    for key, entry in list(self.entries.items()):
+      if entry['state'] not in IN_PROGRESS:
+        continue
+      if entry.get('id') not in states:
+        self.record(key, 'failed', error = 'task not on the task list')
+        continue
+      state = _manifest_state(states[entry['id']])
+      if state != entry['state']:
+        self.record(key, state)
+
+  def listener(self, event, job):
+    """
+    task_functions.TaskScheduler listener that records the transitions of
+    jobs submitted with a `manifest_key` tag.
+    """
+    if job.get('manifest_key') is not None:
+      self.record(job['manifest_key'], event, id = job['id'])
+
+  def summary(self):
+    """
+    Returns:
+        dict: state -> number of jobs
+    """
+    return dict(collections.Counter(e['state'] for e in self.entries.values()))
+
+
+def _manifest_state(task_state):
+  import task_functions as tf
+  if task_state in tf.DONE_STATES:
+    return 'completed'
+  if task_state in tf.FAILED_STATES:
+    return 'failed'
+  return 'running' if task_state == 'RUNNING' else 'submitted'
+
+
+def run_manifest(manifest, scheduler, jobs, sleep = time.sleep):
+  """
+  Submits the jobs the manifest is missing and waits for them, resubmitting
+  failed jobs after their backoff until they complete or run out of retries.
+  Jobs left in progress by an earlier run are refreshed from the scheduler's
+  task backend; they are not the scheduler's jobs, so the task list is polled
+  for them (every `min_wait` seconds, growing by `backoff` up to `max_wait`
+  like the scheduler's polls) until they finish too.
+
+  Args:
+      manifest (ExportManifest): The manifest.
+      scheduler (task_functions.TaskScheduler): The scheduler.
+      jobs (dict): manifest key -> function returning a new unstarted task
+          (a failed ee.batch.Task cannot be started again).
+      sleep (function): Sleep function, replaceable for dry runs.
+
+  Returns:
+      list: The keys that failed and have no retries left.
+  """
+  manifest.refresh(scheduler.backend)
+  if manifest.listener not in scheduler.listeners:
+    scheduler.add_listener(manifest.listener)
+  while True:
+    now = time.time()
+    for key, make_task in jobs.items():
+      if manifest.needs_export(key, now):
+        mission, missDate, v_date, aoi_name = key.split('|')
+        scheduler.submit(make_task(), key = key, manifest_key = key,
+          mission = mission, missDate = missDate)
+    scheduler.wait()
+    # the scheduler's jobs have finished, so jobs still in progress were
+    # started by an earlier run
+    wait = scheduler.min_wait
+    while any(manifest.state(k) in IN_PROGRESS for k in jobs):
+      sleep(wait)
+      wait = min(wait * scheduler.backoff, scheduler.max_wait)
+      manifest.refresh(scheduler.backend)
+    retries = [manifest.retry_at(k) for k in jobs if manifest.state(k) == 'failed']
+    retries = [t for t in retries if t is not None]
+    if not retries:
+      break
+    sleep(max(0, min(retries) - time.time()))
+  return [k for k in jobs if manifest.state(k) == 'failed']
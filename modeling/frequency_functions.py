@@ -0,0 +1,180 @@
+# modules
+import concurrent.futures
+import os
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import aoi_functions as aoi
+import store_functions as sf
+
+# Per-pixel class frequencies over the classified archive in a ReclassStore
+# (see store_functions.py). The store is read one spatial tile and one block
+# of dates at a time, and every tile keeps uint16 counts per group of dates
+# (all dates, calendar month or year) and class, so memory use depends on the
+# tile size and not on the number of dates. Tiles run on a process pool and
+# the counts are written into one full-grid array, a memory-mapped .npy
+# raster when count_classes() is given `out`.
+
+# 'reclass' values of the classes (classifications_to_one_band() adds 1)
+RECLASS_VALUES = {
+  '5class': {'cloud': 1, 'openWater': 2, 'lightNSSed': 3, 'OSSed': 4,
+             'dNSSed': 5},
+  '3class': {'cloud': 1, 'openWater': 2, 'sediment': 3}}
+
+SEDIMENT = {
+  '5class': ['lightNSSed', 'OSSed', 'dNSSed'],
+  '3class': ['sediment']}
+
+
+def _missdate_date(missDate):
+  # missDate is <SPACECRAFT_ID or SPACECRAFT_NAME>_<YYYY-MM-dd>
+  return missDate.rsplit('_', 1)[1]
+
+
+def time_groups(times, by = 'all'):
+  """
+  Groups the dates of a store.
+
+  Args:
+      times (list): missDates, e.g. ReclassStore.times.
+      by (str): 'all', 'month' or 'year'.
+
+  Returns:
+      tuple: (group index of every date, list of group labels)
+  """
+  if by == 'all':
+    return np.zeros(len(times), dtype = np.int64), ['all']
+  part = {'year': slice(0, 4), 'month': slice(5, 7)}[by]
+  keys = [_missdate_date(t)[part] for t in times]
+  labels = sorted(set(keys))
+  lookup = {k: i for i, k in enumerate(labels)}
+  return np.array([lookup[k] for k in keys], dtype = np.int64), labels
+
+
+def _count_tile(args):
+  store_path, window, group, n_groups, n_classes, masks_path, layer = args
+  store = sf.ReclassStore(store_path)
+  r0, r1, c0, c1 = window
+  counts = np.zeros((n_groups, n_classes, r1 - r0, c1 - c0), dtype = np.uint16)
+  values = np.arange(1, n_classes + 1, dtype = np.int8)[:, None, None]
+  if masks_path is not None:
+    # pixels outside the mask layer are never counted as classified
+    inside = aoi.PackedMasks(masks_path).mask(layer, slice(r0, r1),
+      slice(c0, c1))
+    values = np.where(inside, values, 0).astype(np.int8)
+  ct = store.chunks[0]
+  for start in range(0, len(store), ct):
+    times = list(range(start, min(start + ct, len(store))))
+    block = store.read(slice(r0, r1), slice(c0, c1), times)
+    for t, band in zip(times, block):
+      counts[group[t]] += band == values
+  return window, counts
+
+
+def count_classes(store, by = 'all', scheme = '5class', out = None,
+                  tile_size = None, n_jobs = None, masks = None,
+                  layer = 'minus_shoreline_contamination'):
+  """
+  Counts, for every pixel, how often it is in each class per group of dates.
+
+  Args:
+      store (store_functions.ReclassStore or str): The store or its directory.
+      by (str): 'all', 'month' or 'year', see time_groups().
+      scheme (str): '5class' or '3class'.
+      out (str): .npy file to write the counts to as a memory map. With None
+          the full-grid counts are held in memory: 2 bytes per group, class
+          and pixel, e.g. 12 months x 5 classes of a 10000 x 10000 grid are
+          12 GB, so pass `out` for monthly or yearly counts of large grids.
+      tile_size (int): Tile height and width, defaults to the store's chunk
+          size.
+      n_jobs (int): Number of processes, defaults to the number of CPUs; 1
+          counts in the calling process.
+      masks (aoi_functions.PackedMasks): Optional stored mask layers of the
+          store's grid; pixels outside `layer` get no counts.
+      layer (str): The mask layer, see aoi_functions.MASK_LAYERS.
+
+  Returns:
+      tuple: (uint16 counts of shape (groups, classes, rows, cols), group
+      labels, class names)
+  """
+  if isinstance(store, str):
+    store = sf.ReclassStore(store)
+  classes = list(RECLASS_VALUES[scheme])
+  if masks is not None:
+    masks.check_grid(store.meta['transform'], (store.height, store.width),
+      store.meta['crs'])
+  group, labels = time_groups(store.times, by)
+  shape = (len(labels), len(classes), store.height, store.width)
+  if out is None:
+    counts = np.zeros(shape, dtype = np.uint16)
+  else:
+    counts = np.lib.format.open_memmap(out, mode = 'w+', dtype = np.uint16,
+      shape = shape)
+  tile_size = tile_size or store.chunks[1]
+  jobs = [(store.path, (r, min(r + tile_size, store.height), c,
+    min(c + tile_size, store.width)), group, len(labels), len(classes),
+    None if masks is None else masks.path, layer)
+    for r in range(0, store.height, tile_size)
+    for c in range(0, store.width, tile_size)]
+  if n_jobs == 1:
+    results = map(_count_tile, jobs)
+    for (r0, r1, c0, c1), tile in results:
+      counts[:, :, r0:r1, c0:c1] = tile
+  else:
+    with concurrent.futures.ProcessPoolExecutor(n_jobs) as pool:
+      for (r0, r1, c0, c1), tile in pool.map(_count_tile, jobs):
+        counts[:, :, r0:r1, c0:c1] = tile
+  if out is not None:
+    counts.flush()
+  return counts, labels, classes
+
+
+def class_frequency(counts, classes, select, exclude_cloud = False):
+  """
+  Frequency rasters: how often each pixel is in the selected classes,
+  relative to the number of times it was classified.
+
+  Args:
+      counts (np.ndarray): Counts from count_classes().
+      classes (list): Class names from count_classes().
+      select (list): Class names to count, e.g. SEDIMENT['5class'].
+      exclude_cloud (bool): Count only cloud-free classifications as
+          observations.
+
+  Returns:
+      np.ndarray: float32 frequencies of shape (groups, rows, cols), NaN where
+      a pixel was never classified.
+  """
+  idx = [classes.index(c) for c in select]
+  obs_idx = [i for i, c in enumerate(classes)
+    if not (exclude_cloud and c == 'cloud')]
+  out = np.full((counts.shape[0],) + counts.shape[2:], np.nan, dtype = np.float32)
+  for g in range(counts.shape[0]):
+    selected = counts[g, idx].sum(axis = 0, dtype = np.uint32)
+    observed = counts[g, obs_idx].sum(axis = 0, dtype = np.uint32)
+    np.divide(selected, observed, out = out[g], where = observed > 0)
+  return out
+
+
+def frequency_summary(counts, labels, classes, by = 'all'):
+  """
+  Lake-wide summary per group of dates: total pixel observations per class
+  and the share of the classified observations in each class.
+
+  Returns:
+      pd.DataFrame: One row per group and class.
+  """
+  import pandas as pd
+  rows = []
+  for g, label in enumerate(labels):
+    totals = [int(counts[g, k].sum(dtype = np.uint64))
+      for k in range(len(classes))]
+    classified = sum(totals)
+    for k, name in enumerate(classes):
+      rows.append((label, name, totals[k],
+        totals[k] / float(classified) if classified else np.nan))
+  return pd.DataFrame(rows, columns = [by, 'class', 'pixel_count', 'proportion'])
@@ -1,7 +1,17 @@
 # modules
 import ee
+import os
+import sys
 import time
 
+# the notebooks load this file with imp.load_source(); its directory is added
+# to sys.path once, so the sibling modules below import by name
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import aoi_functions as aoi
+from task_functions import ACTIVE_STATES
+
 # feature collections
 aoi_ee = ee.FeatureCollection('projects/ee-ross-superior/assets/aoi/Superior_AOI_modeling')
 aoi_no_sc_ee = ee.FeatureCollection('projects/ee-ross-superior/assets/aoi/Superior_AOI_minus_shoreline_contamination')
@@ -44,6 +54,63 @@ def extract_qa_bits(qa_band, start_bit, end_bit, band_name):
     # (0 or 1 for single bit,  0-3 or 0-N for multiple bits)
     .rightShift(start_bit))
 
+# QA bit fields: (band name, start bit, end bit (not inclusive), mask at). 'mask
+# at' is the field value from which the mask_* functions mask a pixel, None for
+# fields that are only flagged. Copies of these tables are in
+# re_pull_functions.py and local_functions.py, which the notebooks load on
+# their own; tests/test_gee_functions.py checks that the copies agree.
+QA_PIXEL_SPEC = [
+  ('cirrus_conf', 14, 16, 3),
+  ('snowice_conf', 12, 14, 3),
+  ('cloudshad_conf', 10, 12, 3),
+  ('cloud_conf', 8, 10, 3),
+  ('dialated_cloud', 1, 2, None)]
+QA_AEROSOL_SPEC = [('aero_level', 6, 8, 3)]
+QA60_SPEC = [
+  ('cirrus', 11, 12, 1),
+  ('opaque', 10, 11, 1)]
+
+
+# function to decode every QA bit field in a spec at once
+def decode_qa_bits(qa_band, spec):
+  """
+  Extracts all the QA bit fields of a spec table from a QA band in one
+  expression: the QA band is shifted by a constant image holding every start
+  bit and masked by a constant image holding every field width, so the graph
+  does not grow with the number of fields.
+
+  Args:
+      qa_band (ee.Image): The earth engine image QA band to extract the bits from.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      ee.Image: One band per field, named as in the spec.
+  """
+  return (qa_band
+    .select([0])
+    .rightShift(ee.Image.constant([f[1] for f in spec]))
+    .bitwiseAnd(ee.Image.constant([(1 << (f[2] - f[1])) - 1 for f in spec]))
+    .rename([f[0] for f in spec]))
+
+
+# function to make a mask from every maskable QA bit field in a spec
+def qa_mask(qa_band, spec):
+  """
+  Builds a mask that is 1 where every field of the spec with a 'mask at' value
+  is below that value.
+
+  Args:
+      qa_band (ee.Image): The earth engine image QA band.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      ee.Image: A single band 1/0 mask.
+  """
+  fields = [f for f in spec if f[3] is not None]
+  return (decode_qa_bits(qa_band, fields)
+    .lt(ee.Image.constant([f[3] for f in fields]))
+    .reduce(ee.Reducer.min()))
+
 
 ## Remove geometries
 def remove_geo(image):
@@ -58,25 +125,27 @@ def remove_geo(image):
   return image.setGeometry(None)
 
 
+def count_active_tasks():
+  """ Counts the tasks on the account that are queued or running, using the
+  structured 'state' field of the task list.
+
+  Returns:
+      int: number of active tasks
+  """
+  return sum(1 for t in ee.data.getTaskList() if t['state'] in ACTIVE_STATES)
+
+
 ##Function for limiting the max number of tasks sent to
-#earth engine at one time to avoid time out errors
+#earth engine at one time to avoid time out errors. For whole export loops,
+#task_functions.TaskScheduler queues the tasks and starts them as slots free up.
 def maximum_no_of_tasks(MaxNActive, waitingPeriod):
   ##maintain a maximum number of active tasks
-  ## initialize submitting jobs
-  ts = list(ee.batch.Task.list())
-  NActive = 0
-  for task in ts:
-     if ('RUNNING' in str(task) or 'READY' in str(task)):
-         NActive += 1
+  NActive = count_active_tasks()
   ## wait if the number of current active tasks reach the maximum number
   ## defined in MaxNActive
   while (NActive >= MaxNActive):
-    time.sleep(waitingPeriod) # if reach or over maximum no. of active tasks, wait for 2min and check again
-    ts = list(ee.batch.Task.list())
-    NActive = 0
-    for task in ts:
-      if ('RUNNING' in str(task) or 'READY' in str(task)):
-        NActive += 1
+    time.sleep(waitingPeriod) # if reach or over maximum no. of active tasks, wait and check again
+    NActive = count_active_tasks()
   return()
 
 
@@ -126,8 +195,8 @@ def extract_3classes(image):
   return img_addBand
 
 
-def classifications_to_one_band(image):
-  cl = image.select('classification').clip(aoi_ee.geometry())
+def classifications_to_one_band(image, scale = 30):
+  cl = aoi.clip(image.select('classification'), 'modeling', scale)
   img_classified = (cl
     .remap(fromlist, tolist, defaultValue = -99)
     .rename('reclass'))
@@ -141,9 +210,67 @@ def calc_area(feat):
   return feat.set('area_ha', feat_area_ha)
 
 
-# clip images to aoi
-def clip(image):
-  return image.clip(aoi_ee.geometry())
+# clip images to aoi (the cached, simplified geometry of the AOI registry)
+def clip(image, scale = 30):
+  return aoi.clip(image, 'modeling', scale)
+
+
+# count the pixels of each class value in the single 'classification' band
+def class_histogram(image, geometry = None, scale = 30, band = 'classification',
+                    codes = None, layer = 'minus_shoreline_contamination'):
+  """
+  Counts the pixels of every class in one frequency histogram reduction of the
+  single class band, instead of one self-masked band per class as made by
+  extract_classes() and extract_3classes().
+
+  Args:
+      image (ee.Image): Image with the class band.
+      geometry (ee.Geometry): Region to count in, defaults to the modeling AOI.
+      scale (int): Pixel size in meters (30 for Landsat, 10 for Sentinel 2).
+      band (str): The class band, 'classification' (0-based) or 'reclass'.
+      codes (ee.Image or str): Optional layer code image (or asset ID) of
+          aoi_functions.ee_layer_codes(); only pixels in `layer` are counted.
+      layer (str): The mask layer, see aoi_functions.MASK_LAYERS.
+
+  Returns:
+      ee.Dictionary: class value (as a string) -> pixel count
+  """
+  if codes is not None:
+    image = aoi.ee_layer_mask(image, codes, layer)
+  if geometry is None:
+    geometry = aoi.get_registry().ee_geometry('modeling', scale)
+  # unclassified pixels ('reclass' -99) are not counted
+  cl = image.select(band)
+  cl = cl.updateMask(cl.gte(0))
+  # unweighted, so pixels partly inside the geometry count as whole pixels
+  hist = cl.reduceRegion(
+    reducer = ee.Reducer.frequencyHistogram().unweighted(),
+    geometry = geometry,
+    scale = scale,
+    maxPixels = 1e13)
+  return ee.Dictionary(hist.get(band))
+
+
+def class_histograms(collection, geometry = None, scale = 30,
+                     band = 'classification', codes = None,
+                     layer = 'minus_shoreline_contamination'):
+  """
+  Class histograms of every image of a collection, keyed by missDate, so all
+  dates come back in a single getInfo() call.
+
+  Args:
+      collection (ee.ImageCollection): Images with a 'missDate' property, one
+          per missDate (e.g. the mosaics of applyPerMissionDate_*).
+      geometry, scale, band, codes, layer: See class_histogram().
+
+  Returns:
+      ee.Dictionary: missDate -> class histogram
+  """
+  hists = collection.map(lambda image: ee.Feature(None, {
+    'missDate': image.get('missDate'),
+    'hist': class_histogram(image, geometry, scale, band, codes, layer)}))
+  return ee.Dictionary.fromLists(hists.aggregate_array('missDate'),
+    hists.aggregate_array('hist'))
 
 
 ####--------------------------####
@@ -269,31 +396,13 @@ def flag_qa_conf(image):
       is high, except dialated cloud which is 0 none, 1 present
   """
   qa = image.select('QA_PIXEL')
-  # where cirrus confidence is high
-  cirrus_conf = extract_qa_bits(qa, 14, 16, 'cirrus_conf')
-  snowice_conf = extract_qa_bits(qa, 12, 14, 'snowice_conf')
-  cloudshad_conf = extract_qa_bits(qa, 10, 12, 'cloudshad_conf')
-  cloud_conf = extract_qa_bits(qa, 8, 10, 'cloud_conf')
-  dialated = extract_qa_bits(qa, 1, 2, 'dialated_cloud')
-  return (image
-    .addBands(cirrus_conf)
-    .addBands(snowice_conf)
-    .addBands(cloudshad_conf)
-    .addBands(cloud_conf)
-    .addBands(dialated))
+  # cirrus, snow/ice, cloud shadow and cloud confidence and dilated cloud
+  return image.addBands(decode_qa_bits(qa, QA_PIXEL_SPEC))
     
 def mask_qa_flags(image):
   qa = image.select('QA_PIXEL')
-  # where qa confidence is high
-  cirrus_conf = extract_qa_bits(qa, 14, 16, 'cirrus_conf').eq(3)
-  snowice_conf = extract_qa_bits(qa, 12, 14, 'snowice_conf').eq(3)
-  cloudshad_conf = extract_qa_bits(qa, 10, 12, 'cloudshad_conf').eq(3)
-  cloud_conf = extract_qa_bits(qa, 8, 10, 'cloud_conf').eq(3)
-  # create a mask where the qa is not high
-  mask = (cirrus_conf.eq(0)
-    .And(snowice_conf.eq(0))
-    .And(cloudshad_conf.eq(0))
-    .And(cloud_conf.eq(0)))
+  # create a mask where the qa confidence is not high
+  mask = qa_mask(qa, QA_PIXEL_SPEC)
   return (image.updateMask(mask))
 
 
@@ -314,8 +423,7 @@ def mask_high_atmos_opac(image):
 # function to mask high aerosol pixels
 def mask_high_aerosol(image):
   qa_aero = image.select("SR_QA_AEROSOL")
-  aero = extract_qa_bits(qa_aero, 6, 8, 'aero_level')
-  aero_mask = aero.lt(3)
+  aero_mask = qa_mask(qa_aero, QA_AEROSOL_SPEC)
   return image.updateMask(aero_mask)
  
 
@@ -454,10 +562,8 @@ def flag_cirrus_opaque(image):
       ee.Image: The image with the to add a cirrus flag to.
   """
   qa = image.select('QA60')
-  # where cirrus confidence is high
-  cirrus = extract_qa_bits(qa, 11, 12, 'cirrus')
-  opaque = extract_qa_bits(qa, 10, 11, 'opaque')
-  return image.addBands(cirrus).addBands(opaque)
+  # cirrus and opaque cloud presence
+  return image.addBands(decode_qa_bits(qa, QA60_SPEC))
 
 
 def mask_cirrus_opaque(image):
@@ -472,13 +578,70 @@ def mask_cirrus_opaque(image):
       ee.Image: The image with pixels masked
   """
   qa = image.select('QA60')
-  # where cirrus confidence is high
-  cirrus = extract_qa_bits(qa, 11, 12, 'cirrus')
-  opaque = extract_qa_bits(qa, 10, 11, 'opaque')
-  mask = (cirrus.eq(0)
-    .And(opaque.eq(0)))
+  # where neither cirrus nor opaque clouds are present
+  mask = qa_mask(qa, QA60_SPEC)
   return image.updateMask(mask)
 
 
+####--------------------------####
+#### sensor harmonization     ####
+####--------------------------####
+
+def applyHarmonization(image, harmonization):
+  """
+  Maps the optical bands of an image onto the reference bands with a linear
+  transform from harmonize_functions.py, after applyScaleFactors or
+  applyScaleFactors_S2. A per-band fit is one multiply and add of constant
+  images, a full matrix one array matrix multiply.
+
+  Args:
+      image (ee.Image): The scaled earth engine image.
+      harmonization (Harmonization): The transform, with bands_in, bands_out,
+          matrix and offset.
+
+  Returns:
+      ee.Image: The image with the input bands replaced by the harmonized bands.
+  """
+  bands_in = harmonization.bands_in
+  bands_out = harmonization.bands_out
+  matrix = [list(map(float, row)) for row in harmonization.matrix]
+  offset = [float(v) for v in harmonization.offset]
+  optical = image.select(bands_in)
+  if harmonization.is_diagonal:
+    harmonized = (optical
+      .multiply(ee.Image.constant([matrix[i][i] for i in range(len(matrix))]))
+      .add(ee.Image.constant(offset)))
+  else:
+    harmonized = (ee.Image(ee.Array(matrix))
+      .matrixMultiply(optical.toArray().toArray(1))
+      .add(ee.Image(ee.Array([[v] for v in offset])))
+      .arrayProject([0])
+      .arrayFlatten([bands_out]))
+  keep = image.bandNames().removeAll(bands_in).removeAll(bands_out)
+  return (image
+    .select(keep)
+    .addBands(harmonized.rename(bands_out)))
+
 
+def harmonization_stage(harmonization):
+  """
+  Returns applyHarmonization as a one-argument function for
+  ImageCollection.map().
+  """
+  return lambda image: applyHarmonization(image, harmonization)
 
+
+def sample_pixel_pairs(src, ref, src_bands, ref_bands, region, scale = 30,
+                       numPixels = 5000, seed = 47):
+  """
+  Samples paired pixels of two scaled images from overlapping dates, for
+  fitting a harmonization (see harmonize_functions.pairs_from_table()).
+
+  Returns:
+      ee.FeatureCollection: One feature per pixel with 'src_' and 'ref_'
+      prefixed band values.
+  """
+  return (src.select(src_bands, ['src_' + b for b in src_bands])
+    .addBands(ref.select(ref_bands, ['ref_' + b for b in ref_bands]))
+    .sample(region = region, scale = scale, numPixels = numPixels,
+      seed = seed, dropNulls = True, geometries = False))
@@ -0,0 +1,743 @@
+# modules
+import concurrent.futures
+import heapq
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Local gradient tree boosting that mirrors the
+# ee.Classifier.smileGradientTreeBoost(numberOfTrees = 10, seed = 47) models of
+# the 09_-13_*_GTB.Rmd scripts, trained on the label tables in data/labels/.
+# Like smile, each boosting round fits one least-squares regression tree per
+# class to the softmax residuals on a 70% subsample, starts from zero scores
+# and uses Friedman's leaf values. Splits are searched on per-feature
+# histograms of binned feature values.
+
+v_date = '2024-04-26'
+
+# outputs of the local models are kept apart from the committed
+# data/output/GTB_* tables of the GEE models
+LOCAL_OUT_DIR = 'data/output/local'
+
+# default depth limit of smile's GradientTreeBoost; ee_tree_strings() numbers
+# nodes like rpart (2n, 2n + 1), which fits an int32 up to depth 30
+MAX_DEPTH = 20
+EE_MAX_DEPTH = 30
+
+# class order of the GTB scripts (0-4 and 0-2 'byte_property')
+CLASS_VALUES = {
+  '5class': ['cloud', 'openWater', 'lightNearShoreSediment', 'offShoreSediment',
+             'darkNearShoreSediment'],
+  '3class': ['cloud', 'openWater', 'sediment']}
+
+ls57_input_feat = ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7']
+ls89_input_feat = ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7']
+sen_input_feat = ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7', 'SR_B8',
+                  'SR_B8A', 'SR_B11', 'SR_B12']
+
+# per mission: label file group, mission value in the label tables, input
+# features, name in the output tables, and the short names used in the
+# training/test confusion file names and the stats/importance file names
+MISSIONS = {
+  'LS5': {'labels': 'LS5_LS7', 'mission': 'LS5', 'features': ls57_input_feat,
+          'name': 'Landsat 5', 'train': 'l5', 'test': 'l5', 'stats': 'LS5'},
+  'LS7': {'labels': 'LS5_LS7', 'mission': 'LS7', 'features': ls57_input_feat,
+          'name': 'Landsat 7', 'train': 'l7', 'test': 'L7', 'stats': 'LS7'},
+  'LS8': {'labels': 'LS8_LS9', 'mission': 'LS8', 'features': ls89_input_feat,
+          'name': 'Landsat 8', 'train': 'l8', 'test': 'L8', 'stats': 'LS8'},
+  'LS9': {'labels': 'LS8_LS9', 'mission': 'LS9', 'features': ls89_input_feat,
+          'name': 'Landsat 9', 'train': 'l9', 'test': 'l9', 'stats': 'LS9'},
+  'S2': {'labels': 'SEN2', 'mission': 'SEN2', 'features': sen_input_feat,
+         'name': 'Sentinel 2', 'train': 'sen2', 'test': 'Sen2', 'stats': 'Sen2'}}
+
+# LS9 only has one image date with every class, which is held out for
+# validation (see 08_Train_Test_Split.Rmd)
+fixed_validation_dates = {'LS9': ['2022-05-21']}
+
+
+####--------------------------####
+#### label data               ####
+####--------------------------####
+
+def load_labels(mission, scheme = '5class', label_dir = 'data/labels',
+                label_date = '2024-04-25'):
+  """
+  Reads the labels of one mission from the collated label tables with the
+  additional band data, keeping the classes of the class scheme and the rows
+  with complete input features.
+
+  Args:
+      mission (str): 'LS5', 'LS7', 'LS8', 'LS9' or 'S2'.
+      scheme (str): '5class' or '3class'. For '3class' all sediment classes
+          become 'sediment', as in 08_Train_Test_Split_3class.Rmd.
+      label_dir (str): Directory of the label tables.
+      label_date (str): Version date of the label tables.
+
+  Returns:
+      pd.DataFrame: The labels, with a 0-based 'byte_property' class column.
+  """
+  info = MISSIONS[mission]
+  path = os.path.join(label_dir, 'collated_labels_with_additional_data_' +
+    info['labels'] + '_v' + label_date + '.csv')
+  labels = pd.read_csv(path)
+  labels = labels[labels['mission'] == info['mission']].copy()
+  if scheme == '3class':
+    is_sed = labels['class'].str.contains('sediment', case = False)
+    labels.loc[is_sed, 'class'] = 'sediment'
+  classes = CLASS_VALUES[scheme]
+  labels = labels[labels['class'].isin(classes)].dropna(subset = info['features'])
+  labels['byte_property'] = labels['class'].map(
+    {c: i for i, c in enumerate(classes)}).astype(np.uint8)
+  return labels.reset_index(drop = True)
+
+
+def split_by_date(labels, mission, train_frac = 0.7, seed = 47):
+  """
+  Splits labels into training and validation sets by image date, sampling
+  about 70% of the dates for training as in 08_Train_Test_Split.Rmd. The
+  number of training dates (round(dates * 0.7), ties to even in both R and
+  Python) and the fixed LS9 validation date are the same as in R, but the
+  sampled dates are not:
+    - R draws every mission from one set.seed(12) stream with sample(),
+      this function seeds a NumPy generator per mission;
+    - R samples from the dates in table order, this function from the sorted
+      dates;
+    - R takes the validation set as anti_join(all labels, training labels) on
+      every column, which also drops validation rows identical to a training
+      row; here every label of a validation date is kept.
+  To reproduce the models of the notebooks, train on their exported
+  training/validation tables instead.
+
+  Args:
+      labels (pd.DataFrame): The labels, with a 'date' column.
+      mission (str): The mission, used for fixed validation dates.
+      train_frac (float): Fraction of dates used for training.
+      seed (int): Random seed of the date sample.
+
+  Returns:
+      tuple: (training labels, validation labels)
+  """
+  dates = np.sort(labels['date'].unique())
+  if mission in fixed_validation_dates:
+    val_dates = fixed_validation_dates[mission]
+  else:
+    rng = np.random.default_rng(seed)
+    n_train = int(round(len(dates) * train_frac))
+    train_dates = rng.choice(dates, n_train, replace = False)
+    val_dates = np.setdiff1d(dates, train_dates)
+  is_val = labels['date'].isin(val_dates)
+  return (labels[~is_val].reset_index(drop = True),
+    labels[is_val].reset_index(drop = True))
+
+
+####--------------------------####
+#### model                    ####
+####--------------------------####
+
+class GTBModel(object):
+  """
+  A trained multi-class tree ensemble. All trees share flat node arrays: for
+  node i, `feature[i]` is the split feature (-1 for a leaf), samples with
+  x <= `threshold[i]` go to node `left[i]`, others to `right[i]`, and leaves
+  hold `value[i]`. Tree t starts at node `tree_start[t]` and adds to the score
+  of class `tree_class[t]`; the class is the argmax of
+  init + shrinkage * (sum of the leaf values of its trees). `count[i]` is the
+  number of training samples that reached node i.
+  """
+
+  def __init__(self, features, classes, init, shrinkage, feature, threshold,
+               left, right, value, tree_start, tree_class, importance = None,
+               count = None, meta = None):
+    self.features = list(features)
+    self.classes = list(classes)
+    self.init = np.asarray(init, dtype = np.float64)
+    self.shrinkage = float(shrinkage)
+    self.feature = np.asarray(feature, dtype = np.int16)
+    self.threshold = np.asarray(threshold, dtype = np.float64)
+    self.left = np.asarray(left, dtype = np.int32)
+    self.right = np.asarray(right, dtype = np.int32)
+    self.value = np.asarray(value, dtype = np.float64)
+    self.tree_start = np.asarray(tree_start, dtype = np.int32)
+    self.tree_class = np.asarray(tree_class, dtype = np.int16)
+    self.importance = (np.zeros(len(self.features)) if importance is None
+      else np.asarray(importance, dtype = np.float64))
+    self.count = (np.zeros(len(self.feature), dtype = np.int32) if count is None
+      else np.asarray(count, dtype = np.int32))
+    self.meta = dict(meta or {})
+
+  @property
+  def n_trees(self):
+    return len(self.tree_start)
+
+  def depth(self):
+    """
+    Returns:
+        int: The number of splits on the longest root-to-leaf path.
+    """
+    depth = np.zeros(len(self.feature), dtype = np.int32)
+    for i in range(len(self.feature)):
+      if self.feature[i] >= 0:
+        depth[self.left[i]] = depth[i] + 1
+        depth[self.right[i]] = depth[i] + 1
+    return int(depth.max()) if len(depth) else 0
+
+  def leaf_index(self, X):
+    """
+    Finds the leaf reached in every tree by every sample, traversing all trees
+    at once, one tree level per step. Pairs that reached a leaf drop out of
+    the following steps.
+
+    Args:
+        X (np.ndarray): (n samples, n features) array, columns in the order
+            of self.features.
+
+    Returns:
+        np.ndarray: (n samples, n trees) node indices of the leaves.
+    """
+    X = np.asarray(X, dtype = np.float64)
+    n = X.shape[0]
+    node = np.tile(self.tree_start, n)
+    sample = np.repeat(np.arange(n), self.n_trees)
+    active = np.flatnonzero(self.feature[node] >= 0)
+    while active.size:
+      current = node[active]
+      go_left = (X[sample[active], self.feature[current]] <=
+        self.threshold[current])
+      current = np.where(go_left, self.left[current], self.right[current])
+      node[active] = current
+      active = active[self.feature[current] >= 0]
+    return node.reshape(n, self.n_trees)
+
+  def predict_scores(self, X):
+    """
+    Returns:
+        np.ndarray: (n samples, n classes) boosting scores.
+    """
+    leaf_values = self.value[self.leaf_index(X)]
+    scores = np.zeros((leaf_values.shape[0], len(self.classes)))
+    for k in range(len(self.classes)):
+      scores[:, k] = leaf_values[:, self.tree_class == k].sum(axis = 1)
+    return self.init + self.shrinkage * scores
+
+  def predict(self, X):
+    """
+    Returns:
+        np.ndarray: uint8 0-based class of every sample ('classification').
+    """
+    return np.argmax(self.predict_scores(X), axis = 1).astype(np.uint8)
+
+
+def _bin_features(X, max_bins):
+  # cut points between distinct values, at most max_bins - 1 of them per feature
+  cuts = []
+  codes = np.empty(X.shape, dtype = np.uint8)
+  for j in range(X.shape[1]):
+    values = np.unique(X[:, j])
+    if len(values) > max_bins:
+      values = np.unique(np.quantile(X[:, j], np.linspace(0, 1, max_bins)))
+    c = (values[:-1] + values[1:]) / 2
+    cuts.append(c)
+    codes[:, j] = np.searchsorted(c, X[:, j], side = 'left')
+  return codes, cuts
+
+
+def _grow_tree(codes, cuts, residual, rows, n_classes, max_nodes, min_leaf,
+               nodes, max_depth = None):
+  """
+  Grows one least-squares regression tree on the residuals of the sampled
+  rows, best split first, appending its nodes to the `nodes` lists.
+
+  Returns:
+      tuple: (index of the root node, feature -> summed split gain)
+  """
+  n_features = codes.shape[1]
+  n_bins = 256
+  offsets = np.arange(n_features) * n_bins
+  gains = np.zeros(n_features)
+
+  def leaf_value(r):
+    denom = np.sum(np.abs(r) * (1 - np.abs(r)))
+    if denom < 1e-12:
+      return 0.0
+    return (n_classes - 1.0) / n_classes * r.sum() / denom
+
+  def new_node(r):
+    nodes['count'].append(len(r))
+    nodes['feature'].append(-1)
+    nodes['threshold'].append(0.0)
+    nodes['left'].append(-1)
+    nodes['right'].append(-1)
+    nodes['value'].append(leaf_value(r))
+    return len(nodes['feature']) - 1
+
+  def best_split(node_rows):
+    r = residual[node_rows]
+    n = len(node_rows)
+    if n < 2 * min_leaf:
+      return None
+    # one bincount gives the histograms of every feature
+    c = (codes[node_rows] + offsets).ravel()
+    hist_r = np.bincount(c, weights = np.repeat(r, n_features),
+      minlength = n_features * n_bins).reshape(n_features, n_bins)
+    hist_n = np.bincount(c, minlength = n_features * n_bins).reshape(
+      n_features, n_bins)
+    sum_l = np.cumsum(hist_r, axis = 1)[:, :-1]
+    n_l = np.cumsum(hist_n, axis = 1)[:, :-1]
+    sum_r = r.sum() - sum_l
+    n_r = n - n_l
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      gain = sum_l ** 2 / n_l + sum_r ** 2 / n_r - r.sum() ** 2 / n
+    gain[(n_l < min_leaf) | (n_r < min_leaf)] = -np.inf
+    for j in range(n_features):
+      gain[j, len(cuts[j]):] = -np.inf
+    j, b = np.unravel_index(np.argmax(gain), gain.shape)
+    if not np.isfinite(gain[j, b]) or gain[j, b] <= 1e-12:
+      return None
+    return gain[j, b], j, b
+
+  root = new_node(residual[rows])
+  heap = []
+  counter = 0
+  split = best_split(rows) if max_depth is None or max_depth > 0 else None
+  if split is not None:
+    heapq.heappush(heap, (-split[0], counter, root, rows, 0, split))
+  n_leaves = 1
+  while heap and (max_nodes is None or n_leaves < max_nodes):
+    _, _, node, node_rows, depth, (gain, j, b) = heapq.heappop(heap)
+    go_left = codes[node_rows, j] <= b
+    children = []
+    for child_rows in (node_rows[go_left], node_rows[~go_left]):
+      child = new_node(residual[child_rows])
+      children.append(child)
+      if max_depth is not None and depth + 1 >= max_depth:
+        continue
+      child_split = best_split(child_rows)
+      if child_split is not None:
+        counter += 1
+        heapq.heappush(heap, (-child_split[0], counter, child, child_rows,
+          depth + 1, child_split))
+    nodes['feature'][node] = j
+    nodes['threshold'][node] = cuts[j][b]
+    nodes['left'][node], nodes['right'][node] = children
+    gains[j] += gain
+    n_leaves += 1
+  return root, gains
+
+
+def train_gtb(X, y, features, classes, n_trees = 10, shrinkage = 0.005,
+              sampling_rate = 0.7, max_nodes = None, min_leaf = 5,
+              max_depth = MAX_DEPTH, max_bins = 256, seed = 47):
+  """
+  Trains a gradient tree boosting classifier with the defaults of
+  ee.Classifier.smileGradientTreeBoost.
+
+  Args:
+      X (np.ndarray): (n samples, n features) input features.
+      y (np.ndarray): 0-based class of every sample.
+      features (list): Feature names, in column order.
+      classes (list): Class names, in class number order.
+      n_trees (int): Number of boosting rounds (numberOfTrees).
+      shrinkage (float): Learning rate.
+      sampling_rate (float): Fraction of rows sampled in each round.
+      max_nodes (int): Maximum number of leaves per tree, None for no limit.
+      min_leaf (int): Minimum number of samples in a leaf.
+      max_depth (int): Maximum number of splits on a root-to-leaf path, None
+          for no limit; at most EE_MAX_DEPTH for ee_classify().
+      max_bins (int): Maximum number of histogram bins per feature (<= 256).
+      seed (int): Random seed.
+
+  Returns:
+      GTBModel: The trained model.
+  """
+  X = np.asarray(X, dtype = np.float64)
+  y = np.asarray(y)
+  n, n_classes = X.shape[0], len(classes)
+  codes, cuts = _bin_features(X, min(max_bins, 256))
+  onehot = np.eye(n_classes)[y]
+  scores = np.zeros((n, n_classes))
+  rng = np.random.default_rng(seed)
+  nodes = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'value': [],
+    'count': []}
+  tree_start, tree_class = [], []
+  importance = np.zeros(X.shape[1])
+  for _ in range(n_trees):
+    p = np.exp(scores - scores.max(axis = 1, keepdims = True))
+    p /= p.sum(axis = 1, keepdims = True)
+    rows = np.sort(rng.choice(n, int(round(n * sampling_rate)), replace = False))
+    for k in range(n_classes):
+      first = len(nodes['feature'])
+      root, gains = _grow_tree(codes, cuts, onehot[:, k] - p[:, k], rows,
+        n_classes, max_nodes, min_leaf, nodes, max_depth)
+      importance += gains
+      tree_start.append(root)
+      tree_class.append(k)
+      # update the scores of every row from this tree's leaves
+      tree = GTBModel(features, classes, np.zeros(n_classes), 1,
+        nodes['feature'][first:], nodes['threshold'][first:],
+        np.array(nodes['left'][first:]) - first,
+        np.array(nodes['right'][first:]) - first,
+        nodes['value'][first:], [root - first], [0])
+      scores[:, k] += shrinkage * tree.value[tree.leaf_index(X)[:, 0]]
+  return GTBModel(features, classes, np.zeros(n_classes), shrinkage,
+    nodes['feature'], nodes['threshold'], nodes['left'], nodes['right'],
+    nodes['value'], tree_start, tree_class, importance, nodes['count'])
+
+
+####--------------------------####
+#### evaluation and outputs   ####
+####--------------------------####
+
+def error_matrix(actual, predicted, n_classes):
+  """
+  Confusion matrix with actual classes as rows and predicted classes as
+  columns, like ee.FeatureCollection.errorMatrix().
+  """
+  return np.bincount(np.asarray(actual, dtype = np.int64) * n_classes +
+    np.asarray(predicted, dtype = np.int64),
+    minlength = n_classes ** 2).reshape(n_classes, n_classes)
+
+
+def accuracy_stats(matrix):
+  """
+  Per-class F-score, overall accuracy and kappa of a confusion matrix, as from
+  ee.ConfusionMatrix.fscore(), accuracy() and kappa().
+
+  Returns:
+      tuple: (list of F-scores, accuracy, kappa)
+  """
+  m = np.asarray(matrix, dtype = np.float64)
+  total = m.sum()
+  correct = np.diag(m)
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    precision = np.where(m.sum(axis = 0) > 0, correct / m.sum(axis = 0), 0)
+    recall = np.where(m.sum(axis = 1) > 0, correct / m.sum(axis = 1), 0)
+    fscore = np.where(precision + recall > 0,
+      2 * precision * recall / (precision + recall), 0)
+  accuracy = correct.sum() / total
+  expected = (m.sum(axis = 0) * m.sum(axis = 1)).sum() / total ** 2
+  kappa = (accuracy - expected) / (1 - expected)
+  return list(fscore), float(accuracy), float(kappa)
+
+
+def confusion_table(matrix, classes, mission_name):
+  """
+  Formats a confusion matrix like the data/output/GTB_*_confusion.csv files.
+  """
+  table = pd.DataFrame(matrix, index = classes, columns = classes)
+  table['mission'] = mission_name
+  table.index.name = 'class'
+  return table.reset_index()
+
+
+def performance_table(fscore, accuracy, kappa, classes, mission_name):
+  """
+  Formats model stats like the data/output/GTB_*_performance_stats.csv files.
+  """
+  columns = ['satellite'] + list(classes) + ['GTB_accuracy', 'GTB_kappa']
+  return pd.DataFrame([[mission_name] + list(fscore) + [accuracy, kappa]],
+    columns = columns)
+
+
+def importance_table(model):
+  """
+  Formats the summed split gains like the
+  data/output/GTB_*_variable_importance_*.csv files, sorted descending.
+  """
+  table = pd.DataFrame({'Band': model.features,
+    'Feature_Importance': model.importance})
+  return table.sort_values('Feature_Importance', ascending = False)
+
+
+def output_paths(mission, scheme = '5class', version = v_date,
+                 out_dir = LOCAL_OUT_DIR):
+  """
+  File paths of the outputs of one model, following the names the GTB scripts
+  use.
+
+  Returns:
+      dict: 'training', 'confusion', 'performance' and 'importance' paths.
+  """
+  info = MISSIONS[mission]
+  prefix = 'GTB_' if scheme == '5class' else 'GTB_3class_'
+  return {
+    'training': os.path.join(out_dir, prefix + version + '_' + info['train'] +
+      '_training_confusion.csv'),
+    'confusion': os.path.join(out_dir, prefix + version + '_' + info['test'] +
+      '_confusion.csv'),
+    'performance': os.path.join(out_dir, prefix + info['stats'] + '_' + version +
+      '_performance_stats.csv'),
+    'importance': os.path.join(out_dir, prefix + info['stats'] +
+      '_variable_importance_' + version + '.csv')}
+
+
+def check_outputs(paths):
+  """
+  Raises FileExistsError if any of the output files exists.
+  """
+  existing = [path for path in paths if os.path.exists(path)]
+  if existing:
+    raise FileExistsError('Output files exist, pass overwrite = True to ' +
+      'replace them: ' + ', '.join(existing))
+
+
+def write_tables(tables, paths, overwrite = False):
+  """
+  Writes output tables as CSV, e.g. to the output_paths() of a model.
+
+  Args:
+      tables (dict): key -> DataFrame.
+      paths (dict): key -> file path.
+      overwrite (bool): Replace existing files; otherwise nothing is written
+          if any of the files exists.
+  """
+  if not overwrite:
+    check_outputs(paths.values())
+  for key, path in paths.items():
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path), exist_ok = True)
+    tables[key].to_csv(path, index = False)
+
+
+def train_mission(mission, scheme = '5class', version = v_date,
+                  out_dir = LOCAL_OUT_DIR, labels = None, model_dir = None,
+                  overwrite = False, **params):
+  """
+  Trains, evaluates and writes the outputs of one mission and class scheme.
+
+  Args:
+      mission (str): 'LS5', 'LS7', 'LS8', 'LS9' or 'S2'.
+      scheme (str): '5class' or '3class'.
+      version (str): Model version date used in the file names.
+      out_dir (str): Output directory, None to skip writing.
+      labels (tuple): Optional (training, validation) DataFrames, e.g. the
+          filtered labels of 08_Train_Test_Split.Rmd; by default the label
+          tables are read and split by date.
+      model_dir (str): Directory to save the model in (see save_model()),
+          None to skip saving.
+      overwrite (bool): Replace existing output files, see write_tables().
+      **params: Passed to train_gtb().
+
+  Returns:
+      tuple: (GTBModel, dict of output tables)
+  """
+  info = MISSIONS[mission]
+  classes = CLASS_VALUES[scheme]
+  if labels is None:
+    labels = split_by_date(load_labels(mission, scheme), mission)
+  train, test = labels
+  model = train_gtb(train[info['features']].values, train['byte_property'].values,
+    info['features'], classes, **params)
+  model.meta.update({'mission': mission, 'scheme': scheme, 'v_date': version})
+  training_matrix = error_matrix(train['byte_property'].values,
+    model.predict(train[info['features']].values), len(classes))
+  test_matrix = error_matrix(test['byte_property'].values,
+    model.predict(test[info['features']].values), len(classes))
+  tables = {
+    'training': confusion_table(training_matrix, classes, info['name']),
+    'confusion': confusion_table(test_matrix, classes, info['name']),
+    'performance': performance_table(*accuracy_stats(test_matrix),
+      classes = classes, mission_name = info['name']),
+    'importance': importance_table(model)}
+  if out_dir is not None:
+    write_tables(tables, output_paths(mission, scheme, version, out_dir),
+      overwrite)
+  if model_dir is not None:
+    save_model(model, model_dir = model_dir)
+  return model, tables
+
+
+def _train_one(args):
+  mission, scheme, version, out_dir, model_dir, overwrite, params = args
+  return train_mission(mission, scheme, version, out_dir,
+    model_dir = model_dir, overwrite = overwrite, **params)
+
+
+def train_all(missions = None, schemes = ('5class', '3class'), version = v_date,
+              out_dir = LOCAL_OUT_DIR, model_dir = None, n_jobs = None,
+              overwrite = False, **params):
+  """
+  Trains every mission and class scheme in parallel processes.
+
+  Args:
+      missions (list): Missions to train, defaults to all five.
+      schemes (list): Class schemes to train.
+      version (str): Model version date used in the file names.
+      out_dir (str): Output directory, None to skip writing.
+      model_dir (str): Directory to save the models in, None to skip saving.
+      n_jobs (int): Number of processes, defaults to the number of CPUs.
+      overwrite (bool): Replace existing output files, see write_tables().
+      **params: Passed to train_gtb().
+
+  Returns:
+      dict: (mission, scheme) -> GTBModel
+  """
+  jobs = [(m, s, version, out_dir, model_dir, overwrite, params)
+    for m in (missions or list(MISSIONS)) for s in schemes]
+  if out_dir is not None and not overwrite:
+    # fail before training anything
+    check_outputs([path for job in jobs
+      for path in output_paths(job[0], job[1], version, out_dir).values()])
+  with concurrent.futures.ProcessPoolExecutor(n_jobs) as pool:
+    results = list(pool.map(_train_one, jobs))
+  return {(job[0], job[1]): result[0] for job, result in zip(jobs, results)}
+
+
+####--------------------------####
+#### model artifacts          ####
+####--------------------------####
+
+# arrays of a saved model, one .npy file each, next to a model.json with the
+# feature and class names, init scores, shrinkage and metadata
+ARTIFACT_ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'count',
+                   'tree_start', 'tree_class', 'importance', 'init')
+ARTIFACT_FORMAT = 1
+
+
+def model_path(mission, scheme = '5class', version = v_date,
+               model_dir = 'data/models'):
+  """
+  Directory of the saved model of one mission, class scheme and version,
+  named like the GTB output files (e.g. data/models/GTB_3class_LS5_v2024-04-26).
+  """
+  prefix = 'GTB_' if scheme == '5class' else 'GTB_3class_'
+  return os.path.join(model_dir, prefix + mission + '_v' + version)
+
+
+def save_model(model, path = None, model_dir = 'data/models'):
+  """
+  Saves a model as a directory of flat .npy arrays and a model.json.
+
+  Args:
+      model (GTBModel): The model, with 'mission', 'scheme' and 'v_date' in
+          model.meta unless `path` is given.
+      path (str): Target directory, defaults to model_path() of the model.
+      model_dir (str): Parent directory used for the default path.
+
+  Returns:
+      str: The model directory.
+  """
+  if path is None:
+    path = model_path(model.meta['mission'], model.meta['scheme'],
+      model.meta['v_date'], model_dir)
+  if not os.path.exists(path):
+    os.makedirs(path)
+  for name in ARTIFACT_ARRAYS:
+    np.save(os.path.join(path, name + '.npy'), getattr(model, name))
+  with open(os.path.join(path, 'model.json'), 'w') as f:
+    json.dump({'format': ARTIFACT_FORMAT, 'features': model.features,
+      'classes': model.classes, 'shrinkage': model.shrinkage,
+      'meta': model.meta}, f, indent = 1)
+  return path
+
+
+def load_model(path, mmap = True):
+  """
+  Loads a model saved by save_model(). With `mmap` the arrays are memory-mapped
+  read-only, so loading only reads model.json and the arrays are paged in as
+  prediction touches them.
+
+  Args:
+      path (str): The model directory.
+      mmap (bool): Memory-map the arrays instead of reading them.
+
+  Returns:
+      GTBModel: The model.
+  """
+  with open(os.path.join(path, 'model.json')) as f:
+    info = json.load(f)
+  if info['format'] != ARTIFACT_FORMAT:
+    raise ValueError('Unsupported model format ' + str(info['format']) +
+      ' in ' + path)
+  arrays = {name: np.load(os.path.join(path, name + '.npy'),
+    mmap_mode = 'r' if mmap else None) for name in ARTIFACT_ARRAYS}
+  return GTBModel(info['features'], info['classes'], shrinkage = info['shrinkage'],
+    meta = info['meta'], **arrays)
+
+
+def load_or_train(mission, scheme = '5class', version = v_date,
+                  model_dir = 'data/models', **kwargs):
+  """
+  Loads the saved model of a mission, class scheme and version, training and
+  saving it first if there is none. The output tables are only written when
+  an `out_dir` is passed.
+
+  Args:
+      kwargs: Passed to train_mission() when the model has to be trained.
+
+  Returns:
+      GTBModel: The model.
+  """
+  path = model_path(mission, scheme, version, model_dir)
+  if not os.path.exists(os.path.join(path, 'model.json')):
+    kwargs.setdefault('out_dir', None)
+    model, _ = train_mission(mission, scheme, version, **kwargs)
+    save_model(model, path)
+  return load_model(path)
+
+
+def ee_tree_strings(model):
+  """
+  Writes every tree of a model in the text format read by
+  ee.Classifier.decisionTree() and decisionTreeEnsemble(): one
+  'n) split count deviance value' line per node, numbered like R's rpart
+  (children of node n are 2n and 2n + 1), leaves marked with ' *'. Node
+  deviances are not kept and are written as 0. Node numbers of trees deeper
+  than EE_MAX_DEPTH would overflow the parser's int32, which raises a
+  ValueError.
+
+  Returns:
+      list: One list of tree strings per class, in class number order.
+  """
+  depth = model.depth()
+  if depth > EE_MAX_DEPTH:
+    raise ValueError('Trees of depth ' + str(depth) + ' cannot be numbered ' +
+      'for Earth Engine, train with max_depth <= ' + str(EE_MAX_DEPTH))
+  trees = [[] for _ in model.classes]
+  for t in range(model.n_trees):
+    lines = []
+    stack = [(int(model.tree_start[t]), 1, 'root', 0)]
+    while stack:
+      i, n, split, indent = stack.pop()
+      line = (' ' * indent + str(n) + ') ' + split + ' ' +
+        str(int(model.count[i])) + ' 0 ' + repr(float(model.value[i])))
+      f = int(model.feature[i])
+      if f < 0:
+        lines.append(line + ' *')
+        continue
+      lines.append(line)
+      name = model.features[f]
+      threshold = repr(float(model.threshold[i]))
+      stack.append((int(model.right[i]), 2 * n + 1, name + '>' + threshold,
+        indent + 2))
+      stack.append((int(model.left[i]), 2 * n, name + '<=' + threshold,
+        indent + 2))
+    trees[int(model.tree_class[t])].append('\n'.join(lines))
+  return trees
+
+
+def ee_classify(image, model):
+  """
+  Classifies an ee.Image with a local model. The trees of each class run as
+  one regression ee.Classifier.decisionTreeEnsemble(), whose output is the
+  mean of its trees; times the number of trees this is the sum of
+  GTBModel.predict_scores(), so the server side classes match predict().
+
+  Args:
+      image (ee.Image): Image with the model's features as bands.
+      model (GTBModel): The model.
+
+  Returns:
+      ee.Image: The 0-based 'classification' band.
+  """
+  import ee
+  features = image.select(model.features)
+  scores = []
+  for k, trees in enumerate(ee_tree_strings(model)):
+    mean = features.classify(
+      ee.Classifier.decisionTreeEnsemble(trees).setOutputMode('REGRESSION'))
+    scores.append(mean.multiply(model.shrinkage * len(trees))
+      .add(float(model.init[k])))
+  return (ee.Image.cat(scores).toArray().arrayArgmax().arrayGet([0])
+    .toByte().rename('classification'))
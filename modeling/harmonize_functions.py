@@ -0,0 +1,215 @@
+# modules
+import json
+import os
+
+import numpy as np
+
+# Cross-sensor harmonization of the optical bands. Linear transforms
+# y = matrix @ x + offset map a mission's scaled surface reflectance onto the
+# Landsat 8/9 bands (the reference the merged mission-date lists rename to),
+# fit by least squares on pixel pairs from overlapping dates. A fit is either
+# per band (diagonal matrix, OLS or reduced major axis) or across bands (full
+# matrix), and is applied with applyHarmonization() in gee_functions.py (one
+# expression per image) or local_functions.py (one matrix multiply per band
+# stack), or with Harmonization.apply() on label tables, so one model can
+# classify the full record.
+
+# harmonized band names: the Landsat 8/9 GTB input features
+HARMONIZED_BANDS = ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B6', 'SR_B7']
+
+# blue, green, red, nir, swir1 and swir2 of each mission, in the order of
+# HARMONIZED_BANDS (bands after applyScaleFactors/applyScaleFactors_S2)
+MISSION_BANDS = {
+  'LS5': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'],
+  'LS7': ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'SR_B7'],
+  'LS8': HARMONIZED_BANDS,
+  'LS9': HARMONIZED_BANDS,
+  'SEN2': ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B8A', 'SR_B11', 'SR_B12']}
+
+
+class Harmonization(object):
+  """
+  A linear band transform y = matrix @ x + offset.
+
+  Args:
+      bands_in (list): Input band names, in matrix column order.
+      bands_out (list): Output band names, in matrix row order.
+      matrix (array): (out, in) coefficients.
+      offset (array): (out,) intercepts.
+      meta (dict): Fit information (missions, method, pixel count, r2).
+  """
+
+  def __init__(self, bands_in, bands_out, matrix, offset, meta = None):
+    self.bands_in = list(bands_in)
+    self.bands_out = list(bands_out)
+    self.matrix = np.asarray(matrix, dtype = np.float64)
+    self.offset = np.asarray(offset, dtype = np.float64)
+    self.meta = dict(meta or {})
+
+  @classmethod
+  def identity(cls, bands_in, bands_out = None):
+    n = len(bands_in)
+    return cls(bands_in, bands_out or bands_in, np.eye(n), np.zeros(n))
+
+  @property
+  def is_diagonal(self):
+    m = self.matrix
+    return (m.shape[0] == m.shape[1] and
+      not np.any(m[~np.eye(m.shape[0], dtype = bool)]))
+
+  def apply(self, x):
+    """
+    Transforms an (n, bands_in) array, e.g. label band values.
+
+    Returns:
+        np.ndarray: (n, bands_out) harmonized values.
+    """
+    return np.asarray(x, dtype = np.float64) @ self.matrix.T + self.offset
+
+  def then(self, other):
+    """
+    The transform of applying self and then other, e.g. LS5 -> LS7 followed
+    by LS7 -> LS8.
+    """
+    if list(other.bands_in) != self.bands_out:
+      raise ValueError('Output bands ' + str(self.bands_out) + ' do not match ' +
+        'the input bands ' + str(other.bands_in))
+    return Harmonization(self.bands_in, other.bands_out,
+      other.matrix @ self.matrix, other.matrix @ self.offset + other.offset,
+      {'steps': [self.meta, other.meta]})
+
+  def to_dict(self):
+    return {'bands_in': self.bands_in, 'bands_out': self.bands_out,
+      'matrix': self.matrix.tolist(), 'offset': self.offset.tolist(),
+      'meta': self.meta}
+
+  @classmethod
+  def from_dict(cls, d):
+    return cls(d['bands_in'], d['bands_out'], d['matrix'], d['offset'],
+      d.get('meta'))
+
+
+def fit_harmonization(x, y, bands_in, bands_out = HARMONIZED_BANDS,
+                      method = 'ols', weights = None):
+  """
+  Fits a transform from source to reference band values of paired pixels.
+
+  Args:
+      x (np.ndarray): (n, bands) source values.
+      y (np.ndarray): (n, bands) reference values of the same pixels.
+      bands_in (list): Source band names.
+      bands_out (list): Reference band names.
+      method (str): 'ols' or 'rma' (reduced major axis) per band, or 'matrix'
+          for a least squares fit of every output band on all input bands.
+      weights (np.ndarray): Optional (n,) pixel weights.
+
+  Returns:
+      Harmonization: The fit; meta holds the pixel count and r2 per band.
+  """
+  x = np.asarray(x, dtype = np.float64)
+  y = np.asarray(y, dtype = np.float64)
+  w = np.ones(len(x)) if weights is None else np.asarray(weights, np.float64)
+  if method == 'matrix':
+    ok = np.isfinite(x).all(axis = 1) & np.isfinite(y).all(axis = 1)
+    design = np.hstack([x[ok], np.ones((ok.sum(), 1))]) * np.sqrt(w[ok])[:, None]
+    coef = np.linalg.lstsq(design, y[ok] * np.sqrt(w[ok])[:, None],
+      rcond = None)[0]
+    matrix, offset = coef[:-1].T, coef[-1]
+    n = np.full(y.shape[1], int(ok.sum()))
+    pred = x[ok] @ matrix.T + offset
+    resid = ((y[ok] - pred) ** 2 * w[ok, None]).sum(axis = 0)
+    my = (y[ok] * w[ok, None]).sum(axis = 0) / w[ok].sum()
+    total = ((y[ok] - my) ** 2 * w[ok, None]).sum(axis = 0)
+  elif method in ('ols', 'rma'):
+    # per band weighted moments over the pixels valid in that band
+    ok = np.isfinite(x) & np.isfinite(y)
+    wk = np.where(ok, w[:, None], 0)
+    xs, ys = np.where(ok, x, 0), np.where(ok, y, 0)
+    sw = wk.sum(axis = 0)
+    mx, my = (wk * xs).sum(axis = 0) / sw, (wk * ys).sum(axis = 0) / sw
+    dx, dy = np.where(ok, xs - mx, 0), np.where(ok, ys - my, 0)
+    sxx, syy = (wk * dx * dx).sum(axis = 0), (wk * dy * dy).sum(axis = 0)
+    sxy = (wk * dx * dy).sum(axis = 0)
+    if method == 'ols':
+      slope = sxy / sxx
+    else:
+      slope = np.sign(sxy) * np.sqrt(syy / sxx)
+    offset = my - slope * mx
+    matrix = np.diag(slope)
+    n = ok.sum(axis = 0)
+    resid = (wk * (dy - slope * dx) ** 2).sum(axis = 0)
+    total = syy
+  else:
+    raise ValueError('method must be "ols", "rma" or "matrix", not ' +
+      str(method))
+  return Harmonization(bands_in, bands_out, matrix, offset, {
+    'method': method, 'n_pixels': [int(v) for v in n],
+    'r2': [float(v) for v in 1 - resid / total]})
+
+
+def pixel_pairs(src, ref, src_bands, ref_bands = HARMONIZED_BANDS,
+                max_pixels = None, seed = 47):
+  """
+  Paired band values of two co-registered local images from overlapping
+  dates (e.g. LS7 and LS8 eight days apart, or same-day LS8 and S2).
+
+  Args:
+      src, ref (local_functions.LocalImage): Scaled source and reference
+          images on the same grid.
+      src_bands, ref_bands (list): Corresponding bands.
+      max_pixels (int): Random subsample size, None for all valid pixels.
+      seed (int): Seed of the subsample.
+
+  Returns:
+      tuple: (x, y) arrays of shape (pixels, bands).
+  """
+  valid = src.mask & ref.mask
+  x = np.stack([src.band(b)[valid] for b in src_bands], axis = 1)
+  y = np.stack([ref.band(b)[valid] for b in ref_bands], axis = 1)
+  ok = np.isfinite(x).all(axis = 1) & np.isfinite(y).all(axis = 1)
+  x, y = x[ok], y[ok]
+  if max_pixels is not None and len(x) > max_pixels:
+    rows = np.random.default_rng(seed).choice(len(x), max_pixels,
+      replace = False)
+    x, y = x[rows], y[rows]
+  return x, y
+
+
+def pairs_from_table(table, src_bands, ref_bands = HARMONIZED_BANDS,
+                     src_prefix = 'src_', ref_prefix = 'ref_'):
+  """
+  Paired band values from a pixel sample table, e.g. the export of
+  gee_functions.sample_pixel_pairs().
+
+  Returns:
+      tuple: (x, y) arrays of shape (pixels, bands).
+  """
+  x = table[[src_prefix + b for b in src_bands]].values.astype(np.float64)
+  y = table[[ref_prefix + b for b in ref_bands]].values.astype(np.float64)
+  return x, y
+
+
+def save_harmonizations(harmonizations, path):
+  """
+  Writes mission -> Harmonization to a JSON file.
+  """
+  if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  with open(path, 'w') as f:
+    json.dump({k: h.to_dict() for k, h in harmonizations.items()}, f,
+      indent = 1)
+
+
+def load_harmonizations(path):
+  """
+  Reads mission -> Harmonization from a JSON file. Missions whose bands are
+  already HARMONIZED_BANDS and that are missing from the file get the
+  identity.
+  """
+  with open(path) as f:
+    harmonizations = {k: Harmonization.from_dict(d)
+      for k, d in json.load(f).items()}
+  for mission, bands in MISSION_BANDS.items():
+    if mission not in harmonizations and bands == HARMONIZED_BANDS:
+      harmonizations[mission] = Harmonization.identity(bands)
+  return harmonizations
@@ -0,0 +1,330 @@
+# modules
+import collections
+import concurrent.futures
+import os
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import gtb_functions as gtb
+import local_functions as lf
+
+# Local, tiled counterpart of applyGTB_*/applyPerMissionDate_* and
+# classifications_to_one_band in the GTB scripts: a scene is classified in
+# fixed-size tiles by a GTBModel (see gtb_functions.py), every tile is
+# traversed one tree at a time into a float64 score accumulator, tiles run on
+# a process pool and the 'reclass' result is written into a (memory-mapped)
+# int16 array, so memory use depends on the tile size and not on the scene
+# size or the number of trees.
+
+# classifications_to_one_band() encoding: class 0-4 -> 1-5, -99 otherwise.
+# Masked pixels and pixels with missing inputs are -99 as well.
+fromlist = [0, 1, 2, 3, 4]
+tolist = [1, 2, 3, 4, 5]
+reclass_default = -99
+
+_reclass_lut = np.full(256, reclass_default, dtype = np.int16)
+_reclass_lut[fromlist] = tolist
+
+
+def reclass(classification, valid = None):
+  """
+  Remaps a 0-based uint8 class array like classifications_to_one_band().
+
+  Args:
+      classification (np.ndarray): uint8 classes.
+      valid (np.ndarray): Boolean array, False where the result is -99.
+
+  Returns:
+      np.ndarray: int16 'reclass' values.
+  """
+  out = _reclass_lut[classification]
+  if valid is not None:
+    out[~valid] = reclass_default
+  return out
+
+
+def predict_classes(model, X):
+  """
+  Predicts like GTBModel.predict(), one tree at a time: the nodes of the
+  samples are an int32 array and the class scores a float64 accumulator (the
+  same precision as GTBModel.predict_scores(), so near-ties resolve the same
+  way), both allocated once, so memory use does not grow with the number of
+  trees.
+
+  Args:
+      model (gtb_functions.GTBModel): The model.
+      X (np.ndarray): (n samples, n features) array, columns in the order of
+          model.features.
+
+  Returns:
+      np.ndarray: uint8 0-based class of every sample.
+  """
+  n = X.shape[0]
+  scores = np.zeros((len(model.classes), n), dtype = np.float64)
+  node = np.empty(n, dtype = np.int32)
+  for t in range(model.n_trees):
+    node.fill(model.tree_start[t])
+    active = np.arange(n) if model.feature[model.tree_start[t]] >= 0 else []
+    while len(active):
+      current = node[active]
+      f = model.feature[current]
+      current = np.where(X[active, f] <= model.threshold[current],
+        model.left[current], model.right[current])
+      node[active] = current
+      active = active[model.feature[current] >= 0]
+    scores[model.tree_class[t]] += model.value[node]
+  scores *= model.shrinkage
+  scores += model.init[:, None]
+  return scores.argmax(axis = 0).astype(np.uint8)
+
+
+def classify_block(model, image):
+  """
+  Classifies a LocalImage holding the model's features.
+
+  Args:
+      model (gtb_functions.GTBModel): The model.
+      image (local_functions.LocalImage): Image with the model's features as
+          bands.
+
+  Returns:
+      np.ndarray: int16 'reclass' band.
+  """
+  valid = image.mask.copy()
+  for f in model.features:
+    valid &= np.isfinite(image.band(f))
+  out = np.full(valid.shape, reclass_default, dtype = np.int16)
+  n = int(valid.sum())
+  if n:
+    X = np.empty((n, len(model.features)), dtype = np.float64)
+    for j, f in enumerate(model.features):
+      X[:, j] = image.band(f)[valid]
+    out[valid] = _reclass_lut[predict_classes(model, X)]
+  return out
+
+
+####--------------------------####
+#### tiled scenes             ####
+####--------------------------####
+
+def tile_windows(height, width, tile_size = 512):
+  """
+  Splits a raster into tiles.
+
+  Returns:
+      list: (row start, row stop, col start, col stop) of every tile.
+  """
+  return [(r, min(r + tile_size, height), c, min(c + tile_size, width))
+    for r in range(0, height, tile_size) for c in range(0, width, tile_size)]
+
+
+def source_shape(sources):
+  """
+  Returns:
+      tuple: (height, width) of the first source, a 2D array or a GeoTIFF path.
+  """
+  first = next(iter(sources.values()))
+  if isinstance(first, str):
+    import rasterio
+    with rasterio.open(first) as src:
+      return src.height, src.width
+  return first.shape
+
+
+def _read_source(src, window):
+  r0, r1, c0, c1 = window
+  if isinstance(src, str):
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(src) as f:
+      return f.read(1, window = Window(c0, r0, c1 - c0, r1 - r0))
+  return np.asarray(src[r0:r1, c0:c1])
+
+
+def read_window(sources, window):
+  """
+  Reads one tile of a set of bands into a LocalImage.
+
+  Args:
+      sources (dict): Band name -> 2D array or single band GeoTIFF path.
+      window (tuple): (row start, row stop, col start, col stop).
+
+  Returns:
+      local_functions.LocalImage: The tile.
+  """
+  return lf.LocalImage((name, _read_source(src, window))
+    for name, src in sources.items())
+
+
+# model of the worker processes, set once per process by _init_worker()
+_worker_model = None
+
+
+def _init_worker(model):
+  global _worker_model
+  _worker_model = gtb.load_model(model) if isinstance(model, str) else model
+
+
+def _classify_tile(args):
+  window, bands, functions, properties = args
+  image = lf.LocalImage(bands, properties = properties)
+  return window, classify_block(_worker_model, lf.run_chain(image, functions))
+
+
+def classify_scene(model, sources, functions = (), properties = None,
+                   out = None, tile_size = 512, n_jobs = None):
+  """
+  Classifies a scene tile by tile and writes its 'reclass' band.
+
+  Args:
+      model (gtb_functions.GTBModel or str): The model, or the directory of a
+          saved model (see gtb_functions.save_model()), which every worker
+          then memory-maps.
+      sources (dict): Band name -> 2D array (e.g. a np.memmap) or single band
+          GeoTIFF path (e.g. from local_functions.landsat_band_paths()).
+      functions (list): Image functions applied to every tile before
+          classification, e.g. [lf.apply_radsat_mask, lf.applyScaleFactors],
+          so raw bands are scaled tile by tile.
+      properties (dict): Image properties the functions may need (e.g.
+          SPACECRAFT_ID).
+      out (str): Path of a .npy file to write the result to as a memory map,
+          None to return an in-memory array.
+      tile_size (int): Tile height and width in pixels.
+      n_jobs (int): Number of processes, defaults to the number of CPUs; 1
+          classifies in the calling process.
+
+  Returns:
+      np.ndarray: int16 'reclass' band of the scene.
+  """
+  height, width = source_shape(sources)
+  if out is None:
+    result = np.empty((height, width), dtype = np.int16)
+  else:
+    result = np.lib.format.open_memmap(out, mode = 'w+', dtype = np.int16,
+      shape = (height, width))
+  windows = tile_windows(height, width, tile_size)
+  # tiles are read lazily, one batch of jobs at a time
+  jobs = ((w, read_window(sources, w).bands, list(functions), properties)
+    for w in windows)
+  if n_jobs == 1:
+    _init_worker(model)
+    for job in jobs:
+      (r0, r1, c0, c1), tile = _classify_tile(job)
+      result[r0:r1, c0:c1] = tile
+  else:
+    n_jobs = n_jobs or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(n_jobs,
+        initializer = _init_worker, initargs = (model,)) as pool:
+      # keep only a few tiles per process in flight to bound memory
+      running = set()
+      for job in jobs:
+        if len(running) >= 2 * n_jobs:
+          done, running = concurrent.futures.wait(running,
+            return_when = concurrent.futures.FIRST_COMPLETED)
+          for f in done:
+            (r0, r1, c0, c1), tile = f.result()
+            result[r0:r1, c0:c1] = tile
+        running.add(pool.submit(_classify_tile, job))
+      for f in concurrent.futures.as_completed(running):
+        (r0, r1, c0, c1), tile = f.result()
+        result[r0:r1, c0:c1] = tile
+  if out is not None:
+    result.flush()
+  return result
+
+
+####--------------------------####
+#### class statistics         ####
+####--------------------------####
+
+def class_counts(band, mask = None, masks = None, profile = None,
+                 layer = 'minus_shoreline_contamination'):
+  """
+  Counts the pixels of every class value with one np.bincount, the local
+  counterpart of gee_functions.class_histogram().
+
+  Args:
+      band (np.ndarray): 'classification' (0-based uint8) or 'reclass' band.
+          'reclass' values of -99 are not counted.
+      mask (np.ndarray): Boolean array, only True pixels are counted.
+      masks (aoi_functions.PackedMasks): Optional stored mask layers of the
+          band's grid; only pixels in `layer` are counted.
+      profile (dict): Raster profile of the band (e.g. the 'profile' property
+          of local_functions.read_bands()), checked against the grid of
+          `masks`.
+      layer (str): The mask layer, see aoi_functions.MASK_LAYERS.
+
+  Returns:
+      dict: class value -> pixel count, for the values that occur
+  """
+  band = np.asarray(band)
+  if masks is not None:
+    if profile is None:
+      raise ValueError('A profile is needed to check the grid of the masks')
+    masks.check_grid(profile['transform'], band.shape, profile.get('crs'))
+    inside = masks.mask(layer)
+    mask = inside if mask is None else mask & inside
+  values = band[mask] if mask is not None else band.ravel()
+  values = values[values >= 0]
+  counts = np.bincount(values.astype(np.intp))
+  return {int(v): int(counts[v]) for v in np.flatnonzero(counts)}
+
+
+def class_stats_table(histograms, scheme = '5class', scale = 30,
+                      reclassed = False):
+  """
+  Formats class counts of many images as a tidy table with one row per
+  missDate and class.
+
+  Args:
+      histograms (dict): missDate -> class counts, from class_counts() or
+          gee_functions.class_histograms(...).getInfo() (whose class values are
+          strings).
+      scheme (str): '5class' or '3class', for the class names.
+      scale (float): Pixel size in meters, for the areas.
+      reclassed (bool): Whether the class values are the 1-based 'reclass'
+          values instead of the 0-based 'classification' values.
+
+  Returns:
+      pd.DataFrame: missDate, mission, date, class_value, class, pixel_count,
+      area_km2 and proportion (of the classified pixels of the missDate).
+      Values that are not a class (e.g. 'reclass' -99) are left out.
+  """
+  import pandas as pd
+  classes = gtb.CLASS_VALUES[scheme]
+  rows = []
+  for miss_date, counts in histograms.items():
+    for value, n in counts.items():
+      value = int(float(value))
+      k = value - 1 if reclassed else value
+      if not 0 <= k < len(classes):
+        continue
+      rows.append((miss_date, '', '', value, classes[k],
+        int(round(float(n)))))
+  table = pd.DataFrame(rows, columns = ['missDate', 'mission', 'date',
+    'class_value', 'class', 'pixel_count']).astype({'class_value': np.int64,
+    'pixel_count': np.int64})
+  # missDate is <SPACECRAFT_ID or SPACECRAFT_NAME>_<YYYY-MM-dd>
+  parts = table['missDate'].str.rsplit('_', n = 1)
+  table['mission'] = parts.str[0]
+  table['date'] = parts.str[1]
+  table['area_km2'] = table['pixel_count'] * scale * scale / 1e6
+  table['proportion'] = (table['pixel_count'] /
+    table.groupby('missDate')['pixel_count'].transform('sum'))
+  return table.sort_values(['missDate', 'class_value']).reset_index(drop = True)
+
+
+def write_geotiff(reclass_band, profile, path):
+  """
+  Writes a 'reclass' band as a GeoTIFF with the georeferencing of `profile`
+  (e.g. the 'profile' property of local_functions.read_bands()). Requires
+  rasterio.
+  """
+  import rasterio
+  profile = dict(profile, count = 1, dtype = 'int16', nodata = reclass_default)
+  with rasterio.open(path, 'w', **profile) as dst:
+    dst.write(np.asarray(reclass_band), 1)
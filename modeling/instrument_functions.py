@@ -0,0 +1,273 @@
+# modules
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import ee
+
+# Opt-in instrumentation of production runs. A Tracer writes one JSON line per
+# event: every getInfo() with its duration, the queue wait and run time of
+# export tasks (from the task status timestamps), the task list requests and
+# the time spent sleeping in gee_functions.maximum_no_of_tasks() or in a
+# task_functions.TaskScheduler. Events carry the tags that are active in their
+# thread when they happen (e.g. mission and missDate), and summarize() turns a
+# trace into a latency breakdown.
+
+
+class Tracer(object):
+  """
+  Writes instrumentation events to a JSON lines file.
+
+  Args:
+      path (str): The trace file; events are appended.
+      run (str): Name of the run stored with every event, defaults to the
+          start time.
+  """
+
+  def __init__(self, path, run = None):
+    self.path = path
+    self.run = run or time.strftime('%Y-%m-%dT%H:%M:%S')
+    self._local = threading.local()
+    self._lock = threading.Lock()
+    self._patches = []
+    self._listeners = []
+    if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+
+  def record(self, event, duration = None, **fields):
+    """
+    Writes one event with the active tags.
+    """
+    entry = dict(self._active_tags(), run = self.run, event = event,
+      time = time.time())
+    if duration is not None:
+      entry['duration'] = duration
+    entry.update(fields)
+    with self._lock:
+      with open(self.path, 'a') as f:
+        f.write(json.dumps(entry, default = str) + '\n')
+
+  def _active_tags(self):
+    return getattr(self._local, 'tags', {})
+
+  @contextlib.contextmanager
+  def tags(self, **tags):
+    """
+    Tags the events of a with block, e.g.
+    `with tracer.tags(mission = 'LS5', missDate = md):`. Tags are kept per
+    thread, so with blocks in concurrent threads do not mix; events recorded
+    by worker threads (e.g. of evaluate_functions.get_info_batch()) only carry
+    tags set in that thread.
+    """
+    previous = self._active_tags()
+    self._local.tags = dict(previous, **tags)
+    try:
+      yield self
+    finally:
+      self._local.tags = previous
+
+  @contextlib.contextmanager
+  def timed(self, event, **fields):
+    """
+    Records the duration of a with block as one event.
+    """
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.record(event, time.time() - start, **fields)
+
+  def _patch(self, owner, name, wrapper):
+    original = getattr(owner, name)
+    setattr(owner, name, wrapper(original))
+    self._patches.append((owner, name, original))
+
+  def instrument_getinfo(self):
+    """
+    Times every getInfo() of every ee object.
+    """
+    tracer = self
+
+    def wrapper(original):
+      @functools.wraps(original)
+      def getInfo(obj, *args, **kwargs):
+        start = time.time()
+        try:
+          return original(obj, *args, **kwargs)
+        finally:
+          tracer.record('getInfo', time.time() - start,
+            type = type(obj).__name__)
+      return getInfo
+
+    self._patch(ee.ComputedObject, 'getInfo', wrapper)
+
+  def instrument_throttle(self, gee_functions):
+    """
+    Times the sleeps of gee_functions.maximum_no_of_tasks() (the module loaded
+    as gf in the notebooks), one 'throttle' event per sleep, and the task list
+    requests of its count_active_tasks(), one 'task_list' event with the
+    number of listed tasks per ee.data.getTaskList() call. The task list is
+    patched in the ee module, so the polls of a TaskScheduler on Earth Engine
+    are recorded as well.
+    """
+    tracer = self
+
+    def wrapper(original):
+      @functools.wraps(original)
+      def getTaskList(*args, **kwargs):
+        start = time.time()
+        tasks = None
+        try:
+          tasks = original(*args, **kwargs)
+          return tasks
+        finally:
+          tracer.record('task_list', time.time() - start,
+            tasks = None if tasks is None else len(tasks))
+      return getTaskList
+
+    self._patch(gee_functions, 'time',
+      lambda original: _TracedTime(original, self, 'throttle'))
+    self._patch(gee_functions.ee.data, 'getTaskList', wrapper)
+
+  def instrument_scheduler(self, scheduler, task_status = True):
+    """
+    Records the sleeps and task transitions of a task_functions.TaskScheduler.
+    Each event is tagged with the job's mission and missDate tags. When a task
+    finishes, its queue wait and run time are read from the task status
+    (one extra request per task, skipped if `task_status` is False).
+    """
+    tracer = self
+    sleep = scheduler.sleep
+
+    def traced_sleep(seconds):
+      start = time.time()
+      sleep(seconds)
+      tracer.record('scheduler_sleep', time.time() - start)
+
+    scheduler.sleep = traced_sleep
+    self._patches.append((scheduler, 'sleep', sleep))
+
+    def listener(event, job):
+      tags = {k: job[k] for k in ('mission', 'missDate') if k in job}
+      fields = {'key': job['key'], 'id': job['id']}
+      if event in ('completed', 'failed'):
+        fields['local_wait'] = job['submitted'] - job['queued']
+        fields['local_total'] = job['finished'] - job['submitted']
+        if task_status and job['id'] and not str(job['id']).startswith('FAKE'):
+          fields.update(task_timing(job['id']))
+      with tracer.tags(**tags):
+        tracer.record('task_' + event, **fields)
+
+    scheduler.add_listener(listener)
+    self._listeners.append((scheduler, listener))
+
+  def close(self):
+    """
+    Undoes all instrumentation.
+    """
+    for owner, name, original in reversed(self._patches):
+      setattr(owner, name, original)
+    self._patches = []
+    for scheduler, listener in self._listeners:
+      scheduler.remove_listener(listener)
+    self._listeners = []
+
+
+class _TracedTime(object):
+  # stands in for the time module of an instrumented module, recording each
+  # sleep as an event
+  def __init__(self, module, tracer, event):
+    self._module = module
+    self._tracer = tracer
+    self._event = event
+
+  def __getattr__(self, name):
+    return getattr(self._module, name)
+
+  def sleep(self, seconds):
+    start = time.time()
+    try:
+      self._module.sleep(seconds)
+    finally:
+      self._tracer.record(self._event, time.time() - start, wait = seconds)
+
+
+def task_timing(task_id):
+  """
+  Queue wait and run time of a finished task from its status timestamps.
+
+  Returns:
+      dict: 'queue_wait' and 'run_time' in seconds, where available.
+  """
+  status = ee.data.getTaskStatus(task_id)[0]
+  created = status.get('creation_timestamp_ms')
+  started = status.get('start_timestamp_ms')
+  updated = status.get('update_timestamp_ms')
+  timing = {}
+  if created and started:
+    timing['queue_wait'] = (started - created) / 1000.0
+  if started and updated:
+    timing['run_time'] = (updated - started) / 1000.0
+  return timing
+
+
+def enable(path, gee_functions = None, scheduler = None, run = None):
+  """
+  Creates a Tracer and instruments getInfo() and, when given, the task
+  throttle of gee_functions and a TaskScheduler.
+
+  Returns:
+      Tracer: The tracer; call close() to remove the instrumentation.
+  """
+  tracer = Tracer(path, run)
+  tracer.instrument_getinfo()
+  if gee_functions is not None:
+    tracer.instrument_throttle(gee_functions)
+  if scheduler is not None:
+    tracer.instrument_scheduler(scheduler)
+  return tracer
+
+
+def read_trace(path):
+  """
+  Returns:
+      pd.DataFrame: The events of a trace file.
+  """
+  import pandas as pd
+  with open(path) as f:
+    return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def summarize(path, by = ('run', 'event')):
+  """
+  Latency breakdown of a trace: count, total, mean, median and 95th
+  percentile of the event durations and of the task waits and run times
+  (local_wait/local_total as seen by the scheduler, queue_wait/run_time from
+  the task status).
+
+  Args:
+      path (str): The trace file.
+      by (tuple): Grouping columns, e.g. ('run', 'mission', 'event').
+
+  Returns:
+      pd.DataFrame: One row per group and measure.
+  """
+  import pandas as pd
+  events = read_trace(path)
+  by = [c for c in by if c in events.columns]
+  measures = [c for c in ('duration', 'local_wait', 'local_total', 'queue_wait',
+    'run_time') if c in events]
+  tables = []
+  for measure in measures:
+    values = events.dropna(subset = [measure])
+    if values.empty:
+      continue
+    table = values.groupby(by)[measure].agg(['count', 'sum', 'mean', 'median',
+      lambda x: x.quantile(0.95)])
+    table.columns = ['count', 'total', 'mean', 'median', 'p95']
+    table['measure'] = measure
+    tables.append(table.reset_index())
+  return pd.concat(tables, ignore_index = True) if tables else pd.DataFrame()
@@ -0,0 +1,206 @@
+# modules
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Local scene inventory built from the scene metadata exports of the re-pull
+# notebooks (LS5_image_metadata.csv ... SEN2_image_metadata.csv, or
+# data/labels/collated_scene_metadata_*.csv). Scenes are sorted by date, so a
+# date range is a binary search and the other keys (mission, WRS path/row,
+# MGRS tile, month, cloud cover, image quality) are vectorized masks over that
+# range. missdates() returns missDates in the format of addImageDate() and
+# addImageDate_S2(), e.g. for ee.Filter.inList('missDate', ...), so planning a
+# run does not need the server.
+
+# scene filters of the re-pull notebooks and availability checks
+WRS_PATH = 26
+WRS_ROWS = [27, 28]
+MGRS_TILES = ['15TWN', '15TXN', '15TYN', '15TWM', '15TXM', '15TYM']
+MIN_IMAGE_QUALITY = 7
+
+# spacecraft prefix -> mission name of the label tables
+MISSIONS = [('LANDSAT_4', 'LS4'), ('LANDSAT_5', 'LS5'), ('LANDSAT_7', 'LS7'),
+            ('LANDSAT_8', 'LS8'), ('LANDSAT_9', 'LS9'), ('SENTINEL-2', 'SEN2')]
+
+COLUMNS = ['scene_id', 'mission', 'spacecraft', 'date', 'missDate', 'path',
+           'row', 'tile', 'cloud_cover', 'image_quality', 'time_start']
+
+
+def _first(table, names):
+  for name in names:
+    if name in table:
+      return table[name]
+  return pd.Series(np.nan, index = table.index)
+
+
+def _mission(spacecraft):
+  for prefix, mission in MISSIONS:
+    if spacecraft.upper().startswith(prefix):
+      return mission
+  return spacecraft
+
+
+def read_metadata(path):
+  """
+  Reads one scene metadata export into the inventory columns.
+
+  Args:
+      path (str): CSV exported with ee.batch.Export.table.toDrive() from a
+          LANDSAT/*/C02/T1_L2 or COPERNICUS/S2_SR_HARMONIZED collection.
+
+  Returns:
+      pd.DataFrame: One row per scene with the COLUMNS. Scenes with neither
+      a system:time_start nor a DATE_ACQUIRED have no date or missDate and
+      are dropped with a warning.
+  """
+  meta = pd.read_csv(path, low_memory = False)
+  spacecraft = _first(meta, ['SPACECRAFT_ID', 'SPACECRAFT_NAME']).astype(str)
+  time_start = _first(meta, ['system:time_start'])
+  # image.date().format('YYYY-MM-dd') is the UTC date of system:time_start
+  date = pd.to_datetime(time_start, unit = 'ms', utc = True).dt.strftime(
+    '%Y-%m-%d')
+  if 'DATE_ACQUIRED' in meta:
+    date = date.where(time_start.notna(), meta['DATE_ACQUIRED'])
+  scenes = pd.DataFrame({
+    'scene_id': _first(meta, ['system:index']).astype(str),
+    'mission': spacecraft.map(_mission),
+    'spacecraft': spacecraft,
+    'date': date,
+    'missDate': spacecraft + '_' + date,
+    'path': _first(meta, ['WRS_PATH']),
+    'row': _first(meta, ['WRS_ROW']),
+    'tile': _first(meta, ['MGRS_TILE']),
+    'cloud_cover': _first(meta, ['CLOUD_COVER', 'CLOUDY_PIXEL_PERCENTAGE']),
+    'image_quality': _first(meta, ['IMAGE_QUALITY_OLI', 'IMAGE_QUALITY']),
+    'time_start': time_start})
+  undated = scenes['date'].isna()
+  if undated.any():
+    warnings.warn('Dropped ' + str(int(undated.sum())) + ' scenes without ' +
+      'system:time_start or DATE_ACQUIRED from ' + path)
+    scenes = scenes[~undated].reset_index(drop = True)
+  return scenes[COLUMNS]
+
+
+class SceneInventory(object):
+  """
+  Date-sorted scene table with vectorized multi-key queries.
+
+  Args:
+      scenes (pd.DataFrame): Scenes with the COLUMNS, e.g. from
+          read_metadata().
+  """
+
+  def __init__(self, scenes):
+    self.scenes = (scenes.sort_values(['date', 'time_start'], kind = 'stable')
+      .drop_duplicates('scene_id').reset_index(drop = True))
+    self._date = self.scenes['date'].values.astype(str)
+    self._mission = self.scenes['mission'].values.astype(str)
+    self._path = self.scenes['path'].values.astype(np.float64)
+    self._row = self.scenes['row'].values.astype(np.float64)
+    self._tile = self.scenes['tile'].values.astype(str)
+    self._month = np.array([int(d[5:7]) for d in self._date], dtype = np.int64)
+    self._cloud = self.scenes['cloud_cover'].values.astype(np.float64)
+    self._quality = self.scenes['image_quality'].values.astype(np.float64)
+
+  @classmethod
+  def from_csv(cls, paths):
+    """
+    Builds the inventory from scene metadata exports.
+
+    Args:
+        paths (list): CSV paths, or a directory holding *_image_metadata.csv
+            files.
+
+    Returns:
+        SceneInventory: The inventory.
+    """
+    if isinstance(paths, str):
+      if os.path.isdir(paths):
+        paths = sorted(os.path.join(paths, f) for f in os.listdir(paths)
+          if f.endswith('_image_metadata.csv'))
+      else:
+        paths = [paths]
+    return cls(pd.concat([read_metadata(p) for p in paths],
+      ignore_index = True))
+
+  def __len__(self):
+    return len(self.scenes)
+
+  def _rows(self, missions = None, path = None, rows = None, tiles = None,
+            start = None, end = None, months = None, max_cloud = None,
+            min_quality = None):
+    lo = 0 if start is None else int(np.searchsorted(self._date, start, 'left'))
+    hi = len(self) if end is None else int(np.searchsorted(self._date, end,
+      'left'))
+    keep = np.ones(hi - lo, dtype = bool)
+    window = slice(lo, hi)
+    if missions is not None:
+      keep &= np.isin(self._mission[window], [missions] if isinstance(missions,
+        str) else list(missions))
+    if path is not None:
+      keep &= self._path[window] == path
+    if rows is not None:
+      keep &= np.isin(self._row[window], [rows] if np.isscalar(rows)
+        else list(rows))
+    if tiles is not None:
+      keep &= np.isin(self._tile[window], [tiles] if isinstance(tiles, str)
+        else list(tiles))
+    if months is not None:
+      keep &= np.isin(self._month[window], [months] if np.isscalar(months)
+        else list(months))
+    if max_cloud is not None:
+      keep &= self._cloud[window] <= max_cloud
+    if min_quality is not None:
+      # Sentinel 2 metadata has no image quality score
+      quality = self._quality[window]
+      keep &= np.isnan(quality) | (quality >= min_quality)
+    return lo + np.flatnonzero(keep)
+
+  def query(self, **keys):
+    """
+    Selects scenes. All keys are optional and combined with 'and'.
+
+    Args:
+        missions (str or list): Missions, e.g. 'LS8' or ['LS8', 'LS9'].
+        path (int): WRS path, e.g. WRS_PATH.
+        rows (int or list): WRS rows, e.g. WRS_ROWS.
+        tiles (str or list): MGRS tiles, e.g. MGRS_TILES.
+        start, end (str): Date range 'YYYY-MM-dd', start inclusive and end
+            exclusive.
+        months (int or list): Calendar months.
+        max_cloud (float): Maximum scene cloud cover (%).
+        min_quality (int): Minimum image quality (Landsat only).
+
+    Returns:
+        pd.DataFrame: The scenes, by date.
+    """
+    return self.scenes.iloc[self._rows(**keys)]
+
+  def missdates(self, **keys):
+    """
+    Sorted unique missDates of the scenes matching query(**keys), e.g.
+    'LANDSAT_8_2020-08-11' or 'Sentinel-2A_2020-07-12'.
+    """
+    return sorted(set(self.scenes['missDate'].values[self._rows(**keys)]))
+
+  def mission_date_list(self, **keys):
+    """
+    The mission-date table of 1_createMissionDateList.js (one row per
+    spacecraft, date and WRS path/row) for the matching scenes.
+    """
+    table = self.query(**keys)[['spacecraft', 'date', 'path', 'row']]
+    table.columns = ['SPACECRAFT_ID', 'DATE_ACQUIRED', 'WRS_PATH', 'WRS_ROW']
+    return table.drop_duplicates().reset_index(drop = True)
+
+  def summary(self, by = ('mission', 'year'), **keys):
+    """
+    Number of scenes and missDates per group, e.g. per mission and year, as
+    in the availability checks.
+    """
+    scenes = self.query(**keys).assign(year = lambda s: s['date'].str[:4],
+      month = lambda s: s['date'].str[5:7].astype(int))
+    grouped = scenes.groupby(list(by))
+    return pd.DataFrame({'n_scenes': grouped.size(),
+      'n_missDates': grouped['missDate'].nunique()}).reset_index()
@@ -0,0 +1,284 @@
+# modules
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Typed, memory-mapped copies of the collated label tables in data/labels/.
+# Each CSV is parsed once into a directory of .npy columns: numbers keep their
+# dtype and text columns (mission, class, vol_init, date, ...) are stored as
+# integer codes of sorted categories. Rows are sorted by mission, class and
+# date, so "LS8, offShoreSediment, 2019" is one contiguous slice of every
+# column, i.e. a view of the memory map and not a scan. Index arrays of the
+# rows ordered by mission and date and by date answer missDate and date
+# queries. Missing text values have the code -1, sort before every category
+# and are keyed as MISSING in the indexes. The cache is rebuilt when the CSV
+# changes.
+
+LABEL_CACHE = 'data/labels/cache'
+CACHE_FORMAT = 1
+
+# label table mission -> spacecraft part of the image missDate (see
+# addImageDate() and addImageDate_S2() in re_pull_functions.py)
+SPACECRAFT = {'LS5': 'LANDSAT_5', 'LS7': 'LANDSAT_7', 'LS8': 'LANDSAT_8',
+              'LS9': 'LANDSAT_9', 'SEN2': 'Sentinel-2'}
+
+KEY_SEP = '|'
+MISSING = ''
+
+
+def _code_dtype(n):
+  for dtype in (np.int8, np.int16, np.int32):
+    if n < np.iinfo(dtype).max:
+      return dtype
+  return np.int64
+
+
+def _source_stamp(csv_path):
+  stat = os.stat(csv_path)
+  return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _decode(codes, categories):
+  # category of every code, MISSING for the code -1 of missing values
+  return [categories[k] if k >= 0 else MISSING for k in codes]
+
+
+def _ranges(keys):
+  # start/stop of each run of equal keys in a sorted list
+  out = {}
+  for i, k in enumerate(keys):
+    if k not in out:
+      out[k] = [i, i]
+    out[k][1] = i + 1
+  return out
+
+
+def missdate_key(missDate):
+  """
+  Converts an image missDate to the mission|date key of the label tables,
+  e.g. 'LANDSAT_8_2020-08-11' -> 'LS8|2020-08-11' and
+  'Sentinel-2A_2020-07-12' -> 'SEN2|2020-07-12'.
+  """
+  spacecraft, date = missDate.rsplit('_', 1)
+  for mission, name in SPACECRAFT.items():
+    if spacecraft.upper().startswith(name.upper()):
+      return mission + KEY_SEP + date
+  return spacecraft + KEY_SEP + date
+
+
+def build_cache(csv_path, cache_dir):
+  """
+  Converts a label CSV to a directory of memory-mappable columns.
+
+  Args:
+      csv_path (str): The label table, with 'mission', 'class' and 'date'
+          columns.
+      cache_dir (str): Output directory.
+
+  Returns:
+      LabelTable: The cached table.
+  """
+  labels = pd.read_csv(csv_path)
+  columns = []
+  codes = {}
+  for name in labels.columns:
+    values = labels[name]
+    if values.dtype.kind in 'biuf':
+      columns.append({'name': name, 'dtype': values.dtype.str})
+      continue
+    cat = pd.Categorical(values.astype(object).where(values.notna(), None))
+    categories = sorted(str(c) for c in cat.categories)
+    cat = cat.set_categories(categories)
+    codes[name] = cat.codes.astype(_code_dtype(len(categories)))
+    columns.append({'name': name, 'dtype': codes[name].dtype.str,
+      'categories': categories})
+  mission = codes['mission']
+  cls = codes['class']
+  date = codes['date']
+  order = np.lexsort((date, cls, mission))
+  missdate_order = np.lexsort((cls[order], date[order], mission[order]))
+  date_order = np.lexsort((mission[order], date[order]))
+
+  if not os.path.exists(os.path.join(cache_dir, 'columns')):
+    os.makedirs(os.path.join(cache_dir, 'columns'))
+  for i, col in enumerate(columns):
+    name = col['name']
+    values = codes[name] if name in codes else labels[name].values
+    np.save(os.path.join(cache_dir, 'columns', '%d.npy' % i), values[order])
+  np.save(os.path.join(cache_dir, 'missdate_rows.npy'),
+    missdate_order.astype(np.int32))
+  np.save(os.path.join(cache_dir, 'date_rows.npy'), date_order.astype(np.int32))
+
+  cats = {c['name']: c.get('categories') for c in columns}
+  m = _decode(mission[order], cats['mission'])
+  c = _decode(cls[order], cats['class'])
+  d = _decode(date[order], cats['date'])
+  meta = {
+    'format': CACHE_FORMAT, 'source': os.path.abspath(csv_path),
+    'stamp': _source_stamp(csv_path), 'rows': len(labels),
+    'columns': columns,
+    'mission': _ranges(m),
+    'mission_class': _ranges([a + KEY_SEP + b for a, b in zip(m, c)]),
+    'missdate': _ranges([m[i] + KEY_SEP + d[i] for i in missdate_order]),
+    'date': _ranges([d[i] for i in date_order])}
+  tmp = os.path.join(cache_dir, 'meta.json.tmp')
+  with open(tmp, 'w') as f:
+    json.dump(meta, f)
+  os.replace(tmp, os.path.join(cache_dir, 'meta.json'))
+  return LabelTable(cache_dir)
+
+
+def load_table(csv_path, cache_dir = LABEL_CACHE):
+  """
+  Opens the cached copy of a label CSV, building it on first use or when the
+  CSV has changed.
+
+  Args:
+      csv_path (str): The label table, e.g.
+          'data/labels/collated_labels_with_additional_data_LS8_LS9_v2024-04-25.csv'.
+      cache_dir (str): Parent directory of the caches.
+
+  Returns:
+      LabelTable: The cached table.
+  """
+  path = os.path.join(cache_dir, os.path.splitext(os.path.basename(csv_path))[0])
+  meta_path = os.path.join(path, 'meta.json')
+  if os.path.exists(meta_path):
+    with open(meta_path) as f:
+      meta = json.load(f)
+    if (meta.get('format') == CACHE_FORMAT and
+        meta.get('stamp') == _source_stamp(csv_path)):
+      return LabelTable(path)
+  return build_cache(csv_path, path)
+
+
+class LabelTable(object):
+  """
+  A cached label table. Row selections are a slice (a view of every column)
+  when the rows are contiguous in the (mission, class, date) order, and an
+  array of row numbers otherwise.
+
+  Args:
+      path (str): Cache directory, made with build_cache().
+  """
+
+  def __init__(self, path):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as f:
+      self.meta = json.load(f)
+    self.columns = [c['name'] for c in self.meta['columns']]
+    self._info = {c['name']: (i, c) for i, c in enumerate(self.meta['columns'])}
+    self._arrays = {}
+
+  def __len__(self):
+    return self.meta['rows']
+
+  def _array(self, name):
+    if name not in self._arrays:
+      if name in ('missdate_rows', 'date_rows'):
+        path = os.path.join(self.path, name + '.npy')
+      else:
+        path = os.path.join(self.path, 'columns', '%d.npy' % self._info[name][0])
+      self._arrays[name] = np.load(path, mmap_mode = 'r')
+    return self._arrays[name]
+
+  def categories(self, name):
+    """
+    Returns:
+        list: The categories of a text column, None for numeric columns.
+    """
+    return self._info[name][1].get('categories')
+
+  def _date_bounds(self, start, end):
+    dates = self.categories('date')
+    lo = 0 if start is None else int(np.searchsorted(dates, start, 'left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, end, 'left'))
+    return lo, hi
+
+  def rows(self, mission = None, cls = None, start = None, end = None,
+           year = None, missDate = None):
+    """
+    Selects rows using the precomputed indexes.
+
+    Args:
+        mission (str): Label table mission, e.g. 'LS8' or 'SEN2', MISSING
+            for the rows without one.
+        cls (str): Class, e.g. 'offShoreSediment'.
+        start, end (str): Date range 'YYYY-MM-dd', start inclusive and end
+            exclusive. Rows without a date are never in a date range.
+        year (int): Shortcut for start = '<year>', end = '<year + 1>'.
+        missDate (str): An image missDate ('LANDSAT_8_2020-08-11') or label
+            key ('LS8|2020-08-11'); the other arguments are ignored.
+
+    Returns:
+        slice or np.ndarray: The rows.
+    """
+    if missDate is not None:
+      key = missDate if KEY_SEP in missDate else missdate_key(missDate)
+      s, e = self.meta['missdate'].get(key, (0, 0))
+      return self._array('missdate_rows')[s:e]
+    if year is not None:
+      start, end = str(year), str(int(year) + 1)
+    dated = start is not None or end is not None
+    lo, hi = self._date_bounds(start, end)
+    if mission is not None and cls is not None:
+      s, e = self.meta['mission_class'].get(mission + KEY_SEP + cls, (0, 0))
+      if dated:
+        date = self._array('date')[s:e]
+        s, e = (s + int(np.searchsorted(date, lo, 'left')),
+          s + int(np.searchsorted(date, hi, 'left')))
+      return slice(s, e)
+    if mission is not None:
+      s, e = self.meta['mission'].get(mission, (0, 0))
+      if not dated:
+        return slice(s, e)
+      index = self._array('missdate_rows')[s:e]
+      date = self._array('date')[index]
+      return index[np.searchsorted(date, lo, 'left'):
+        np.searchsorted(date, hi, 'left')]
+    if dated:
+      index = self._array('date_rows')
+      date = self._array('date')[index]
+      index = index[np.searchsorted(date, lo, 'left'):
+        np.searchsorted(date, hi, 'left')]
+    else:
+      index = slice(0, len(self))
+    if cls is not None:
+      codes = self._array('class')[index]
+      categories = self.categories('class')
+      if cls == MISSING:
+        code = -1
+      else:
+        code = categories.index(cls) if cls in categories else -2
+      index = np.arange(len(self))[index][codes == code]
+    return index
+
+  def column(self, name, rows = None):
+    """
+    One column of the selected rows: a view of the memory map for slices,
+    integer codes for text columns (see categories()).
+    """
+    values = self._array(name)
+    return values if rows is None else values[rows]
+
+  def frame(self, rows = None, columns = None):
+    """
+    The selected rows as a DataFrame with categorical text columns.
+    """
+    data = {}
+    for name in columns or self.columns:
+      values = self.column(name, rows)
+      categories = self.categories(name)
+      if categories is not None:
+        values = pd.Categorical.from_codes(values, categories)
+      data[name] = values
+    return pd.DataFrame(data)
+
+  def select(self, columns = None, **query):
+    """
+    Shortcut for frame(rows(**query), columns), e.g.
+    `table.select(mission = 'LS8', cls = 'offShoreSediment', year = 2019)`.
+    """
+    return self.frame(self.rows(**query), columns)
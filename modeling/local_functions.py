@@ -0,0 +1,472 @@
+# modules
+import collections
+import glob
+import os
+import re
+
+import numpy as np
+
+# Local (NumPy) versions of the image functions in gee_functions.py and
+# eePlumB/2_data_ingestion/re_pull_functions.py. Images are LocalImage objects:
+# an ordered set of named 2D band arrays that share one boolean mask (True is a
+# valid pixel), plus a dictionary of properties. The image functions take the
+# same arguments as their Earth Engine counterparts and follow the same
+# arithmetic: scaled bands are float64 (the type ee uses for non-integer
+# constants), while QA bit fields and comparisons are compact uint8 bands.
+# Most keep the ee name; the exceptions are
+#   applyScaleFactors_57  re_pull_functions.applyScaleFactors (Landsat 5/7
+#                         optical, thermal, opacity and cloud distance bands;
+#                         applyScaleFactors here is the optical-only version
+#                         of gee_functions.py)
+#   addImageDate(_S2)     read the date from DATE_ACQUIRED instead of
+#                         system:time_start
+# and qa_bands, run_chain and the reading functions, which have no ee
+# counterpart.
+
+
+class LocalImage(object):
+  """
+  In-memory stand-in for an ee.Image.
+
+  ee keeps a mask per band, this class keeps one mask for the whole image. The
+  image functions give the same results as ee because they only ever mask with
+  a single band mask (which ee applies to every band) and only add bands
+  computed from the already masked image. Results differ from ee where bands
+  carry their own masks:
+    - bands read from files with a nodata value are all valid here, in ee only
+      that band is masked where it is nodata;
+    - addBands() with bands of another image gives them this image's mask, ee
+      keeps the mask they came with;
+    - updateMask() with a multi-band mask masks band by band in ee, here it
+      must be a single 2D array.
+
+  Args:
+      bands (dict): Band name -> 2D array, all of the same shape.
+      mask (np.ndarray): Boolean array, True where pixels are valid. Defaults
+          to all valid.
+      properties (dict): Image properties (e.g. SPACECRAFT_ID, DATE_ACQUIRED).
+  """
+
+  def __init__(self, bands, mask = None, properties = None):
+    self.bands = collections.OrderedDict(bands)
+    shape = next(iter(self.bands.values())).shape
+    self.mask = np.ones(shape, dtype = bool) if mask is None else mask
+    self.properties = dict(properties or {})
+
+  def bandNames(self):
+    return list(self.bands)
+
+  def band(self, name):
+    return self.bands[name]
+
+  def select(self, pattern):
+    """
+    Selects bands by name or regular expression, like ee.Image.select().
+
+    Args:
+        pattern (str or list): A band name/regex or a list of them.
+
+    Returns:
+        LocalImage: The selected bands, with the same mask and properties.
+    """
+    patterns = [pattern] if isinstance(pattern, str) else list(pattern)
+    names = [n for p in patterns for n in self.bands if re.fullmatch(p, n)]
+    return LocalImage(((n, self.bands[n]) for n in names), self.mask,
+      self.properties)
+
+  def addBands(self, bands, overwrite = False):
+    """
+    Adds bands, like ee.Image.addBands(). Existing bands are only replaced if
+    overwrite is True.
+
+    Args:
+        bands (dict or LocalImage): The bands to add.
+        overwrite (bool): Replace bands with the same name.
+
+    Returns:
+        LocalImage: The image with the added bands.
+    """
+    if isinstance(bands, LocalImage):
+      bands = bands.bands
+    out = collections.OrderedDict(self.bands)
+    for name, arr in bands.items():
+      if name in out and not overwrite:
+        continue
+      out[name] = arr
+    return LocalImage(out, self.mask, self.properties)
+
+  def updateMask(self, mask):
+    """
+    Masks pixels where `mask` is False/0, keeping pixels that are already masked
+    masked, like ee.Image.updateMask().
+    """
+    return LocalImage(self.bands, self.mask & (mask != 0), self.properties)
+
+  def set(self, name, value):
+    properties = dict(self.properties)
+    properties[name] = value
+    return LocalImage(self.bands, self.mask, properties)
+
+  def get(self, name):
+    return self.properties.get(name)
+
+
+def run_chain(image, functions):
+  """
+  Applies a list of image functions in order, the local counterpart of a chain
+  of ImageCollection.map() calls.
+
+  Args:
+      image (LocalImage): The image to process.
+      functions (list): The image functions, in order.
+
+  Returns:
+      LocalImage: The processed image.
+  """
+  for f in functions:
+    image = f(image)
+  return image
+
+
+####--------------------------####
+#### reading tiles from disk  ####
+####--------------------------####
+
+def read_bands(paths, properties = None):
+  """
+  Reads single band GeoTIFFs into a LocalImage. Requires rasterio.
+
+  Args:
+      paths (dict): Band name -> path of the GeoTIFF holding that band.
+      properties (dict): Image properties to attach.
+
+  Returns:
+      LocalImage: The image, with the raster profile of the first band stored
+      in the 'profile' property.
+  """
+  import rasterio
+  bands = collections.OrderedDict()
+  properties = dict(properties or {})
+  for name, path in paths.items():
+    with rasterio.open(path) as src:
+      bands[name] = src.read(1)
+      properties.setdefault('profile', src.profile)
+  return LocalImage(bands, properties = properties)
+
+
+def landsat_band_paths(directory):
+  """
+  Finds the band files of an unpacked Collection 2 Level 2 Landsat scene, e.g.
+  LC08_L2SP_026027_20200811_20200918_02_T1_SR_B2.TIF -> 'SR_B2'.
+
+  Args:
+      directory (str): The scene directory.
+
+  Returns:
+      dict: Band name -> path.
+  """
+  paths = collections.OrderedDict()
+  for path in sorted(glob.glob(os.path.join(directory, '*.TIF'))):
+    m = re.search(r'_((?:SR|ST|QA)_[A-Z0-9_]+)\.TIF$', path)
+    if m:
+      paths[m.group(1)] = path
+  return paths
+
+
+def read_landsat_scene(directory):
+  """
+  Reads an unpacked Collection 2 Level 2 Landsat scene, setting SPACECRAFT_ID
+  and DATE_ACQUIRED from the product id in the file names.
+
+  Args:
+      directory (str): The scene directory.
+
+  Returns:
+      LocalImage: The scene.
+  """
+  paths = landsat_band_paths(directory)
+  product = os.path.basename(next(iter(paths.values())))
+  sensor, _, _, date = product.split('_')[:4]
+  properties = {
+    'SPACECRAFT_ID': 'LANDSAT_' + str(int(sensor[2:4])),
+    'DATE_ACQUIRED': date[:4] + '-' + date[4:6] + '-' + date[6:8]}
+  return read_bands(paths, properties)
+
+
+####--------------------------####
+#### helper functions         ####
+####--------------------------####
+
+# function to split QA bits
+def extract_qa_bits(qa_band, start_bit, end_bit, band_name = None):
+  """
+  Extracts specified quality assurance (QA) bits from a QA band array, like
+  gee_functions.extract_qa_bits.
+
+  Args:
+      qa_band (np.ndarray): The QA band to extract the bits from.
+      start_bit (int): The start bit of the QA bits to extract.
+      end_bit (int): The end bit of the QA bits to extract (not inclusive)
+      band_name (str): Unused, kept for the same call signature as ee.
+
+  Returns:
+      np.ndarray: The extracted QA bit values, same dtype as qa_band.
+  """
+  qa_bits = 0
+  for bit in range(end_bit):
+    qa_bits += (1 << bit)
+  return (qa_band & qa_bits) >> start_bit
+
+
+# QA bit fields: (band name, start bit, end bit (not inclusive), mask at), the
+# same tables as in gee_functions.py (checked by tests/test_gee_functions.py)
+QA_PIXEL_SPEC = [
+  ('cirrus_conf', 14, 16, 3),
+  ('snowice_conf', 12, 14, 3),
+  ('cloudshad_conf', 10, 12, 3),
+  ('cloud_conf', 8, 10, 3),
+  ('dialated_cloud', 1, 2, None)]
+QA_AEROSOL_SPEC = [('aero_level', 6, 8, 3)]
+QA60_SPEC = [
+  ('cirrus', 11, 12, 1),
+  ('opaque', 10, 11, 1)]
+
+
+def decode_qa_bits(qa_band, spec):
+  """
+  Unpacks every QA bit field of a spec table in one vectorized pass.
+
+  Args:
+      qa_band (np.ndarray): The QA band, any unsigned integer type.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      np.ndarray: uint8 array of shape (number of fields,) + qa_band.shape.
+  """
+  starts = np.array([f[1] for f in spec], dtype = qa_band.dtype)
+  widths = np.array([(1 << (f[2] - f[1])) - 1 for f in spec], dtype = qa_band.dtype)
+  shape = (len(spec),) + (1,) * qa_band.ndim
+  stack = (qa_band[np.newaxis] >> starts.reshape(shape)) & widths.reshape(shape)
+  return stack.astype(np.uint8)
+
+
+def qa_mask(qa_band, spec):
+  """
+  Boolean mask that is True where every field of the spec with a 'mask at'
+  value is below that value.
+
+  Args:
+      qa_band (np.ndarray): The QA band.
+      spec (list): QA field table, e.g. QA_PIXEL_SPEC.
+
+  Returns:
+      np.ndarray: Boolean array of the QA band shape.
+  """
+  fields = [f for f in spec if f[3] is not None]
+  limits = np.array([f[3] for f in fields], dtype = np.uint8)
+  limits = limits.reshape((len(fields),) + (1,) * qa_band.ndim)
+  return (decode_qa_bits(qa_band, fields) < limits).all(axis = 0)
+
+
+def qa_bands(qa_band, spec):
+  """
+  Decodes a spec into a dictionary of named uint8 bands for addBands().
+  """
+  stack = decode_qa_bits(qa_band, spec)
+  return collections.OrderedDict((f[0], stack[i]) for i, f in enumerate(spec))
+
+
+def _eq(band, value):
+  return (band == value).astype(np.uint8)
+
+
+def addImageDate(image):
+  """
+  Adds the mission-date ('LANDSAT_8_2020-08-11') to the image properties, using
+  SPACECRAFT_ID and DATE_ACQUIRED.
+  """
+  missDate = image.get('SPACECRAFT_ID') + '_' + image.get('DATE_ACQUIRED')
+  return image.set('missDate', missDate)
+
+
+def addImageDate_S2(image):
+  """
+  Adds the mission-date ('Sentinel-2A_2020-07-12') to the image properties,
+  using SPACECRAFT_NAME and DATE_ACQUIRED.
+  """
+  missDate = image.get('SPACECRAFT_NAME') + '_' + image.get('DATE_ACQUIRED')
+  return image.set('missDate', missDate)
+
+
+####--------------------------####
+#### Landsat shared functions ####
+####--------------------------####
+
+def apply_radsat_mask(image):
+  """
+  Masks saturated pixels in a Landsat image.
+  """
+  return image.updateMask(image.band('QA_RADSAT') == 0)
+
+
+def _scale(image, pattern, mult, add = None):
+  scaled = collections.OrderedDict()
+  for n, arr in image.select(pattern).bands.items():
+    scaled[n] = arr * mult if add is None else arr * mult + add
+  return scaled
+
+
+def applyScaleFactors(image):
+  """
+  Applies scaling factors to the optical bands of any Landsat 4-9 image
+  (gee_functions.applyScaleFactors).
+  """
+  return image.addBands(_scale(image, 'SR_B.', 0.0000275, -0.2), True)
+
+
+def applyScaleFactors_57(image):
+  """
+  Applies scaling factors to the optical, thermal, opacity and cloud distance
+  bands of Landsat 5/7 (re_pull_functions.applyScaleFactors).
+  """
+  return (image
+    .addBands(_scale(image, 'SR_B.', 0.0000275, -0.2), True)
+    .addBands(_scale(image, 'ST_B.', 0.00341802, 149.0), True)
+    .addBands(_scale(image, 'SR_ATMOS_OPACITY', 0.001), True)
+    .addBands(_scale(image, 'ST_CDIST', 0.01), True))
+
+
+def applyScaleFactors_89(image):
+  """
+  Applies scaling factors to the optical, thermal and cloud distance bands of
+  Landsat 8/9 (re_pull_functions.applyScaleFactors_89).
+  """
+  return (image
+    .addBands(_scale(image, 'SR_B.', 0.0000275, -0.2), True)
+    .addBands(_scale(image, 'ST_B..', 0.00341802, 149.0), True)
+    .addBands(_scale(image, 'ST_CDIST', 0.01), True))
+
+
+def flag_qa_conf(image):
+  """
+  Adds the cirrus, snow/ice, cloud shadow and cloud confidence and the dilated
+  cloud flag from QA_PIXEL as bands.
+  """
+  return image.addBands(qa_bands(image.band('QA_PIXEL'), QA_PIXEL_SPEC))
+
+
+def mask_qa_flags(image):
+  """
+  Masks pixels with high cirrus, snow/ice, cloud shadow or cloud confidence.
+  """
+  return image.updateMask(qa_mask(image.band('QA_PIXEL'), QA_PIXEL_SPEC))
+
+
+####--------------------------####
+#### Landsat 5/7 functions    ####
+####--------------------------####
+
+def mask_high_atmos_opac(image):
+  """
+  Masks pixels with a scaled atmospheric opacity of 0.3 or more.
+  """
+  atmos = image.band('SR_ATMOS_OPACITY') * 0.001
+  return image.updateMask(atmos < 0.3)
+
+
+####--------------------------####
+#### Landsat 8/9 functions    ####
+####--------------------------####
+
+def flag_high_aerosol(image):
+  """
+  Adds the aerosol level (SR_QA_AEROSOL bits 6-7) as the 'aero_level' band.
+  """
+  return image.addBands(qa_bands(image.band('SR_QA_AEROSOL'), QA_AEROSOL_SPEC))
+
+
+def mask_high_aerosol(image):
+  """
+  Masks pixels with a high aerosol level.
+  """
+  return image.updateMask(qa_mask(image.band('SR_QA_AEROSOL'), QA_AEROSOL_SPEC))
+
+
+####--------------------------####
+#### Sentinel 2 functions     ####
+####--------------------------####
+
+def applyScaleFactors_S2(image):
+  """
+  Applies scaling factors to the optical bands of Sentinel 2 and renames them
+  with the 'SR_' prefix, placing them after the remaining bands.
+  """
+  optical = image.select('B.*')
+  keep = [n for n in image.bandNames() if n not in optical.bands]
+  scaled = collections.OrderedDict(('SR_' + n, arr * 0.0001)
+    for n, arr in optical.bands.items())
+  return image.select(keep).addBands(scaled, True)
+
+
+def apply_sat_defect_mask(image):
+  """
+  Masks saturated and defective pixels according to the SCL band.
+  """
+  return image.updateMask(image.band('SCL') != 1)
+
+
+def add_qa_info_s2(image):
+  """
+  Parses the SCL classes into separate 1/0 presence/absence bands.
+  """
+  scl = image.band('SCL')
+  return image.addBands(collections.OrderedDict([
+    ('dark_pixel', _eq(scl, 2)),
+    ('cloud_shadow', _eq(scl, 3)),
+    ('water', _eq(scl, 6)),
+    ('low_prob_cloud', _eq(scl, 7)),
+    ('med_prob_cloud', _eq(scl, 8)),
+    ('hi_prob_cloud', _eq(scl, 9)),
+    ('cirrus_scl', _eq(scl, 10)),
+    ('snow_ice', _eq(scl, 11))]))
+
+
+def mask_SCL_qa(image):
+  """
+  Masks cirrus, snow/ice, cloud shadow, dark pixels and med/high prob cloud
+  according to the SCL classification.
+  """
+  scl = image.band('SCL')
+  return image.updateMask(~np.isin(scl, [2, 3, 8, 9, 10, 11]))
+
+
+def flag_cirrus_opaque(image):
+  """
+  Adds the QA60 cirrus (bit 11) and opaque cloud (bit 10) flags as bands.
+  """
+  return image.addBands(qa_bands(image.band('QA60'), QA60_SPEC))
+
+
+def mask_cirrus_opaque(image):
+  """
+  Masks pixels where the QA60 band indicates cirrus or opaque clouds.
+  """
+  return image.updateMask(qa_mask(image.band('QA60'), QA60_SPEC))
+
+
+####--------------------------####
+#### sensor harmonization     ####
+####--------------------------####
+
+def applyHarmonization(image, harmonization):
+  """
+  Maps the optical bands onto the reference bands with one matrix multiply of
+  the band stack (gee_functions.applyHarmonization).
+  """
+  stack = np.stack([image.band(b) for b in harmonization.bands_in])
+  out = np.tensordot(harmonization.matrix, stack, axes = 1)
+  out += harmonization.offset.reshape((-1,) + (1,) * (stack.ndim - 1))
+  drop = set(harmonization.bands_in) | set(harmonization.bands_out)
+  keep = [n for n in image.bandNames() if n not in drop]
+  return image.select(keep).addBands(collections.OrderedDict(
+    zip(harmonization.bands_out, out)), True)
@@ -0,0 +1,286 @@
+# modules
+import os
+import statistics
+import sys
+
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if HERE not in sys.path:
+  sys.path.insert(0, HERE)
+import gtb_functions as gtb
+
+# Label consistency and outlier screening of every mission and class at once,
+# in place of the per-mission checks of the 02_-06_*_out_class_analysis
+# scripts. Per (mission, class) group it computes, for all SR_B* bands in one
+# sort, the median/MAD and the quartiles (the rstatix::identify_outliers()
+# 'extreme' rule, beyond 3 * IQR), and the Mahalanobis distance of each label's
+# band ratios to its group. The QA rules of the out-class analyses (the bands
+# added by flag_qa_conf, flag_high_aerosol, add_qa_info_s2 and
+# flag_cirrus_opaque) are applied as flags. Cloud labels are never QA flagged.
+
+LABEL_FILES = ['LS5_LS7', 'LS8_LS9', 'SEN2']
+
+ID_COLUMNS = ['system:index', 'mission', 'date', 'class', 'vol_init']
+
+# per label table mission: (column, threshold) pairs, flagged where
+# value >= threshold, as in the *_training_labels filters
+QA_RULES = {
+  'LS5': [('SR_ATMOS_OPACITY', 0.3), ('cloud_conf', 2), ('cloudshad_conf', 2),
+          ('snowice_conf', 2)],
+  'LS7': [('SR_ATMOS_OPACITY', 0.3), ('cloud_conf', 2), ('cloudshad_conf', 2),
+          ('snowice_conf', 2)],
+  'LS8': [('aero_level', 3), ('cirrus_conf', 3), ('cloud_conf', 3),
+          ('cloudshad_conf', 3), ('snowice_conf', 3)],
+  'LS9': [('aero_level', 3), ('cirrus_conf', 3), ('cloud_conf', 3),
+          ('cloudshad_conf', 3), ('snowice_conf', 3)],
+  'SEN2': [('cirrus', 1), ('cirrus_scl', 1), ('cloud_shadow', 1),
+           ('dark_pixel', 1), ('hi_prob_cloud', 1), ('med_prob_cloud', 1),
+           ('opaque', 1), ('snow_ice', 1)]}
+
+# label table mission -> GTB input features, used for the band ratios
+RATIO_FEATURES = {info['mission']: info['features']
+  for info in gtb.MISSIONS.values()}
+
+
+def load_all_labels(label_dir = 'data/labels', label_date = '2024-04-25'):
+  """
+  Reads and stacks the collated label tables of all missions.
+
+  Returns:
+      pd.DataFrame: The labels of LS5, LS7, LS8, LS9 and SEN2.
+  """
+  return pd.concat([pd.read_csv(os.path.join(label_dir,
+    'collated_labels_with_additional_data_' + name + '_v' + label_date +
+    '.csv')) for name in LABEL_FILES], ignore_index = True, sort = False)
+
+
+def group_quantiles(x, group, n_groups, q):
+  """
+  Quantiles (R type 7, as quantile() and rstatix) of every column of x per
+  group, from one sort; NaNs are ignored.
+
+  Args:
+      x (np.ndarray): (rows, columns) values.
+      group (np.ndarray): Group index of every row.
+      n_groups (int): Number of groups.
+      q (list): Probabilities.
+
+  Returns:
+      np.ndarray: (groups, columns, len(q)) quantiles, NaN for empty groups.
+  """
+  n_cols = x.shape[1]
+  keys = (group[:, None] * n_cols + np.arange(n_cols)).ravel()
+  values = x.ravel()
+  valid = ~np.isnan(values)
+  keys, values = keys[valid], values[valid]
+  order = np.lexsort((values, keys))
+  keys, values = keys[order], values[order]
+  counts = np.bincount(keys, minlength = n_groups * n_cols)
+  starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+  out = np.full((n_groups * n_cols, len(q)), np.nan)
+  has = counts > 0
+  for j, p in enumerate(q):
+    h = (counts[has] - 1) * p
+    lo = np.floor(h).astype(np.int64)
+    hi = np.minimum(lo + 1, counts[has] - 1)
+    base = starts[has]
+    out[has, j] = values[base + lo] + (h - lo) * (values[base + hi] -
+      values[base + lo])
+  return out.reshape(n_groups, n_cols, len(q))
+
+
+def band_ratios(labels, missions = None):
+  """
+  Normalized differences (a - b) / (|a| + |b|) of consecutive GTB input
+  features of every label, padded with NaN to the longest feature list.
+
+  Returns:
+      tuple: (ratio array of shape (rows, ratios), number of ratios per row)
+  """
+  missions = labels['mission'].values if missions is None else missions
+  n_ratio = max(len(f) for f in RATIO_FEATURES.values()) - 1
+  ratios = np.full((len(labels), n_ratio), np.nan)
+  k = np.zeros(len(labels), dtype = np.int64)
+  for mission, features in RATIO_FEATURES.items():
+    rows = np.flatnonzero(missions == mission)
+    if len(rows) == 0:
+      continue
+    x = labels[features].values[rows].astype(np.float64)
+    a, b = x[:, :-1], x[:, 1:]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      ratios[rows, :len(features) - 1] = (a - b) / (np.abs(a) + np.abs(b))
+    k[rows] = len(features) - 1
+  return ratios, k
+
+
+def mahalanobis(x, group, n_groups, k):
+  """
+  Mahalanobis distance of every row to the mean of its group, using the
+  group's covariance (pseudo-inverse); the NaN padding of rows with fewer
+  than x.shape[1] values is treated as constant zeros.
+
+  Args:
+      x (np.ndarray): (rows, features) values.
+      group (np.ndarray): Group index of every row.
+      n_groups (int): Number of groups.
+      k (np.ndarray): Number of real features of every row.
+
+  Returns:
+      np.ndarray: Squared distances, NaN where a real feature is missing or
+      the group has fewer than two complete rows.
+  """
+  padded = np.arange(x.shape[1])[None, :] >= k[:, None]
+  complete = ~np.isnan(np.where(padded, 0, x)).any(axis = 1)
+  z = np.where(padded | ~complete[:, None], 0, x)
+  n = np.bincount(group[complete], minlength = n_groups).astype(np.float64)
+  sums = np.zeros((n_groups, x.shape[1]))
+  np.add.at(sums, group[complete], z[complete])
+  cross = np.zeros((n_groups, x.shape[1], x.shape[1]))
+  np.add.at(cross, group[complete], z[complete, :, None] * z[complete, None, :])
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    mean = sums / n[:, None]
+    cov = (cross - n[:, None, None] * mean[:, :, None] * mean[:, None, :]) / (
+      n[:, None, None] - 1)
+  ok = n >= 2
+  inv = np.zeros_like(cov)
+  if ok.any():
+    inv[ok] = np.linalg.pinv(cov[ok], hermitian = True)
+  d = z - mean[group]
+  d2 = np.einsum('ni,nij,nj->n', d, inv[group], d)
+  d2[~complete | ~ok[group]] = np.nan
+  return d2
+
+
+def chi2_quantile(p, k):
+  """
+  Chi-square quantile with k degrees of freedom: scipy.stats.chi2.ppf() when
+  scipy is installed, otherwise the Wilson-Hilferty approximation. At
+  p = 0.999 the approximation is 1.2% (k = 5, Landsat) and 0.7% (k = 9,
+  Sentinel 2) above the exact quantile, and at most 3% for k = 1, so it flags
+  slightly fewer labels than the exact threshold.
+  """
+  k = np.asarray(k, dtype = np.float64)
+  try:
+    from scipy import stats
+  except ImportError:
+    stats = None
+  if stats is not None:
+    return stats.chi2.ppf(p, k)
+  z = statistics.NormalDist().inv_cdf(p)
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    return k * (1 - 2 / (9 * k) + z * np.sqrt(2 / (9 * k))) ** 3
+
+
+def qa_flags(labels):
+  """
+  The QA_RULES flags of every label.
+
+  Returns:
+      pd.DataFrame: One boolean 'qa_<column>' column per QA column and 'qa'
+      (any flag), all False for cloud labels.
+  """
+  missions = labels['mission'].values
+  not_cloud = labels['class'].values != 'cloud'
+  flags = {}
+  for mission, rules in QA_RULES.items():
+    rows = missions == mission
+    for column, threshold in rules:
+      if column not in labels:
+        continue
+      name = 'qa_' + column
+      if name not in flags:
+        flags[name] = np.zeros(len(labels), dtype = bool)
+      flags[name] |= rows & not_cloud & (labels[column].values >= threshold)
+  flags = pd.DataFrame(flags, index = labels.index)
+  flags['qa'] = flags.any(axis = 1)
+  return flags
+
+
+def screen_labels(labels, mad_z = 3.5, iqr_k = 3, min_bands = 3,
+                  p_mahalanobis = 0.999):
+  """
+  Screens labels of any number of missions for spectral outliers and QA
+  flags.
+
+  Args:
+      labels (pd.DataFrame): Stacked label tables, e.g. load_all_labels().
+      mad_z (float): Robust z-score 0.6745 * |x - median| / MAD above which a
+          band is an outlier.
+      iqr_k (float): A band is 'extreme' beyond iqr_k * IQR from the quartiles
+          (3 in rstatix::identify_outliers()).
+      min_bands (int): Number of extreme bands that flag a label, as in the
+          out-class analyses.
+      p_mahalanobis (float): Chi-square probability above which the band ratio
+          distance flags a label.
+
+  Returns:
+      pd.DataFrame: One row per label: the ID_COLUMNS, the number of MAD and
+      extreme bands, the '; '-separated extreme bands, the squared Mahalanobis
+      distance, the QA flags and the combined flags 'flag_spectral',
+      'flag_mahalanobis' and 'flag_qa'.
+  """
+  bands = sorted((c for c in labels.columns if c.startswith('SR_B')),
+    key = lambda b: (len(b), b))
+  groups = labels['mission'].astype(str) + '|' + labels['class'].astype(str)
+  group, names = pd.factorize(groups)
+  x = labels[bands].values.astype(np.float64)
+
+  stats = group_quantiles(x, group, len(names), [0.25, 0.5, 0.75])
+  q1, med, q3 = stats[group, :, 0], stats[group, :, 1], stats[group, :, 2]
+  mad = group_quantiles(np.abs(x - med), group, len(names), [0.5])[group, :, 0]
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    robust_z = 0.6745 * np.abs(x - med) / mad
+  mad_out = robust_z > mad_z
+  iqr = q3 - q1
+  extreme = (x < q1 - iqr_k * iqr) | (x > q3 + iqr_k * iqr)
+
+  ratios, k = band_ratios(labels)
+  d2 = mahalanobis(ratios, group, len(names), k)
+
+  table = labels[[c for c in ID_COLUMNS if c in labels]].copy()
+  table['n_bands_mad'] = mad_out.sum(axis = 1)
+  table['n_bands_extreme'] = extreme.sum(axis = 1)
+  names_out = np.array(bands, dtype = object)
+  table['bands_extreme'] = ['; '.join(names_out[row]) for row in extreme]
+  table['mahalanobis'] = d2
+  qa = qa_flags(labels)
+  for column in qa:
+    table[column] = qa[column].values
+  table['flag_spectral'] = table['n_bands_extreme'] >= min_bands
+  with np.errstate(invalid = 'ignore'):
+    table['flag_mahalanobis'] = d2 > chi2_quantile(p_mahalanobis, k)
+  table['flag_qa'] = table.pop('qa')
+  return table
+
+
+def screen_all(label_dir = 'data/labels', label_date = '2024-04-25', out = None,
+               **kwargs):
+  """
+  Screens the label tables of all missions and optionally writes the flag
+  table as CSV.
+
+  Args:
+      label_dir (str): Directory of the label tables.
+      label_date (str): Version date of the label tables.
+      out (str): CSV path for the flag table, None to skip writing.
+      **kwargs: Passed to screen_labels().
+
+  Returns:
+      pd.DataFrame: The flag table.
+  """
+  table = screen_labels(load_all_labels(label_dir, label_date), **kwargs)
+  if out is not None:
+    table.to_csv(out, index = False)
+  return table
+
+
+def flag_summary(table):
+  """
+  Number of labels and flagged labels per mission and class.
+  """
+  flags = ['flag_spectral', 'flag_mahalanobis', 'flag_qa']
+  summary = table.groupby(['mission', 'class'])[flags].sum()
+  summary.insert(0, 'n_labels', table.groupby(['mission', 'class']).size())
+  return summary.reset_index()
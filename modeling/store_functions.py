@@ -0,0 +1,220 @@
+# modules
+import collections
+import json
+import os
+import re
+
+import numpy as np
+
+# Chunked, time-indexed store for the 'reclass' band of the classified
+# mission-dates, in place of one GeoTIFF per date. The store is a directory of
+# .npy chunk files, each holding `chunks[0]` dates of a `chunks[1]` x
+# `chunks[2]` pixel block, plus a meta.json with the grid and the list of
+# missDates. Chunks are memory-mapped, so reading one pixel's time series or
+# one date's map only touches the chunks (and pages) it needs, and appending
+# a date never rewrites earlier data.
+
+NODATA = -99
+
+
+def _write_json(path, obj):
+  tmp = path + '.tmp'
+  with open(tmp, 'w') as f:
+    json.dump(obj, f, indent = 1)
+  os.replace(tmp, path)
+
+
+def missdate_from_filename(path):
+  """
+  Gets the missDate from an exported file name, e.g.
+  GTB_v2024-04-26_LANDSAT_5_1984-06-01.tif -> 'LANDSAT_5_1984-06-01'.
+  """
+  name = os.path.splitext(os.path.basename(path))[0]
+  m = re.match(r'^GTB_(?:3class_)?v\d{4}-\d{2}-\d{2}_(.+_\d{4}-\d{2}-\d{2})',
+    name)
+  return m.group(1) if m else name
+
+
+class ReclassStore(object):
+  """
+  A chunked (date, row, col) int8 array of 'reclass' values.
+
+  Args:
+      path (str): Store directory, made with ReclassStore.create().
+      max_open (int): Number of chunk memory maps kept open (each holds a file
+          descriptor); the least recently used ones are flushed and closed.
+  """
+
+  def __init__(self, path, max_open = 64):
+    self.path = path
+    with open(os.path.join(path, 'meta.json')) as f:
+      self.meta = json.load(f)
+    self.height, self.width = self.meta['shape']
+    self.chunks = tuple(self.meta['chunks'])
+    self.times = self.meta['times']
+    self._index = {t: i for i, t in enumerate(self.times)}
+    self.max_open = max_open
+    self._open = collections.OrderedDict()
+
+  @classmethod
+  def create(cls, path, height, width, chunks = (64, 256, 256),
+             transform = None, crs = None):
+    """
+    Creates an empty store.
+
+    Args:
+        path (str): Store directory.
+        height, width (int): Grid size in pixels.
+        chunks (tuple): (dates, rows, cols) per chunk.
+        transform (list): Affine transform of the grid (6 numbers).
+        crs (str): CRS of the grid.
+
+    Returns:
+        ReclassStore: The store.
+    """
+    os.makedirs(os.path.join(path, 'chunks'))
+    _write_json(os.path.join(path, 'meta.json'), {
+      'shape': [height, width], 'chunks': list(chunks), 'dtype': 'int8',
+      'nodata': NODATA, 'transform': list(transform)[:6] if transform else None,
+      'crs': str(crs) if crs else None, 'times': []})
+    return cls(path)
+
+  def __len__(self):
+    return len(self.times)
+
+  @property
+  def shape(self):
+    return (len(self.times), self.height, self.width)
+
+  def _chunk(self, k, i, j, create = False):
+    key = (k, i, j)
+    if key in self._open:
+      self._open.move_to_end(key)
+      return self._open[key]
+    path = os.path.join(self.path, 'chunks', '%d.%d.%d.npy' % key)
+    if os.path.exists(path):
+      arr = np.load(path, mmap_mode = 'r+')
+    elif create:
+      ct, cy, cx = self.chunks
+      shape = (ct, min(cy, self.height - i * cy), min(cx, self.width - j * cx))
+      arr = np.lib.format.open_memmap(path, mode = 'w+', dtype = np.int8,
+        shape = shape)
+      arr[:] = NODATA
+    else:
+      return None
+    self._open[key] = arr
+    while len(self._open) > self.max_open:
+      # dropping the last reference unmaps the chunk and closes its file
+      self._open.popitem(last = False)[1].flush()
+    return arr
+
+  def _time_index(self, t):
+    return t if isinstance(t, (int, np.integer)) else self._index[t]
+
+  def append(self, missDate, band):
+    """
+    Adds (or, for a missDate already in the store, replaces) one date.
+
+    Args:
+        missDate (str): The missDate, e.g. 'LANDSAT_5_1984-06-01'.
+        band (np.ndarray): 2D 'reclass' band on the store's grid; -99 for no
+            data.
+
+    Returns:
+        int: The time index of the date.
+    """
+    band = np.asarray(band)
+    if band.shape != (self.height, self.width):
+      raise ValueError('Band shape ' + str(band.shape) + ' does not match the ' +
+        'store grid ' + str((self.height, self.width)))
+    t = self._index.get(missDate, len(self.times))
+    ct, cy, cx = self.chunks
+    k = t // ct
+    for i in range(0, -(-self.height // cy)):
+      for j in range(0, -(-self.width // cx)):
+        block = band[i * cy:(i + 1) * cy, j * cx:(j + 1) * cx]
+        chunk = self._chunk(k, i, j, create = (block != NODATA).any())
+        if chunk is not None:
+          chunk[t % ct] = block
+    if t == len(self.times):
+      self.times.append(missDate)
+      self._index[missDate] = t
+      self.flush()
+    return t
+
+  def append_geotiff(self, path, missDate = None):
+    """
+    Adds a downloaded GeoTIFF export. Requires rasterio.
+
+    Args:
+        path (str): The GeoTIFF, on the store's grid.
+        missDate (str): Defaults to the missDate in the file name.
+
+    Returns:
+        int: The time index of the date.
+    """
+    import rasterio
+    with rasterio.open(path) as src:
+      band = src.read(1)
+      if src.nodata is not None and src.nodata != NODATA:
+        band = np.where(band == src.nodata, NODATA, band)
+    return self.append(missDate or missdate_from_filename(path), band)
+
+  def flush(self):
+    for arr in self._open.values():
+      arr.flush()
+    self.meta['times'] = self.times
+    _write_json(os.path.join(self.path, 'meta.json'), self.meta)
+
+  def read_date(self, t, rows = None, cols = None):
+    """
+    Reads the map of one date.
+
+    Args:
+        t (str or int): missDate or time index.
+        rows, cols (slice): Optional window.
+
+    Returns:
+        np.ndarray: int8 'reclass' values.
+    """
+    return self.read(rows, cols, [t])[0]
+
+  def read_pixel(self, row, col):
+    """
+    Reads the full time series of one pixel.
+
+    Returns:
+        np.ndarray: int8 'reclass' value of every date, in the order of
+        self.times.
+    """
+    return self.read(slice(row, row + 1), slice(col, col + 1))[:, 0, 0]
+
+  def read(self, rows = None, cols = None, times = None):
+    """
+    Reads a (dates, rows, cols) block, only opening the chunks it overlaps.
+
+    Args:
+        rows, cols (slice): Window, defaults to the full grid.
+        times (list): missDates or time indices, defaults to all dates.
+
+    Returns:
+        np.ndarray: int8 array of shape (dates, rows, cols).
+    """
+    r0, r1, _ = (rows or slice(None)).indices(self.height)
+    c0, c1, _ = (cols or slice(None)).indices(self.width)
+    t_idx = (np.arange(len(self.times)) if times is None
+      else np.array([self._time_index(t) for t in times], dtype = np.int64))
+    ct, cy, cx = self.chunks
+    out = np.full((len(t_idx), r1 - r0, c1 - c0), NODATA, dtype = np.int8)
+    for k in np.unique(t_idx // ct):
+      sel = np.flatnonzero(t_idx // ct == k)
+      for i in range(r0 // cy, -(-r1 // cy)):
+        for j in range(c0 // cx, -(-c1 // cx)):
+          chunk = self._chunk(int(k), i, j)
+          if chunk is None:
+            continue
+          y0, y1 = max(r0, i * cy), min(r1, (i + 1) * cy)
+          x0, x1 = max(c0, j * cx), min(c1, (j + 1) * cx)
+          out[sel, y0 - r0:y1 - r0, x0 - c0:x1 - c0] = chunk[
+            t_idx[sel] % ct, y0 - i * cy:y1 - i * cy, x0 - j * cx:x1 - j * cx]
+    return out
@@ -0,0 +1,280 @@
+# modules
+import collections
+import itertools
+import time
+
+import ee
+
+# task states that hold one of the account's concurrent task slots. The first
+# two are the legacy ee.batch vocabulary, 'PENDING' and 'CANCELLING' are the
+# Cloud API operation states that newer versions of earthengine-api report. A
+# task whose cancellation was requested keeps its slot until it is cancelled.
+ACTIVE_STATES = ('READY', 'RUNNING', 'PENDING', 'CANCELLING', 'CANCEL_REQUESTED')
+DONE_STATES = ('COMPLETED', 'SUCCEEDED')
+FAILED_STATES = ('FAILED', 'CANCELLED')
+
+
+def describe(task):
+  """
+  Gets the description of an unstarted task.
+
+  Args:
+      task (ee.batch.Task or str): The task, or a description standing in for
+          one in dry runs.
+
+  Returns:
+      str: The task description, None if there is none.
+  """
+  if isinstance(task, str):
+    return task
+  return getattr(task, 'config', {}).get('description')
+
+
+####--------------------------####
+#### task backends            ####
+####--------------------------####
+
+class EETaskBackend(object):
+  """
+  Thin wrapper around the Earth Engine task endpoints used by the scheduler.
+  Task state comes from the structured 'state' field of the task status
+  dictionaries, not from the string representation of ee.batch.Task.
+  """
+
+  def list_states(self):
+    """
+    Lists the state of every task on the account.
+
+    Returns:
+        dict: task id -> state string
+    """
+    return {t['id']: t['state'] for t in ee.data.getTaskList()}
+
+  def start(self, task):
+    """
+    Starts an unsubmitted ee.batch.Task (e.g. from Export.image.toDrive).
+
+    Args:
+        task (ee.batch.Task): The task to start.
+
+    Returns:
+        str: The id of the started task.
+    """
+    task.start()
+    return task.id
+
+
+class FakeTaskBackend(object):
+  """
+  In-process stand-in for EETaskBackend for dry runs of an export loop without
+  an Earth Engine session. Every started task sits in 'READY' for `ready_polls`
+  calls to list_states(), then in 'RUNNING' for `run_polls` calls, and then
+  finishes as 'COMPLETED' (or 'FAILED' if its description is in `fail`).
+
+  Args:
+      ready_polls (int): Number of polls a task stays in the queue.
+      run_polls (int): Number of polls a task stays running.
+      fail (iterable): Task descriptions that should finish as 'FAILED'.
+      existing (int): Number of unrelated tasks already running on the
+          account; they complete after `run_polls` polls.
+  """
+
+  def __init__(self, ready_polls = 1, run_polls = 2, fail = (), existing = 0):
+    self.ready_polls = ready_polls
+    self.run_polls = run_polls
+    self.fail = set(fail)
+    self.tasks = collections.OrderedDict()
+    self.started = []
+    self.n_polls = 0
+    self._ids = itertools.count()
+    for i in range(existing):
+      self.tasks['existing_' + str(i)] = {'state': 'RUNNING',
+        'age': ready_polls, 'description': None}
+
+  def list_states(self):
+    self.n_polls += 1
+    states = {}
+    for task_id, t in self.tasks.items():
+      if t['state'] in ACTIVE_STATES:
+        t['age'] += 1
+        if t['age'] > self.ready_polls + self.run_polls:
+          t['state'] = 'FAILED' if t['description'] in self.fail else 'COMPLETED'
+        elif t['age'] > self.ready_polls:
+          t['state'] = 'RUNNING'
+      states[task_id] = t['state']
+    return states
+
+  def start(self, task):
+    task_id = 'FAKE' + str(next(self._ids))
+    description = describe(task) or task_id
+    self.tasks[task_id] = {'state': 'READY', 'age': 0, 'description': description}
+    self.started.append(description)
+    return task_id
+
+
+####--------------------------####
+#### submission scheduler     ####
+####--------------------------####
+
+class TaskScheduler(object):
+  """
+  Submits export tasks while keeping at most `max_active` tasks active on the
+  account. Pending tasks sit in a bounded local queue and are started as soon
+  as a poll shows a free slot. The wait between polls adapts to load: it resets
+  to `min_wait` whenever a slot frees up and grows by `backoff` (up to
+  `max_wait`) while the account stays saturated.
+
+  Listeners are called as listener(event, job) on 'submitted', 'running',
+  'completed' and 'failed' transitions of the tasks started by this scheduler.
+
+  Args:
+      max_active (int): Maximum number of active tasks on the account.
+      max_pending (int): Maximum number of tasks held in the local queue;
+          submit() blocks while the queue is full.
+      min_wait (float): Shortest wait between polls, in seconds.
+      max_wait (float): Longest wait between polls, in seconds.
+      backoff (float): Factor the wait grows by after a poll with no free slot.
+      backend: Task backend, defaults to EETaskBackend().
+      sleep (function): Sleep function, replaceable for dry runs.
+  """
+
+  def __init__(self, max_active = 10, max_pending = 100, min_wait = 5,
+               max_wait = 300, backoff = 2, backend = None, sleep = time.sleep):
+    self.max_active = max_active
+    self.max_pending = max_pending
+    self.min_wait = min_wait
+    self.max_wait = max_wait
+    self.backoff = backoff
+    self.backend = backend if backend is not None else EETaskBackend()
+    self.sleep = sleep
+    self.wait_time = min_wait
+    self.slept = 0
+    self.queue = collections.deque()
+    self.jobs = collections.OrderedDict()
+    self.listeners = []
+
+  def add_listener(self, listener):
+    """
+    Registers a function called as listener(event, job) on task transitions.
+    """
+    self.listeners.append(listener)
+
+  def remove_listener(self, listener):
+    """
+    Unregisters a function added with add_listener().
+    """
+    self.listeners.remove(listener)
+
+  def _emit(self, event, job):
+    for listener in self.listeners:
+      listener(event, job)
+
+  def submit(self, task, key = None, **tags):
+    """
+    Queues a task for submission and starts whatever the free slots allow.
+
+    Args:
+        task (ee.batch.Task): The unstarted task.
+        key (str): Identifier of the job, defaults to the task description.
+            A key can only be submitted again once its job has failed.
+        **tags: Extra fields (e.g. mission, missDate) stored with the job.
+
+    Returns:
+        dict: The job record.
+    """
+    if key is None:
+      key = describe(task) or str(len(self.jobs))
+    if key in self.jobs and self.jobs[key]['state'] not in FAILED_STATES:
+      raise ValueError('A job with the key ' + key + ' was already submitted')
+    while len(self.queue) >= self.max_pending:
+      if not self.poll():
+        self._pause()
+    job = dict(tags, key = key, task = task, id = None, state = 'QUEUED',
+      queued = time.time(), submitted = None, finished = None)
+    self.jobs[key] = job
+    self.queue.append(job)
+    self.poll()
+    return job
+
+  def poll(self):
+    """
+    Refreshes task states once and starts queued tasks into any free slots.
+
+    Returns:
+        int: The number of tasks that finished or were started in this poll.
+    """
+    states = self.backend.list_states()
+    freed = 0
+    for job in self.jobs.values():
+      if job['id'] is None or job['state'] in DONE_STATES + FAILED_STATES:
+        continue
+      state = states.get(job['id'], job['state'])
+      if state == job['state']:
+        continue
+      job['state'] = state
+      if state in DONE_STATES:
+        job['finished'] = time.time()
+        freed += 1
+        self._emit('completed', job)
+      elif state in FAILED_STATES:
+        job['finished'] = time.time()
+        freed += 1
+        self._emit('failed', job)
+      elif state == 'RUNNING':
+        self._emit('running', job)
+    n_active = sum(1 for s in states.values() if s in ACTIVE_STATES)
+    while self.queue and n_active < self.max_active:
+      job = self.queue.popleft()
+      job['id'] = self.backend.start(job['task'])
+      job['state'] = 'READY'
+      job['submitted'] = time.time()
+      n_active += 1
+      freed += 1
+      self._emit('submitted', job)
+    if freed:
+      self.wait_time = self.min_wait
+    return freed
+
+  def _pause(self):
+    self.sleep(self.wait_time)
+    self.slept += self.wait_time
+    self.wait_time = min(self.wait_time * self.backoff, self.max_wait)
+
+  def pending(self):
+    """
+    Returns:
+        int: The number of jobs that are queued or still active.
+    """
+    return sum(1 for job in self.jobs.values()
+      if job['state'] not in DONE_STATES + FAILED_STATES)
+
+  def wait(self, until_done = True):
+    """
+    Blocks until every queued task is started, and by default until every
+    started task has finished.
+
+    Args:
+        until_done (bool): If False, return once the local queue is empty.
+
+    Returns:
+        list: The job records that failed.
+    """
+    while self.queue or (until_done and self.pending()):
+      if not self.poll():
+        self._pause()
+    return [job for job in self.jobs.values() if job['state'] in FAILED_STATES]
+
+  def run(self, tasks, until_done = True):
+    """
+    Submits an iterable of tasks and waits for them.
+
+    Args:
+        tasks (iterable): Unstarted ee.batch.Task objects.
+        until_done (bool): See wait().
+
+    Returns:
+        list: The job records that failed.
+    """
+    for task in tasks:
+      self.submit(task)
+    return self.wait(until_done)
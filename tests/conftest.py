@@ -0,0 +1,43 @@
+# modules
+import os
+import sys
+
+import pytest
+
+# the modeling modules are loaded from modeling/ like in the notebooks; tests
+# that need Earth Engine run against the recording fake ee module of
+# benchmark_functions.py
+MODELING = os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), 'modeling')
+if MODELING not in sys.path:
+  sys.path.insert(0, MODELING)
+
+import benchmark_functions as bf
+
+
+@pytest.fixture
+def fake_ee():
+  ee = bf.fake_ee()
+  with bf.using(ee):
+    yield ee
+
+
+def load(name):
+  """
+  Loads a fresh copy of a modeling module, e.g. with the fake ee installed.
+  """
+  return bf.load_module(os.path.join(MODELING, name + '.py'), name + '_test')
+
+
+def find_nodes(node, name):
+  """
+  All nodes of a fake ee expression with the given function name.
+  """
+  if isinstance(node, (list, tuple)):
+    return [n for arg in node for n in find_nodes(arg, name)]
+  if not isinstance(node, bf.FakeNode):
+    return []
+  found = [node] if node._name == name else []
+  for arg in list(node._args) + list(node._kwargs.values()):
+    found += find_nodes(arg, name)
+  return found
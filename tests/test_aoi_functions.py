@@ -0,0 +1,109 @@
+# modules
+import json
+
+import numpy as np
+import pytest
+
+import aoi_functions as aoi
+import local_functions as lf
+from conftest import load
+
+TRANSFORM = [30.0, 0.0, 500015.0, 0.0, -30.0, 5300015.0]
+
+
+def _packed(tmp_path, shape = (13, 21), seed = 1):
+  # mask layers written like build_mask_layers(), without rasterizing
+  layers = np.random.default_rng(seed).random((3,) + shape) > 0.5
+  path = str(tmp_path / 'masks.npy')
+  np.save(path, np.stack([np.packbits(m.ravel()) for m in layers]))
+  with open(str(tmp_path / 'masks.json'), 'w') as f:
+    json.dump({'layers': aoi.MASK_LAYERS, 'shape': list(shape),
+      'transform': TRANSFORM, 'crs': aoi.GRID_CRS}, f)
+  return aoi.PackedMasks(path), layers
+
+
+def test_mask_windows_match_full_layers(tmp_path):
+  masks, layers = _packed(tmp_path)
+  for k, name in enumerate(aoi.MASK_LAYERS):
+    np.testing.assert_array_equal(masks.mask(name), layers[k])
+    for rows, cols in [(slice(3, 7), slice(5, 20)), (slice(12, 13), None),
+                       (slice(0, 1), slice(0, 1))]:
+      np.testing.assert_array_equal(masks.mask(name, rows, cols),
+        layers[k][rows, cols or slice(None)])
+  codes = masks.codes(block_rows = 4)
+  np.testing.assert_array_equal(codes, layers[0] | layers[1] << 1 |
+    layers[2] << 2)
+
+
+def test_mask_image_checks_the_grid(tmp_path):
+  masks, layers = _packed(tmp_path)
+  profile = {'height': 13, 'width': 21, 'transform': TRANSFORM,
+    'crs': aoi.GRID_CRS}
+  image = lf.LocalImage({'b': np.zeros((13, 21))},
+    properties = {'profile': profile})
+  masked = masks.mask_image(image, 'modeling')
+  np.testing.assert_array_equal(masked.mask, layers[0])
+  shifted = dict(profile, transform = [30.0, 0.0, 500000.0, 0.0, -30.0,
+    5300015.0])
+  with pytest.raises(ValueError):
+    masks.mask_image(lf.LocalImage({'b': np.zeros((13, 21))},
+      properties = {'profile': shifted}))
+  with pytest.raises(ValueError):
+    masks.mask_image(lf.LocalImage({'b': np.zeros((13, 20))},
+      properties = {'profile': dict(profile, width = 20)}))
+
+
+def test_ee_layer_codes_use_the_grid_transform(fake_ee):
+  aoi_ee = load('aoi_functions')
+  codes = aoi_ee.ee_layer_codes([fake_ee.FeatureCollection('a')],
+    transform = TRANSFORM)
+  assert codes._name == 'reproject'
+  assert codes._args[1:] == (aoi.GRID_CRS, TRANSFORM)
+
+
+def test_class_counts_and_frequencies_use_the_mask_layers(tmp_path):
+  import frequency_functions as ff
+  import inference_functions as inf
+  import store_functions as sf
+  masks, layers = _packed(tmp_path)
+  inside = layers[1]
+  rng = np.random.default_rng(2)
+  bands = rng.integers(1, 6, (3, 13, 21)).astype(np.int8)
+  profile = {'transform': TRANSFORM, 'crs': aoi.GRID_CRS}
+  counts = inf.class_counts(bands[0], masks = masks, profile = profile)
+  expected = np.bincount(bands[0][inside])
+  assert counts == {v: int(expected[v]) for v in np.flatnonzero(expected)}
+
+  store = sf.ReclassStore.create(str(tmp_path / 'store'), 13, 21,
+    chunks = (2, 8, 8), transform = TRANSFORM, crs = aoi.GRID_CRS)
+  for d, band in enumerate(bands):
+    store.append('LANDSAT_8_2020-06-0' + str(d + 1), band)
+  store.flush()
+  freq, _, classes = ff.count_classes(store, n_jobs = 1, masks = masks)
+  for k in range(len(classes)):
+    np.testing.assert_array_equal(freq[0, k],
+      np.where(inside, (bands == k + 1).sum(axis = 0), 0))
+  with pytest.raises(ValueError):
+    ff.count_classes(sf.ReclassStore.create(str(tmp_path / 'other'), 13, 21),
+      n_jobs = 1, masks = masks)
+
+
+def test_grid_scale_uses_the_crs_units():
+  pytest.importorskip('pyproj')
+  assert aoi.grid_scale(TRANSFORM, aoi.GRID_CRS) == 30
+  # NAD83 / Wisconsin Central in US survey feet
+  feet = [100.0, 0.0, 0.0, 0.0, -100.0, 0.0]
+  assert aoi.grid_scale(feet, 'EPSG:2288') == pytest.approx(30.48006, rel = 1e-6)
+  with pytest.raises(ValueError):
+    aoi.grid_scale([0.00025, 0.0, -92.0, 0.0, -0.00025, 48.0], 'EPSG:4326')
+
+
+def test_masks_are_cached_per_scale(monkeypatch):
+  def no_grid_scale(transform, crs):
+    raise AssertionError('grid_scale() called with an explicit scale')
+  monkeypatch.setattr(aoi, 'grid_scale', no_grid_scale)
+  registry = aoi.AOIRegistry()
+  cached = np.ones((2, 2), dtype = bool)
+  registry._masks[('modeling', tuple(TRANSFORM), (2, 2), 'EPSG:4326', 25)] = cached
+  assert registry.mask('modeling', TRANSFORM, (2, 2), 'EPSG:4326',
+    scale = 25) is cached
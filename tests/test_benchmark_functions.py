@@ -0,0 +1,25 @@
+# modules
+import json
+
+import benchmark_functions as bf
+
+
+def test_ee_counts_match_baseline():
+  with open(bf.BASELINE) as f:
+    baseline = json.load(f)
+  assert 'local' not in baseline
+  assert bf.compare({'ee': bf.ee_benchmarks(baseline['meta']['n_dates'])},
+    baseline) == []
+
+
+def test_local_timings_are_reported_not_gated():
+  baseline = {'ee': {'a': {'nodes': 5}},
+    'local': {'qa_mask': {'pixels_per_s': 100.0, 'peak_mb': 10.0}}}
+  results = {'ee': {'a': {'nodes': 5}},
+    'local': {'qa_mask': {'pixels_per_s': 10.0, 'peak_mb': 30.0}}}
+  assert bf.compare(results, baseline) == []
+  assert bf.timing_changes(results, baseline) == [
+    ('local.qa_mask.peak_mb', 10.0, 30.0),
+    ('local.qa_mask.pixels_per_s', 100.0, 10.0)]
+  results['ee']['a']['nodes'] = 6
+  assert bf.compare(results, baseline) == [('ee.a.nodes', 5, 6)]
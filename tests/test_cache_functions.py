@@ -0,0 +1,63 @@
+# modules
+import json
+import os
+
+from conftest import load
+
+
+def _cache(fake_ee, tmp_path, **kwargs):
+  cf = load('cache_functions')
+  fake_ee.recorder.respond = lambda node: node._args[-1] * 1000
+  return cf, cf.GetInfoCache(str(tmp_path / 'cache'), **kwargs)
+
+
+def test_hit_and_miss(fake_ee, tmp_path):
+  cf, cache = _cache(fake_ee, tmp_path)
+  a = fake_ee.Number('a')
+  assert cache.get_info(a) == 'a' * 1000
+  # the same expression, built again, is served from disk
+  assert cache.get_info(fake_ee.Number('a')) == 'a' * 1000
+  assert cache.get_info(fake_ee.Number('b')) == 'b' * 1000
+  assert fake_ee.recorder.get_info == 2
+  stats = cache.stats()
+  assert (stats['hits'], stats['misses'], stats['entries']) == (1, 2, 2)
+  assert cf.expression_key(a) != cf.expression_key(fake_ee.Number('b'))
+
+
+def test_ttl_expiry(fake_ee, tmp_path):
+  cf, cache = _cache(fake_ee, tmp_path, ttl = 60)
+  a = fake_ee.Number('a')
+  cache.get_info(a)
+  cache.get_info(a)
+  assert fake_ee.recorder.get_info == 1
+  # age the entry past the TTL
+  path = os.path.join(cache.cache_dir, cf.expression_key(a) + '.json')
+  with open(path) as f:
+    entry = json.load(f)
+  entry['created'] -= 61
+  with open(path, 'w') as f:
+    json.dump(entry, f)
+  assert cache.get_info(a) == 'a' * 1000
+  assert fake_ee.recorder.get_info == 2
+  assert (cache.hits, cache.misses) == (1, 2)
+  with open(path) as f:
+    assert json.load(f)['created'] > entry['created'] + 60
+
+
+def test_lru_eviction(fake_ee, tmp_path):
+  # each entry is a bit over 1000 bytes, two fit
+  cf, cache = _cache(fake_ee, tmp_path, max_bytes = 2500)
+  paths = {}
+  for name, mtime in (('a', 1000), ('b', 2000)):
+    node = fake_ee.Number(name)
+    cache.get_info(node)
+    paths[name] = os.path.join(cache.cache_dir,
+      cf.expression_key(node) + '.json')
+    os.utime(paths[name], (mtime, mtime))
+  # using 'a' makes 'b' the least recently used result
+  cache.get_info(fake_ee.Number('a'))
+  cache.get_info(fake_ee.Number('c'))
+  assert os.path.exists(paths['a']) and not os.path.exists(paths['b'])
+  assert cache.evictions == 1 and cache.stats()['entries'] == 2
+  cache.get_info(fake_ee.Number('b'))
+  assert fake_ee.recorder.get_info == 4
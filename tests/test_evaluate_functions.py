@@ -0,0 +1,29 @@
+# modules
+import inspect
+import os
+
+import pytest
+
+from conftest import load
+
+
+def test_evaluate_models_keeps_existing_outputs(fake_ee, tmp_path):
+  evf = load('evaluate_functions')
+  out_dir = str(tmp_path)
+  path = evf.gtb.output_paths('LS5', '5class', out_dir = out_dir)['confusion']
+  with open(path, 'w') as f:
+    f.write('kept\n')
+  models = {('LS5', '5class'): (fake_ee.Classifier('gtb'),
+    fake_ee.FeatureCollection('testing'))}
+  with pytest.raises(FileExistsError):
+    evf.evaluate_models(models, out_dir = out_dir)
+  # nothing was requested from the server or written
+  assert fake_ee.recorder.get_info == 0
+  assert os.listdir(out_dir) == [os.path.basename(path)]
+
+
+def test_evaluate_models_default_is_local(fake_ee):
+  evf = load('evaluate_functions')
+  default = inspect.signature(evf.evaluate_models).parameters['out_dir'].default
+  assert default == evf.gtb.LOCAL_OUT_DIR
+  assert os.path.normpath(default) != os.path.normpath('data/output')
@@ -0,0 +1,89 @@
+# modules
+import numpy as np
+
+from conftest import load
+
+
+def test_shards_are_clipped_before_unmask(fake_ee):
+  ef = load('export_functions')
+  regions = {'tile_a': fake_ee.Geometry('a'), 'tile_b': fake_ee.Geometry('b')}
+  tasks = ef.sharded_export_tasks(fake_ee.Image('reclass'), 'GTB_test',
+    'folder', 'EPSG:32615', [30, 0, 0, 0, -30, 0], regions)
+  for task in tasks.values():
+    image = task.config['image']
+    assert image._name == 'unmask'
+    assert image._args[0]._name == 'clip'
+    assert task.config['formatOptions'] == {'noData': ef.NODATA}
+
+
+def test_overlapping_shards_keep_classified_pixels(fake_ee):
+  ef = load('export_functions')
+  nd = ef.NODATA
+  # shard a covers columns 0-3, shard b columns 2-5; each is NODATA outside
+  # its tile, which overlaps the other shard's classified pixels
+  a = np.array([[[1, 1, 1, nd], [1, 1, nd, nd]]], dtype = np.int16)
+  b = np.array([[[nd, 2, 2, 2], [2, 2, 2, 2]]], dtype = np.int16)
+  merged = ef.merge_shards([(a, 0, 0), (b, 0, 2)], (1, 2, 6))
+  np.testing.assert_array_equal(merged[0],
+    [[1, 1, 1, 2, 2, 2], [1, 1, 2, 2, 2, 2]])
+  merged = ef.merge_shards([(b, 0, 2), (a, 0, 0)], (1, 2, 6))
+  np.testing.assert_array_equal(merged[0],
+    [[1, 1, 1, 2, 2, 2], [1, 1, 2, 2, 2, 2]])
+
+
+def test_jobs_missing_from_the_task_list_are_resubmitted(fake_ee, tmp_path):
+  ef = load('export_functions')
+  tf = load('task_functions')
+  manifest = ef.ExportManifest(str(tmp_path / 'manifest.jsonl'),
+    retry_wait = 0)
+  lost = manifest.key('LS8', 'LANDSAT_8_2020-06-01', 'v')
+  done = manifest.key('LS8', 'LANDSAT_8_2020-06-02', 'v')
+  manifest.record(lost, 'running', id = 'TASK_FROM_AN_EARLIER_RUN')
+  manifest.record(done, 'completed', id = 'OLD')
+  backend = tf.FakeTaskBackend()
+  scheduler = tf.TaskScheduler(backend = backend, min_wait = 0,
+    sleep = lambda s: None)
+  jobs = {lost: lambda: 'lost', done: lambda: 'done'}
+  failed = ef.run_manifest(ef.ExportManifest(manifest.path, retry_wait = 0),
+    scheduler, jobs, sleep = lambda s: None)
+  assert failed == []
+  assert backend.started == ['lost']
+  reopened = ef.ExportManifest(manifest.path)
+  assert reopened.state(lost) == 'completed'
+  assert reopened.entries[lost]['failures'] == 1
+
+
+def test_jobs_in_progress_from_an_earlier_run_are_waited_for(fake_ee, tmp_path):
+  ef = load('export_functions')
+  tf = load('task_functions')
+  manifest = ef.ExportManifest(str(tmp_path / 'manifest.jsonl'),
+    retry_wait = 0)
+  running = manifest.key('LS8', 'LANDSAT_8_2020-06-01', 'v')
+  failing = manifest.key('LS8', 'LANDSAT_8_2020-06-02', 'v')
+  new = manifest.key('LS8', 'LANDSAT_8_2020-06-03', 'v')
+  manifest.record(running, 'running', id = 'OLD_RUNNING')
+  manifest.record(failing, 'submitted', id = 'OLD_FAILING')
+  # the earlier run's tasks are still on the task list, the new job finishes
+  # before them
+  backend = tf.FakeTaskBackend(ready_polls = 0, run_polls = 1,
+    fail = ['old failing'])
+  backend.tasks['OLD_RUNNING'] = {'state': 'RUNNING', 'age': -5,
+    'description': 'old running'}
+  backend.tasks['OLD_FAILING'] = {'state': 'READY', 'age': -5,
+    'description': 'old failing'}
+  slept = []
+  scheduler = tf.TaskScheduler(backend = backend, min_wait = 1, max_wait = 4,
+    sleep = lambda s: None)
+  jobs = {running: lambda: 'running', failing: lambda: 'failing',
+    new: lambda: 'new'}
+  failed = ef.run_manifest(ef.ExportManifest(manifest.path, retry_wait = 0),
+    scheduler, jobs, sleep = slept.append)
+  assert failed == []
+  # the earlier run's jobs were not submitted again until one failed, and
+  # were polled with a growing wait
+  assert backend.started == ['new', 'failing']
+  assert slept[:3] == [1, 2, 4]
+  reopened = ef.ExportManifest(manifest.path)
+  assert {k: reopened.state(k) for k in jobs} == dict.fromkeys(jobs, 'completed')
+  assert reopened.entries[running]['id'] == 'OLD_RUNNING'
+  assert reopened.entries[failing]['failures'] == 1
@@ -0,0 +1,82 @@
+# modules
+import numpy as np
+import pytest
+
+import frequency_functions as ff
+import store_functions as sf
+
+DATES = ['LANDSAT_5_1999-05-02', 'LANDSAT_7_1999-05-26', 'LANDSAT_8_2020-05-11',
+  'LANDSAT_8_2020-06-12', 'LANDSAT_9_2021-06-20']
+
+
+def _store(tmp_path, shape = (11, 19), seed = 4):
+  rng = np.random.default_rng(seed)
+  bands = rng.integers(1, 6, (len(DATES),) + shape).astype(np.int8)
+  # unclassified pixels are never counted
+  bands[rng.random(bands.shape) < 0.2] = sf.NODATA
+  store = sf.ReclassStore.create(str(tmp_path / 'store'), shape[0], shape[1],
+    chunks = (2, 8, 8))
+  for missDate, band in zip(DATES, bands):
+    store.append(missDate, band)
+  store.flush()
+  return store, bands
+
+
+def test_time_groups():
+  assert ff.time_groups(DATES, 'all')[1] == ['all']
+  group, labels = ff.time_groups(DATES, 'month')
+  assert labels == ['05', '06'] and group.tolist() == [0, 0, 0, 1, 1]
+  group, labels = ff.time_groups(DATES, 'year')
+  assert labels == ['1999', '2020', '2021'] and group.tolist() == [0, 0, 1, 1, 2]
+
+
+@pytest.mark.parametrize('by', ['all', 'month', 'year'])
+def test_counts_per_group_and_class(tmp_path, by):
+  store, bands = _store(tmp_path)
+  group, labels = ff.time_groups(DATES, by)
+  # tiles that do not divide the grid, counted in the calling process
+  counts, got_labels, classes = ff.count_classes(store, by = by,
+    tile_size = 5, n_jobs = 1)
+  assert counts.dtype == np.uint16
+  assert counts.shape == (len(labels), 5) + bands.shape[1:]
+  assert got_labels == labels and classes == list(ff.RECLASS_VALUES['5class'])
+  for g in range(len(labels)):
+    for k in range(len(classes)):
+      np.testing.assert_array_equal(counts[g, k],
+        (bands[group == g] == k + 1).sum(axis = 0))
+
+
+def test_counts_on_a_pool_into_a_memmap(tmp_path):
+  store, _ = _store(tmp_path)
+  expected, _, _ = ff.count_classes(store, by = 'month', n_jobs = 1)
+  out = str(tmp_path / 'counts.npy')
+  counts, _, _ = ff.count_classes(store, by = 'month', out = out, n_jobs = 2)
+  assert isinstance(counts, np.memmap)
+  np.testing.assert_array_equal(np.load(out), expected)
+
+
+def test_3class_counts(tmp_path):
+  # values 4 and 5 are not 3class values and are not counted
+  store, bands = _store(tmp_path)
+  counts, _, classes = ff.count_classes(store, scheme = '3class', n_jobs = 1)
+  assert classes == ['cloud', 'openWater', 'sediment']
+  for k in range(3):
+    np.testing.assert_array_equal(counts[0, k], (bands == k + 1).sum(axis = 0))
+
+
+def test_class_frequency_and_summary():
+  classes = list(ff.RECLASS_VALUES['5class'])
+  # one group, four pixels: counts of cloud, openWater and the sediments
+  counts = np.zeros((1, 5, 1, 4), dtype = np.uint16)
+  counts[0, :, 0, 0] = [2, 1, 1, 0, 0]
+  counts[0, :, 0, 1] = [0, 0, 1, 2, 1]
+  counts[0, :, 0, 2] = [3, 0, 0, 0, 0]
+  freq = ff.class_frequency(counts, classes, ff.SEDIMENT['5class'])
+  np.testing.assert_allclose(freq[0, 0], [0.25, 1, 0, np.nan])
+  freq = ff.class_frequency(counts, classes, ff.SEDIMENT['5class'],
+    exclude_cloud = True)
+  np.testing.assert_allclose(freq[0, 0], [0.5, 1, np.nan, np.nan])
+
+  summary = ff.frequency_summary(counts, ['all'], classes)
+  assert summary['pixel_count'].tolist() == [5, 1, 2, 2, 1]
+  np.testing.assert_allclose(summary['proportion'], np.array([5, 1, 2, 2, 1]) / 11)
@@ -0,0 +1,139 @@
+# modules
+import inspect
+import sys
+
+import numpy as np
+
+import local_functions as lf
+from conftest import bf, find_nodes, load
+
+
+def test_aoi_functions_use_the_registry(fake_ee):
+  gf = load('gee_functions')
+  gf.aoi.set_registry(bf.FakeRegistry(fake_ee))
+  image = fake_ee.Image('classified')
+  for out in (gf.classifications_to_one_band(image), gf.clip(image),
+              gf.class_histogram(image)):
+    assert not find_nodes(out, 'FeatureCollection')
+    geometries = find_nodes(out, 'Geometry')
+    assert [g._args for g in geometries] == [('modeling',)]
+
+
+def test_class_histogram_is_unweighted_and_skips_unclassified(fake_ee):
+  gf = load('gee_functions')
+  gf.aoi.set_registry(bf.FakeRegistry(fake_ee))
+  hist = gf.class_histogram(fake_ee.Image('classified'), band = 'reclass')
+  reduce = find_nodes(hist, 'reduceRegion')[0]
+  assert reduce._kwargs['reducer']._name == 'unweighted'
+  masked = reduce._args[0]
+  assert masked._name == 'updateMask'
+  assert masked._args[1]._name == 'gte' and masked._args[1]._args[1] == 0
+
+
+def test_reloading_adds_no_duplicate_path_entries(fake_ee):
+  before = list(sys.path)
+  for _ in range(3):
+    load('gee_functions')
+  assert sys.path == before
+
+
+####--------------------------####
+#### QA bit decoding          ####
+####--------------------------####
+
+def _evaluate(node, inputs):
+  """
+  Evaluates the few ee.Image operations of the QA functions on NumPy arrays,
+  with ee's band semantics: a one band operand is applied to every band of
+  the other, otherwise bands are paired in order. Images are lists of
+  (name, array) bands.
+  """
+  def ev(x):
+    if isinstance(x, bf.FakeNode) and not x._name.startswith('Reducer.'):
+      return _evaluate(x, inputs)
+    return x
+
+  args = [ev(a) for a in node._args]
+  name = node._name
+  if name == 'Image':
+    return [(args[0], inputs[args[0]])]
+  if name == 'Image.constant':
+    values = args[0] if isinstance(args[0], list) else [args[0]]
+    return [('constant_%d' % i, v) for i, v in enumerate(values)]
+  image = args[0]
+  if name == 'select':
+    picked = [image[i] for i in args[1]]
+    names = args[2] if len(args) > 2 else [n for n, _ in picked]
+    return [(n, a) for n, (_, a) in zip(names, picked)]
+  if name == 'rename':
+    return [(n, a) for n, (_, a) in zip(args[1], image)]
+  if name == 'reduce':
+    assert args[1]._name == 'Reducer.min'
+    return [('min', np.min([a for _, a in image], axis = 0))]
+  ops = {
+    'rightShift': lambda a, b: a >> b,
+    'bitwiseAnd': lambda a, b: a & b,
+    'lt': lambda a, b: (a < b).astype(np.uint8),
+    'eq': lambda a, b: (a == b).astype(np.uint8),
+    'And': lambda a, b: ((a != 0) & (b != 0)).astype(np.uint8)}
+  other = args[1]
+  if not isinstance(other, list):
+    other = [('constant', other)]
+  if len(other) == 1:
+    other = other * len(image)
+  if len(image) == 1:
+    image = [(image[0][0], image[0][1])] * len(other)
+    names = [n for n, _ in other] if len(other) > 1 else [image[0][0]]
+  else:
+    names = [n for n, _ in image]
+  return [(n, ops[name](a, b)) for n, (_, a), (_, b) in
+    zip(names, image, other)]
+
+
+def _old_masks(m, qa):
+  """
+  The mask_* chains of extract_qa_bits calls that decode_qa_bits and qa_mask
+  replaced (gee_functions.py before the spec tables).
+  """
+  def high(s, e):
+    return m.extract_qa_bits(qa, s, e, 'f').eq(3)
+  pixel = (high(14, 16).eq(0)
+    .And(high(12, 14).eq(0))
+    .And(high(10, 12).eq(0))
+    .And(high(8, 10).eq(0)))
+  aerosol = m.extract_qa_bits(qa, 6, 8, 'aero_level').lt(3)
+  qa60 = (m.extract_qa_bits(qa, 11, 12, 'cirrus').eq(0)
+    .And(m.extract_qa_bits(qa, 10, 11, 'opaque').eq(0)))
+  return [(m.QA_PIXEL_SPEC, pixel), (m.QA_AEROSOL_SPEC, aerosol),
+    (m.QA60_SPEC, qa60)]
+
+
+def test_qa_specs_and_decoders_agree_across_modules(fake_ee):
+  gf = load('gee_functions')
+  rp = bf.load_module(bf.RE_PULL_FUNCTIONS, 're_pull_functions_test')
+  for spec in ('QA_PIXEL_SPEC', 'QA_AEROSOL_SPEC', 'QA60_SPEC'):
+    assert getattr(gf, spec) == getattr(rp, spec) == getattr(lf, spec)
+  for f in ('extract_qa_bits', 'decode_qa_bits', 'qa_mask'):
+    assert inspect.getsource(getattr(gf, f)) == \
+      inspect.getsource(getattr(rp, f))
+
+
+def test_decode_qa_bits_matches_extract_qa_bits_chains(fake_ee):
+  gf = load('gee_functions')
+  inputs = {'qa': np.arange(1 << 16, dtype = np.uint16)}
+  qa = fake_ee.Image('qa')
+  for spec, old_mask in _old_masks(gf, qa):
+    decoded = _evaluate(gf.decode_qa_bits(qa, spec), inputs)
+    old = [_evaluate(gf.extract_qa_bits(qa, f[1], f[2], f[0]), inputs)[0]
+      for f in spec]
+    assert [n for n, _ in decoded] == [n for n, _ in old]
+    for (_, new), (_, ref) in zip(decoded, old):
+      assert np.array_equal(new, ref)
+    (_, mask), = _evaluate(gf.qa_mask(qa, spec), inputs)
+    (_, expected), = _evaluate(old_mask, inputs)
+    assert np.array_equal(mask, expected)
+    # and the NumPy versions give the same bands and mask
+    local = lf.decode_qa_bits(inputs['qa'], spec)
+    for row, (_, ref) in zip(local, old):
+      assert np.array_equal(row, ref)
+    assert np.array_equal(lf.qa_mask(inputs['qa'], spec), expected == 1)
@@ -0,0 +1,143 @@
+# modules
+import numpy as np
+import pandas as pd
+import pytest
+
+import gtb_functions as gtb
+from conftest import find_nodes
+
+
+def _labels(n, seed):
+  rng = np.random.default_rng(seed)
+  table = pd.DataFrame(rng.random((n, len(gtb.ls57_input_feat))),
+    columns = gtb.ls57_input_feat)
+  table['byte_property'] = rng.integers(0, 3, n)
+  return table
+
+
+def test_train_mission_keeps_existing_outputs(tmp_path):
+  labels = (_labels(200, 1), _labels(50, 2))
+  out_dir = str(tmp_path / 'local')
+  gtb.train_mission('LS5', '3class', out_dir = out_dir, labels = labels,
+    n_trees = 2)
+  paths = gtb.output_paths('LS5', '3class', out_dir = out_dir)
+  assert all(pd.read_csv(p).shape[0] > 0 for p in paths.values())
+  with open(paths['importance'], 'w') as f:
+    f.write('kept\n')
+  with pytest.raises(FileExistsError):
+    gtb.train_mission('LS5', '3class', out_dir = out_dir, labels = labels,
+      n_trees = 2)
+  with open(paths['importance']) as f:
+    assert f.read() == 'kept\n'
+  gtb.train_mission('LS5', '3class', out_dir = out_dir, labels = labels,
+    n_trees = 2, overwrite = True)
+  assert 'Band' in pd.read_csv(paths['importance'])
+
+
+def test_default_outputs_are_not_the_committed_tables():
+  paths = gtb.output_paths('LS8')
+  assert all(p.startswith(gtb.LOCAL_OUT_DIR) for p in paths.values())
+
+
+def test_max_depth_limits_tree_numbers():
+  labels = _labels(400, 3)
+  X = labels[gtb.ls57_input_feat].values
+  model = gtb.train_gtb(X, labels['byte_property'].values, gtb.ls57_input_feat,
+    gtb.CLASS_VALUES['3class'], n_trees = 2, min_leaf = 1, max_depth = 4)
+  assert model.depth() == 4
+  numbers = [int(line.split(')')[0]) for trees in gtb.ee_tree_strings(model)
+    for tree in trees for line in tree.split('\n')]
+  assert max(numbers) < 2 ** 5
+  deep = gtb.train_gtb(X, labels['byte_property'].values, gtb.ls57_input_feat,
+    gtb.CLASS_VALUES['3class'], n_trees = 1, min_leaf = 1, max_depth = None)
+  assert deep.depth() > 4
+
+
+def _small_model():
+  # class 0: a <= 0.5 ? 1.0 : (b <= 2 ? -1.0 : 0.5); class 1: a single leaf
+  return gtb.GTBModel(['a', 'b'], ['x', 'y'], init = [0.1, 0.2],
+    shrinkage = 0.5,
+    feature = [0, -1, 1, -1, -1, -1],
+    threshold = [0.5, 0, 2.0, 0, 0, 0],
+    left = [1, -1, 3, -1, -1, -1],
+    right = [2, -1, 4, -1, -1, -1],
+    value = [0.0, 1.0, 0.0, -1.0, 0.5, 0.25],
+    tree_start = [0, 5], tree_class = [0, 1],
+    count = [10, 4, 6, 2, 4, 10])
+
+
+def test_ee_tree_strings_rpart_format():
+  trees = gtb.ee_tree_strings(_small_model())
+  assert trees == [
+    ['1) root 10 0 0.0\n'
+     '  2) a<=0.5 4 0 1.0 *\n'
+     '  3) a>0.5 6 0 0.0\n'
+     '    6) b<=2.0 2 0 -1.0 *\n'
+     '    7) b>2.0 4 0 0.5 *'],
+    ['1) root 10 0 0.25 *']]
+
+
+def _chain_model(depth):
+  # every split sends x > 0 right, down to a leaf at the given depth
+  feature, left, right, value = [], [], [], []
+  for d in range(depth):
+    i = len(feature)
+    feature += [0, -1]
+    left += [i + 1, -1]
+    right += [i + 2, -1]
+    value += [0.0, -1.0]
+  feature.append(-1)
+  left.append(-1)
+  right.append(-1)
+  value.append(1.0)
+  n = len(feature)
+  return gtb.GTBModel(['a'], ['x'], init = [0.0], shrinkage = 1.0,
+    feature = feature, threshold = [0.0] * n, left = left, right = right,
+    value = value, tree_start = [0], tree_class = [0], count = [1] * n)
+
+
+def test_ee_tree_strings_numbering_at_the_depth_limit():
+  model = _chain_model(gtb.EE_MAX_DEPTH)
+  tree = gtb.ee_tree_strings(model)[0][0]
+  numbers = [int(line.split(')')[0]) for line in tree.split('\n')]
+  assert len(numbers) == 2 * gtb.EE_MAX_DEPTH + 1
+  # the deepest right child is 2^31 - 1, the largest int32
+  assert max(numbers) == 2 ** 31 - 1
+  assert len(set(numbers)) == len(numbers)
+  with pytest.raises(ValueError):
+    gtb.ee_tree_strings(_chain_model(gtb.EE_MAX_DEPTH + 1))
+
+
+def test_ee_classify_uses_one_ensemble_per_class(fake_ee):
+  model = _small_model()
+  out = gtb.ee_classify(fake_ee.Image('features'), model)
+  ensembles = find_nodes(out, 'Classifier.decisionTreeEnsemble')
+  assert [e._args[0] for e in ensembles] == gtb.ee_tree_strings(model)
+  assert not find_nodes(out, 'Classifier.decisionTree')
+  # the ensemble mean is scaled back to the shrunk sum of the trees
+  scaled = find_nodes(out, 'multiply')
+  assert sorted(m._args[1] for m in scaled) == [0.5, 0.5]
+
+
+def test_save_load_model_round_trip(tmp_path):
+  labels = _labels(300, 4)
+  X = labels[gtb.ls57_input_feat].values
+  model = gtb.train_gtb(X, labels['byte_property'].values, gtb.ls57_input_feat,
+    gtb.CLASS_VALUES['3class'], n_trees = 3, min_leaf = 2, max_depth = 6)
+  model.meta = {'mission': 'LS5', 'scheme': '3class', 'v_date': 'test'}
+  path = gtb.save_model(model, model_dir = str(tmp_path))
+  assert path == gtb.model_path('LS5', '3class', 'test', str(tmp_path))
+  loaded = gtb.load_model(path)
+  for name in gtb.ARTIFACT_ARRAYS:
+    array = getattr(loaded, name)
+    # memory-mapped read-only, with the saved dtype and values
+    assert not array.flags.writeable and not array.flags.owndata
+    assert array.dtype == getattr(model, name).dtype
+    assert np.array_equal(array, getattr(model, name))
+  assert loaded.features == model.features and loaded.classes == model.classes
+  assert loaded.shrinkage == model.shrinkage and loaded.meta == model.meta
+  assert np.array_equal(loaded.predict(X), model.predict(X))
+  assert np.array_equal(loaded.predict_scores(X), model.predict_scores(X))
+  in_memory = gtb.load_model(path, mmap = False)
+  assert in_memory.threshold.flags.writeable
+  assert np.array_equal(in_memory.predict(X), model.predict(X))
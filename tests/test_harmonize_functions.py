@@ -0,0 +1,171 @@
+# modules
+import numpy as np
+import pytest
+
+import harmonize_functions as hf
+import local_functions as lf
+from conftest import bf, load
+
+
+def _pairs(matrix, offset, n = 2000, noise = 0, seed = 3):
+  rng = np.random.default_rng(seed)
+  x = rng.uniform(0, 0.4, (n, len(offset)))
+  y = x @ np.asarray(matrix).T + offset + rng.normal(0, noise, (n, len(offset)))
+  return x, y
+
+
+def test_mission_bands_use_the_mission_names():
+  assert sorted(hf.MISSION_BANDS) == ['LS5', 'LS7', 'LS8', 'LS9', 'SEN2']
+  assert all(len(b) == len(hf.HARMONIZED_BANDS)
+    for b in hf.MISSION_BANDS.values())
+
+
+@pytest.mark.parametrize('method', ['ols', 'rma'])
+def test_fit_recovers_per_band_coefficients(method):
+  slope = np.array([0.95, 1.02, 0.98, 1.05, 0.9, 1.1])
+  offset = np.array([0.01, -0.005, 0.002, 0.0, -0.01, 0.004])
+  x, y = _pairs(np.diag(slope), offset)
+  fit = hf.fit_harmonization(x, y, hf.MISSION_BANDS['LS7'], method = method)
+  assert fit.is_diagonal
+  np.testing.assert_allclose(np.diag(fit.matrix), slope, rtol = 1e-10)
+  np.testing.assert_allclose(fit.offset, offset, atol = 1e-12)
+  np.testing.assert_allclose(fit.meta['r2'], 1, atol = 1e-12)
+  assert fit.meta['n_pixels'] == [2000] * 6
+
+  # with noise OLS stays unbiased and RMA is steeper by 1/r
+  x, y = _pairs(np.diag(slope), offset, n = 200000, noise = 0.002)
+  fit = hf.fit_harmonization(x, y, hf.MISSION_BANDS['LS7'], method = method)
+  r = np.sqrt(fit.meta['r2'])
+  expected = slope if method == 'ols' else slope / r
+  np.testing.assert_allclose(np.diag(fit.matrix), expected, rtol = 2e-3)
+
+
+def test_fit_skips_invalid_pixels_per_band_and_weights():
+  x, y = _pairs(np.diag([1.1] * 6), [0.02] * 6, n = 100)
+  x[:10, 0] = np.nan
+  # outliers with zero weight do not move the fit
+  y[10:20, 1] += 1
+  weights = np.ones(100)
+  weights[10:20] = 0
+  fit = hf.fit_harmonization(x, y, hf.MISSION_BANDS['LS5'], weights = weights)
+  assert fit.meta['n_pixels'] == [90] + [100] * 5
+  np.testing.assert_allclose(np.diag(fit.matrix), 1.1, rtol = 1e-10)
+  np.testing.assert_allclose(fit.offset, 0.02, atol = 1e-12)
+
+
+def test_fit_recovers_a_band_matrix():
+  rng = np.random.default_rng(5)
+  matrix = np.eye(6) + rng.normal(0, 0.05, (6, 6))
+  offset = rng.normal(0, 0.01, 6)
+  x, y = _pairs(matrix, offset)
+  fit = hf.fit_harmonization(x, y, hf.MISSION_BANDS['SEN2'], method = 'matrix')
+  assert not fit.is_diagonal
+  np.testing.assert_allclose(fit.matrix, matrix, atol = 1e-10)
+  np.testing.assert_allclose(fit.offset, offset, atol = 1e-10)
+  np.testing.assert_allclose(fit.apply(x), y, atol = 1e-10)
+
+
+def test_then_and_json_round_trip(tmp_path):
+  a = hf.fit_harmonization(*_pairs(np.diag([2.0] * 6), [0.1] * 6),
+    hf.MISSION_BANDS['LS5'], bands_out = hf.MISSION_BANDS['LS7'])
+  b = hf.fit_harmonization(*_pairs(np.diag([0.5] * 6), [0.0] * 6),
+    hf.MISSION_BANDS['LS7'])
+  chained = a.then(b)
+  x = np.full((1, 6), 0.2)
+  np.testing.assert_allclose(chained.apply(x), b.apply(a.apply(x)))
+  with pytest.raises(ValueError):
+    b.then(a)
+  path = str(tmp_path / 'harmonization.json')
+  hf.save_harmonizations({'LS5': chained}, path)
+  loaded = hf.load_harmonizations(path)
+  # Landsat 8/9 already have the harmonized bands and get the identity
+  assert sorted(loaded) == ['LS5', 'LS8', 'LS9']
+  np.testing.assert_array_equal(loaded['LS5'].matrix, chained.matrix)
+  np.testing.assert_array_equal(loaded['LS8'].matrix, np.eye(6))
+
+
+####--------------------------####
+#### gee and local transforms ####
+####--------------------------####
+
+def _evaluate(node, inputs):
+  """
+  Evaluates the ee.Image and array image operations of applyHarmonization on
+  NumPy arrays. Images are lists of (name, array) bands, array images are
+  (axes, array) pairs with the array axes first.
+  """
+  def ev(x):
+    if isinstance(x, bf.FakeNode):
+      return _evaluate(x, inputs)
+    if isinstance(x, list):
+      return [ev(v) for v in x]
+    return x
+
+  args = [ev(a) for a in node._args]
+  name = node._name
+  if name == 'Array':
+    return np.asarray(args[0], dtype = np.float64)
+  if name == 'Image':
+    if isinstance(args[0], str):
+      return list(inputs.items())
+    return (args[0].ndim, args[0])
+  if name == 'Image.constant':
+    return [('constant_%d' % i, v) for i, v in enumerate(args[0])]
+  image = args[0]
+  if name == 'bandNames':
+    return [n for n, _ in image]
+  if name == 'removeAll':
+    return [n for n in image if n not in args[1]]
+  if name == 'select':
+    bands = dict(image)
+    return [(n, bands[n]) for n in args[1]]
+  if name == 'rename':
+    return [(n, a) for n, (_, a) in zip(args[1], image)]
+  if name == 'addBands':
+    return image + args[1]
+  if name == 'toArray':
+    if isinstance(image, list):
+      return (1, np.stack([a for _, a in image]))
+    axes, a = image
+    return (axes + 1, np.expand_dims(a, args[1]))
+  if name == 'matrixMultiply':
+    (_, a), (axes, b) = image, args[1]
+    assert a.ndim == 2
+    return (axes, np.tensordot(a, b, axes = 1))
+  if name == 'arrayProject':
+    axes, a = image
+    return (1, a.reshape(a.shape[:1] + a.shape[axes:]))
+  if name == 'arrayFlatten':
+    _, a = image
+    return list(zip(args[1][0], a))
+  if isinstance(image, tuple):
+    (axes, a), (_, b) = image, args[1]
+    b = b.reshape(b.shape + (1,) * (a.ndim - b.ndim))
+    return (axes, {'add': np.add, 'multiply': np.multiply}[name](a, b))
+  ops = {'add': np.add, 'multiply': np.multiply}
+  return [(n, ops[name](a, b)) for (n, a), (_, b) in zip(image, args[1])]
+
+
+@pytest.mark.parametrize('method', ['ols', 'matrix'])
+def test_gee_and_local_applyHarmonization_agree(fake_ee, method):
+  gf = load('gee_functions')
+  rng = np.random.default_rng(11)
+  matrix = (np.diag(rng.uniform(0.9, 1.1, 6)) if method == 'ols' else
+    np.eye(6) + rng.normal(0, 0.05, (6, 6)))
+  fit = hf.fit_harmonization(*_pairs(matrix, rng.normal(0, 0.01, 6)),
+    hf.MISSION_BANDS['LS5'], method = method)
+  bands = {n: rng.uniform(0, 0.4, (3, 4))
+    for n in ['SR_B1', 'SR_B2', 'SR_B3', 'SR_B4', 'SR_B5', 'ST_B6', 'SR_B7',
+              'QA_PIXEL']}
+
+  ee_out = _evaluate(gf.applyHarmonization(fake_ee.Image('scene'), fit), bands)
+  local_out = lf.applyHarmonization(lf.LocalImage(dict(bands)), fit)
+
+  assert [n for n, _ in ee_out] == local_out.bandNames() == [
+    'ST_B6', 'QA_PIXEL'] + hf.HARMONIZED_BANDS
+  for n, a in ee_out:
+    np.testing.assert_allclose(local_out.band(n), a, rtol = 1e-12, atol = 1e-15)
+  np.testing.assert_allclose(
+    np.stack([local_out.band(b) for b in hf.HARMONIZED_BANDS], axis = -1),
+    fit.apply(np.stack([bands[b] for b in hf.MISSION_BANDS['LS5']], axis = -1)),
+    rtol = 1e-12)
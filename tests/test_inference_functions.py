@@ -0,0 +1,73 @@
+# modules
+import sys
+
+import numpy as np
+
+import gtb_functions as gtb
+import inference_functions as inf
+import local_functions as lf
+from conftest import load
+
+
+def _model(seed = 4):
+  rng = np.random.default_rng(seed)
+  X = rng.random((500, 3))
+  y = (X[:, 0] * 3).astype(int) % 3
+  return gtb.train_gtb(X, y, ['a', 'b', 'c'], gtb.CLASS_VALUES['3class'],
+    n_trees = 5, min_leaf = 2), rng
+
+
+def test_predict_classes_matches_predict():
+  model, rng = _model()
+  X = rng.random((2000, 3))
+  np.testing.assert_array_equal(inf.predict_classes(model, X),
+    model.predict(X))
+
+
+def test_classify_block_reclasses_valid_pixels():
+  model, rng = _model()
+  bands = {f: rng.random((20, 30)) for f in model.features}
+  bands['b'][3, 4] = np.nan
+  mask = np.ones((20, 30), dtype = bool)
+  mask[0, :5] = False
+  out = inf.classify_block(model, lf.LocalImage(bands, mask))
+  valid = mask & np.isfinite(bands['b'])
+  assert (out[~valid] == inf.reclass_default).all()
+  X = np.stack([bands[f][valid] for f in model.features], axis = 1)
+  np.testing.assert_array_equal(out[valid], model.predict(X) + 1)
+
+
+def test_predict_classes_matches_predict_on_training_data():
+  rng = np.random.default_rng(9)
+  X = rng.random((1000, 4))
+  y = ((X[:, 0] + 0.3 * X[:, 1]) * 4).astype(int) % 5
+  model = gtb.train_gtb(X, y, ['a', 'b', 'c', 'd'],
+    gtb.CLASS_VALUES['5class'], n_trees = 20, min_leaf = 5, max_depth = 8)
+  np.testing.assert_array_equal(inf.predict_classes(model, X),
+    model.predict(X))
+
+
+def test_import_adds_no_duplicate_path_entries():
+  before = list(sys.path)
+  load('inference_functions')
+  load('inference_functions')
+  assert sys.path == before
+
+
+def test_class_stats_table_leaves_out_unclassified():
+  hists = {'LANDSAT_8_2020-06-01': {'1': 10.6, '-99': 50, '2': 30},
+    'Sentinel-2A_2020-06-02': {'3': 4}}
+  table = inf.class_stats_table(hists, '3class', reclassed = True)
+  assert list(table['class']) == ['cloud', 'openWater', 'sediment']
+  assert list(table['pixel_count']) == [11, 30, 4]
+  assert list(table['mission']) == ['LANDSAT_8', 'LANDSAT_8', 'Sentinel-2A']
+  np.testing.assert_allclose(table['proportion'], [11 / 41, 30 / 41, 1])
+  counts = inf.class_counts(np.array([[1, -99], [2, -99]], dtype = np.int16))
+  assert counts == {1: 1, 2: 1}
+
+
+def test_class_stats_table_of_no_counts():
+  for hists in ({}, {'LANDSAT_8_2020-06-01': {'-99': 5}}):
+    table = inf.class_stats_table(hists, reclassed = True)
+    assert len(table) == 0
+    assert 'proportion' in table
@@ -0,0 +1,79 @@
+# modules
+import threading
+import types
+
+from conftest import load
+
+
+def test_throttle_records_sleeps_and_task_lists(fake_ee, tmp_path):
+  inf = load('instrument_functions')
+  gf = load('gee_functions')
+  running = [{'id': str(i), 'state': 'RUNNING'} for i in range(5)]
+  fake_ee.recorder.tasks = running
+  slept = []
+
+  def sleep(seconds):
+    # no real waiting; two tasks finish during the second sleep
+    slept.append(seconds)
+    if len(slept) == 2:
+      fake_ee.recorder.tasks = running[:2]
+
+  gf.time = types.SimpleNamespace(sleep = sleep)
+  clock, task_list = gf.time, fake_ee.data.getTaskList
+  tracer = inf.Tracer(str(tmp_path / 'trace.jsonl'), run = 'test')
+  tracer.instrument_throttle(gf)
+  gf.maximum_no_of_tasks(3, 30)
+  tracer.close()
+  assert gf.time is clock and fake_ee.data.getTaskList == task_list
+  assert slept == [30, 30]
+  assert fake_ee.recorder.task_lists == 3
+  events = inf.read_trace(str(tmp_path / 'trace.jsonl'))
+  assert list(events['event']) == ['task_list', 'throttle', 'task_list',
+    'throttle', 'task_list']
+  throttle = events[events['event'] == 'throttle']
+  assert list(throttle['wait']) == [30, 30]
+  lists = events[events['event'] == 'task_list']
+  assert list(lists['tasks']) == [5, 5, 2]
+
+
+def test_tags_are_kept_per_thread(fake_ee, tmp_path):
+  inf = load('instrument_functions')
+  tracer = inf.Tracer(str(tmp_path / 'trace.jsonl'), run = 'test')
+  inside = threading.Barrier(2)
+
+  def work(mission):
+    with tracer.tags(mission = mission):
+      # both threads are inside their with block before either records
+      inside.wait()
+      tracer.record('work', name = mission)
+    tracer.record('after', name = mission)
+
+  threads = [threading.Thread(target = work, args = (m,))
+    for m in ('LS5', 'LS8')]
+  with tracer.tags(mission = 'main'):
+    for t in threads:
+      t.start()
+    for t in threads:
+      t.join()
+    tracer.record('main')
+  events = inf.read_trace(str(tmp_path / 'trace.jsonl'))
+  work = events[events['event'] == 'work']
+  assert (work['mission'] == work['name']).all()
+  after = events[events['event'] == 'after']
+  assert after['mission'].isna().all()
+  assert list(events[events['event'] == 'main']['mission']) == ['main']
+
+
+def test_close_removes_scheduler_listener(fake_ee, tmp_path):
+  inf = load('instrument_functions')
+  tf = load('task_functions')
+  scheduler = tf.TaskScheduler(max_active = 2, min_wait = 0,
+    backend = tf.FakeTaskBackend(), sleep = lambda s: None)
+  tracer = inf.Tracer(str(tmp_path / 'trace.jsonl'), run = 'test')
+  tracer.instrument_scheduler(scheduler, task_status = False)
+  scheduler.run(['a', 'b', 'c'])
+  tracer.close()
+  assert scheduler.listeners == []
+  n_events = len(inf.read_trace(str(tmp_path / 'trace.jsonl')))
+  scheduler.run(['d'])
+  assert len(inf.read_trace(str(tmp_path / 'trace.jsonl'))) == n_events
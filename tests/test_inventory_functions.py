@@ -0,0 +1,129 @@
+# modules
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import inventory_functions as inv
+from conftest import bf
+
+DAY = 86400000
+# 2020-08-11 00:00 UTC
+T0 = 1597104000000
+
+
+def _millis(date):
+  return int(datetime.datetime.strptime(date, '%Y-%m-%d').replace(
+    tzinfo = datetime.timezone.utc).timestamp() * 1000)
+
+
+@pytest.fixture
+def metadata(tmp_path):
+  landsat = pd.DataFrame({
+    'system:index': ['LC08_026027_20200811', 'LC08_026028_20200811',
+      'LC08_026027_20200827', 'LC09_026027_20220521', 'LC08_026027_X',
+      'LC08_026027_Y'],
+    'SPACECRAFT_ID': ['LANDSAT_8', 'LANDSAT_8', 'LANDSAT_8', 'LANDSAT_9',
+      'LANDSAT_8', 'LANDSAT_8'],
+    # the second scene is one millisecond before midnight UTC, the fifth has
+    # only DATE_ACQUIRED and the last has no date at all
+    'system:time_start': [T0 + 16 * 3600000, T0 + DAY - 1, T0 + 16 * DAY,
+      _millis('2022-05-21') + 3600000, np.nan, np.nan],
+    'DATE_ACQUIRED': [np.nan, np.nan, np.nan, np.nan, '2021-06-02', np.nan],
+    'WRS_PATH': [26] * 6,
+    'WRS_ROW': [27, 28, 27, 27, 27, 27],
+    'CLOUD_COVER': [10.0, 80.0, 5.0, 20.0, 1.0, 1.0],
+    'IMAGE_QUALITY_OLI': [9, 9, 5, 9, 9, 9]})
+  sentinel = pd.DataFrame({
+    'system:index': ['S2A_1', 'S2B_1', 'S2A_2'],
+    'SPACECRAFT_NAME': ['Sentinel-2A', 'Sentinel-2B', 'Sentinel-2A'],
+    'system:time_start': [_millis('2020-07-12') + 60000,
+      _millis('2020-08-11') + 60000, _millis('2021-06-02') + 60000],
+    'MGRS_TILE': ['15TWN', '15TXN', '15TWN'],
+    'CLOUDY_PIXEL_PERCENTAGE': [3.0, 50.0, 0.0]})
+  paths = [str(tmp_path / 'LS8_image_metadata.csv'),
+    str(tmp_path / 'SEN2_image_metadata.csv')]
+  landsat.to_csv(paths[0], index = False)
+  sentinel.to_csv(paths[1], index = False)
+  return paths, landsat, sentinel
+
+
+def _ee_missdate(rp, ee, function, properties):
+  # evaluates addImageDate()/addImageDate_S2() of the re-pull notebooks on an
+  # image with the given properties
+  def ev(node):
+    if not isinstance(node, bf.FakeNode):
+      return node
+    args = [ev(a) for a in node._args]
+    if node._name == 'Image':
+      return properties
+    if node._name == 'get':
+      return args[0][args[1]]
+    if node._name == 'date':
+      return datetime.datetime.fromtimestamp(
+        args[0]['system:time_start'] / 1000, datetime.timezone.utc)
+    if node._name == 'format':
+      assert args[1] == 'YYYY-MM-dd'
+      return args[0].strftime('%Y-%m-%d')
+    if node._name == 'String':
+      return str(args[0])
+    if node._name == 'cat':
+      return args[0] + args[1]
+    if node._name == 'set':
+      return args[2]
+    raise AssertionError(node._name)
+  return ev(function(ee.Image('image')))
+
+
+def test_read_metadata_drops_undated_scenes(metadata):
+  paths, landsat, _ = metadata
+  with pytest.warns(UserWarning, match = '1 scenes'):
+    scenes = inv.read_metadata(paths[0])
+  assert len(scenes) == len(landsat) - 1
+  assert scenes['date'].tolist() == ['2020-08-11', '2020-08-11', '2020-08-27',
+    '2022-05-21', '2021-06-02']
+  with pytest.warns(UserWarning):
+    inventory = inv.SceneInventory.from_csv(paths)
+  assert len(inventory) == 8
+  assert len(inventory.query(months = 8)) == 4
+
+
+def test_missdates_match_addImageDate(metadata, fake_ee):
+  paths, landsat, sentinel = metadata
+  rp = bf.load_module(bf.RE_PULL_FUNCTIONS, 're_pull_functions_test')
+  with pytest.warns(UserWarning):
+    inventory = inv.SceneInventory.from_csv(paths)
+  expected = set()
+  for row in landsat.dropna(subset = ['system:time_start']).to_dict('records'):
+    expected.add(_ee_missdate(rp, fake_ee, rp.addImageDate, row))
+  for row in sentinel.to_dict('records'):
+    expected.add(_ee_missdate(rp, fake_ee, rp.addImageDate_S2, row))
+  # the scene with only DATE_ACQUIRED
+  expected.add('LANDSAT_8_2021-06-02')
+  assert inventory.missdates() == sorted(expected)
+  assert 'LANDSAT_8_2020-08-11' in expected
+  assert 'Sentinel-2A_2020-07-12' in expected
+
+
+def test_date_range_queries(metadata):
+  paths = metadata[0]
+  with pytest.warns(UserWarning):
+    inventory = inv.SceneInventory.from_csv(paths)
+  scenes = inventory.scenes
+  for start, end in [('2020-08-11', '2020-08-12'), ('2020-08-01', '2021-06-02'),
+      (None, '2020-08-11'), ('2021-06-02', None), ('2020-07-12', '2022-05-22')]:
+    keep = pd.Series(True, index = scenes.index)
+    if start is not None:
+      keep &= scenes['date'] >= start
+    if end is not None:
+      keep &= scenes['date'] < end
+    got = inventory.query(start = start, end = end)
+    assert sorted(got['scene_id']) == sorted(scenes.loc[keep, 'scene_id'])
+  assert inventory.missdates(missions = 'LS8', start = '2020-08-01',
+    end = '2020-09-01', rows = 27, max_cloud = 50) == [
+    'LANDSAT_8_2020-08-11', 'LANDSAT_8_2020-08-27']
+  assert inventory.missdates(missions = 'LS8', start = '2020-08-01',
+    end = '2020-09-01', min_quality = 7) == ['LANDSAT_8_2020-08-11']
+  assert inventory.missdates(missions = 'SEN2', tiles = '15TWN') == [
+    'Sentinel-2A_2020-07-12', 'Sentinel-2A_2021-06-02']
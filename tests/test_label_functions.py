@@ -0,0 +1,79 @@
+# modules
+import numpy as np
+import pandas as pd
+import pytest
+
+import label_functions as lbf
+
+
+@pytest.fixture
+def labels(tmp_path):
+  rng = np.random.default_rng(21)
+  n = 400
+  table = pd.DataFrame({
+    'mission': rng.choice(['LS5', 'LS8', 'SEN2'], n),
+    'class': rng.choice(['cloud', 'openWater', 'offShoreSediment'], n),
+    'date': rng.choice(['2018-05-02', '2019-06-11', '2019-08-30', '2020-07-12',
+      '2021-09-01'], n),
+    'SR_B2': rng.random(n),
+    'id': np.arange(n)})
+  table.loc[[3, 50, 51], 'date'] = np.nan
+  table.loc[[7, 50], 'mission'] = np.nan
+  table.loc[[9], 'class'] = np.nan
+  path = str(tmp_path / 'labels.csv')
+  table.to_csv(path, index = False)
+  return lbf.load_table(path, str(tmp_path / 'cache')), pd.read_csv(path)
+
+
+def _ids(table, rows):
+  return sorted(table.column('id', rows).tolist())
+
+
+QUERIES = [
+  {'mission': 'LS8'},
+  {'mission': 'LS8', 'cls': 'openWater'},
+  {'mission': 'SEN2', 'cls': 'cloud', 'year': 2019},
+  {'mission': 'LS5', 'start': '2019-06-11', 'end': '2021-01-01'},
+  {'cls': 'offShoreSediment'},
+  {'cls': 'cloud', 'start': '2019-01-01'},
+  {'end': '2019-08-30'},
+  {'missDate': 'LANDSAT_8_2019-08-30'},
+  {'missDate': 'Sentinel-2A_2020-07-12'},
+  {'mission': lbf.MISSING},
+  {'cls': lbf.MISSING}]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_rows_match_a_pandas_filter(labels, query):
+  table, df = labels
+  keep = pd.Series(True, index = df.index)
+  if 'missDate' in query:
+    mission, date = lbf.missdate_key(query['missDate']).split(lbf.KEY_SEP)
+    keep &= (df['mission'] == mission) & (df['date'] == date)
+  if 'mission' in query:
+    keep &= (df['mission'].fillna(lbf.MISSING) == query['mission'])
+  if 'cls' in query:
+    keep &= (df['class'].fillna(lbf.MISSING) == query['cls'])
+  start = query.get('start', str(query['year']) if 'year' in query else None)
+  end = query.get('end', str(query['year'] + 1) if 'year' in query else None)
+  if start is not None:
+    keep &= df['date'].notna() & (df['date'] >= start)
+  if end is not None:
+    keep &= df['date'].notna() & (df['date'] < end)
+  expected = sorted(df.loc[keep, 'id'].tolist())
+  assert expected
+  assert _ids(table, table.rows(**query)) == expected
+
+
+def test_missing_values_are_not_the_last_category(labels):
+  table, df = labels
+  # rows without a mission or date are not counted as SEN2 or 2021-09-01
+  sen2 = table.rows(mission = 'SEN2')
+  assert 7 not in _ids(table, sen2)
+  last_date = table.rows(start = '2021-09-01')
+  assert not {3, 50, 51} & set(_ids(table, last_date))
+  frame = table.frame(table.rows(mission = lbf.MISSING))
+  assert sorted(frame['id']) == [7, 50]
+  assert frame['mission'].isna().all()
+  assert frame.loc[frame['id'] == 50, 'date'].isna().all()
+  assert set(table.meta['date']) >= {lbf.MISSING}
@@ -0,0 +1,135 @@
+# modules
+import numpy as np
+
+import local_functions as lf
+
+# expected values are worked out by hand from the ee definitions in
+# gee_functions.py and re_pull_functions.py: ee scales in double precision
+# (x * mult + add), decodes QA fields as (qa >> start) & width and masks a
+# pixel in every band when the single band mask is 0
+
+
+def _image(**bands):
+  return lf.LocalImage({n: np.array(a) for n, a in bands.items()})
+
+
+def test_applyScaleFactors_optical_only():
+  image = _image(
+    SR_B1 = np.array([[0, 8000], [10000, 65535]], dtype = np.uint16),
+    ST_B6 = np.array([[40000, 0], [0, 0]], dtype = np.uint16),
+    QA_PIXEL = np.array([[1, 2], [3, 4]], dtype = np.uint16))
+  out = lf.applyScaleFactors(image)
+  assert out.bandNames() == ['SR_B1', 'ST_B6', 'QA_PIXEL']
+  assert out.band('SR_B1').dtype == np.float64
+  np.testing.assert_allclose(out.band('SR_B1'),
+    [[-0.2, 0.02], [0.075, 1.6022125]], rtol = 0, atol = 1e-12)
+  # same double arithmetic as ee: multiply, then add
+  assert np.array_equal(out.band('SR_B1'),
+    image.band('SR_B1').astype(np.float64) * 0.0000275 + -0.2)
+  assert out.band('ST_B6') is image.band('ST_B6')
+  assert out.band('QA_PIXEL') is image.band('QA_PIXEL')
+
+
+def test_applyScaleFactors_57_and_89():
+  bands = dict(
+    SR_B3 = np.array([[10000]], dtype = np.uint16),
+    ST_B6 = np.array([[40000]], dtype = np.uint16),
+    ST_B10 = np.array([[40000]], dtype = np.uint16),
+    SR_ATMOS_OPACITY = np.array([[300]], dtype = np.int16),
+    ST_CDIST = np.array([[250]], dtype = np.int16))
+  ls57 = lf.applyScaleFactors_57(_image(**bands))
+  np.testing.assert_allclose(ls57.band('SR_B3'), [[0.075]], atol = 1e-12)
+  np.testing.assert_allclose(ls57.band('ST_B6'), [[285.7208]], atol = 1e-9)
+  np.testing.assert_allclose(ls57.band('SR_ATMOS_OPACITY'), [[0.3]], atol = 1e-12)
+  np.testing.assert_allclose(ls57.band('ST_CDIST'), [[2.5]], atol = 1e-12)
+  # 'ST_B.' does not match the two digit Landsat 8/9 thermal band
+  assert ls57.band('ST_B10').dtype == np.uint16
+
+  ls89 = lf.applyScaleFactors_89(_image(**bands))
+  np.testing.assert_allclose(ls89.band('ST_B10'), [[285.7208]], atol = 1e-9)
+  np.testing.assert_allclose(ls89.band('ST_CDIST'), [[2.5]], atol = 1e-12)
+  assert ls89.band('ST_B6').dtype == np.uint16
+  assert ls89.band('SR_ATMOS_OPACITY').dtype == np.int16
+  assert ls89.bandNames() == list(bands)
+
+
+def test_qa_pixel_decode_and_mask():
+  qa = np.array([
+    0,                  # clear
+    (2 << 8) | 2,       # medium cloud, dilated cloud: kept
+    3 << 8,             # high cloud
+    (2 << 10),          # medium cloud shadow: kept
+    3 << 10,            # high cloud shadow
+    3 << 12,            # high snow/ice
+    3 << 14,            # high cirrus
+    (1 << 14) | (1 << 8)], dtype = np.uint16)
+  stack = lf.decode_qa_bits(qa, lf.QA_PIXEL_SPEC)
+  assert stack.dtype == np.uint8
+  names = [f[0] for f in lf.QA_PIXEL_SPEC]
+  decoded = dict(zip(names, stack))
+  assert decoded['cloud_conf'].tolist() == [0, 2, 3, 0, 0, 0, 0, 1]
+  assert decoded['cloudshad_conf'].tolist() == [0, 0, 0, 2, 3, 0, 0, 0]
+  assert decoded['snowice_conf'].tolist() == [0, 0, 0, 0, 0, 3, 0, 0]
+  assert decoded['cirrus_conf'].tolist() == [0, 0, 0, 0, 0, 0, 3, 1]
+  assert decoded['dialated_cloud'].tolist() == [0, 1, 0, 0, 0, 0, 0, 0]
+  assert lf.qa_mask(qa, lf.QA_PIXEL_SPEC).tolist() == [
+    True, True, False, True, False, False, False, True]
+
+
+def test_qa_aerosol_and_qa60_masks():
+  aerosol = np.array([0, 1 << 6, 2 << 6, 3 << 6, (3 << 6) | 63], dtype = np.uint8)
+  assert lf.qa_mask(aerosol, lf.QA_AEROSOL_SPEC).tolist() == [
+    True, True, True, False, False]
+  qa60 = np.array([0, 1 << 10, 1 << 11, 3 << 10, 1 << 9], dtype = np.uint16)
+  assert lf.qa_mask(qa60, lf.QA60_SPEC).tolist() == [
+    True, False, False, False, True]
+  image = _image(QA60 = qa60.reshape(1, -1))
+  flagged = lf.flag_cirrus_opaque(image)
+  assert flagged.band('cirrus').tolist() == [[0, 0, 1, 1, 0]]
+  assert flagged.band('opaque').tolist() == [[0, 1, 0, 1, 0]]
+
+
+def test_mask_qa_flags_masks_every_band():
+  qa = np.array([[0, 3 << 8], [3 << 14, 2 << 8]], dtype = np.uint16)
+  image = _image(QA_PIXEL = qa, SR_B2 = np.ones((2, 2)))
+  image = image.updateMask(np.array([[True, True], [True, False]]))
+  out = lf.mask_qa_flags(image)
+  # pixels that were already masked stay masked, like ee.Image.updateMask()
+  assert out.mask.tolist() == [[True, False], [False, False]]
+
+
+def test_mask_SCL_qa():
+  scl = np.arange(12, dtype = np.uint8).reshape(3, 4)
+  out = lf.mask_SCL_qa(_image(SCL = scl))
+  # masked: dark (2), cloud shadow (3), medium (8) and high (9) probability
+  # cloud, cirrus (10) and snow/ice (11)
+  assert out.mask.tolist() == [
+    [True, True, False, False],
+    [True, True, True, True],
+    [False, False, False, False]]
+  sat = lf.apply_sat_defect_mask(_image(SCL = scl))
+  assert sat.mask.ravel().tolist() == [v != 1 for v in range(12)]
+
+
+def test_add_qa_info_s2():
+  scl = np.array([[2, 3, 6, 7], [8, 9, 10, 11]], dtype = np.uint8)
+  out = lf.add_qa_info_s2(_image(SCL = scl))
+  names = ['dark_pixel', 'cloud_shadow', 'water', 'low_prob_cloud',
+    'med_prob_cloud', 'hi_prob_cloud', 'cirrus_scl', 'snow_ice']
+  assert out.bandNames() == ['SCL'] + names
+  for i, name in enumerate(names):
+    expected = np.zeros(8, dtype = np.uint8)
+    expected[i] = 1
+    assert out.band(name).dtype == np.uint8
+    assert np.array_equal(out.band(name).ravel(), expected)
+
+
+def test_applyScaleFactors_S2_renames_and_moves_bands():
+  image = _image(
+    B2 = np.array([[1000]], dtype = np.uint16),
+    SCL = np.array([[4]], dtype = np.uint8),
+    B8A = np.array([[2500]], dtype = np.uint16))
+  out = lf.applyScaleFactors_S2(image)
+  assert out.bandNames() == ['SCL', 'SR_B2', 'SR_B8A']
+  np.testing.assert_allclose(out.band('SR_B2'), [[0.1]], atol = 1e-12)
+  np.testing.assert_allclose(out.band('SR_B8A'), [[0.25]], atol = 1e-12)
@@ -0,0 +1,69 @@
+# modules
+import types
+
+from conftest import bf, find_nodes
+
+
+def _re_pull():
+  return bf.load_module(bf.RE_PULL_FUNCTIONS, 're_pull_functions_test')
+
+
+def test_labels_join_composites_on_time_start(fake_ee):
+  rp = _re_pull()
+  index = {'2020-06-01': ['a'], '2020-06-02': []}
+  composites = rp.date_composites(fake_ee.ImageCollection('stack'), index,
+    rp.PIPELINE_BANDS['LS89'])
+  data = rp.extract_labels(composites, fake_ee.FeatureCollection('labels'),
+    rp.PIPELINE_BANDS['LS89'])
+  join = data._args[0]._args[0]._args[0]
+  assert join._name == 'apply'
+  assert join._args[0]._name == 'Join.saveAll'
+  condition = join._kwargs['condition']
+  assert condition._name == 'Filter.equals'
+  assert condition._kwargs == {'leftField': 'system:time_start',
+    'rightField': 'system:time_start'}
+  # the labels' join key is set in milliseconds, like the composites'
+  labels = join._kwargs['secondary']
+  assert labels._name == 'map'
+  assert find_nodes(labels, 'millis')
+
+
+def test_date_composites_map_over_the_date_list(fake_ee):
+  rp = _re_pull()
+  bands = rp.PIPELINE_BANDS['LS89']
+  small = {'2020-06-%02d' % d: ['a'] for d in range(1, 3)}
+  large = {'2020-06-%02d' % d: ['a', 'b'] for d in range(1, 29)}
+  large['2020-06-29'] = []
+  sizes = [bf.node_count(rp.date_composites(fake_ee.ImageCollection('stack'),
+    index, bands)) for index in (small, large)]
+  assert sizes[0] == sizes[1]
+  composites = rp.date_composites(fake_ee.ImageCollection('stack'), large,
+    bands)
+  dates = composites._args[0]._args[0]
+  assert dates._name == 'List'
+  assert dates._args[0] == sorted(d for d in large if large[d])
+
+
+def test_import_builds_no_ee_objects():
+  def untouchable(name):
+    raise AssertionError('ee.' + name + ' used at import')
+  ee = types.ModuleType('ee')
+  ee.__getattr__ = untouchable
+  with bf.using(ee):
+    rp = _re_pull()
+  with bf.using(bf.fake_ee()) as fake:
+    rp = _re_pull()
+    composite = rp.date_composite(fake.ImageCollection('images'),
+      rp.PIPELINE_BANDS['LS89'])
+    reduce = find_nodes(composite, 'reduce')[0]
+    assert reduce._args[1]._name == 'combine'
+
+
+def test_date_index_uses_utc_dates(fake_ee):
+  rp = _re_pull()
+  # 2020-06-01T23:30:00Z and 2020-06-02T00:10:00Z
+  fake_ee.recorder.respond = lambda node: {'dates': ['2020-06-02',
+    '2020-06-01'], 'ids': ['a', 'b'], 'times': [1591054200000, 1591056600000]}
+  index = rp.build_date_index(fake_ee.ImageCollection('stack'),
+    ['2020-06-01', '2020-06-02'])
+  assert index == {'2020-06-01': ['a'], '2020-06-02': ['b']}
@@ -0,0 +1,102 @@
+# modules
+import numpy as np
+import pandas as pd
+
+import gtb_functions as gtb
+import screen_functions as scf
+
+
+def test_group_quantiles_r_type_7():
+  x = np.array([[1.0, 5.0], [2.0, np.nan], [4.0, 5.0], [7.0, 6.0],
+    [3.0, 1.0]])
+  group = np.array([0, 0, 0, 0, 2])
+  q = scf.group_quantiles(x, group, 3, [0.25, 0.5, 0.75])
+  # R: quantile(c(1, 2, 4, 7), c(.25, .5, .75)) = 1.75, 3, 4.75 and the NaN is
+  # dropped from quantile(c(5, NA, 5, 6), ..., na.rm = TRUE) = 5, 5, 5.5
+  np.testing.assert_allclose(q[0, 0], [1.75, 3.0, 4.75])
+  np.testing.assert_allclose(q[0, 1], [5.0, 5.0, 5.5])
+  assert np.isnan(q[1]).all()
+  np.testing.assert_allclose(q[2], [[3.0] * 3, [1.0] * 3])
+
+  rng = np.random.default_rng(5)
+  x = rng.normal(size = (300, 4))
+  x[rng.random(x.shape) < 0.1] = np.nan
+  group = rng.integers(0, 5, 300)
+  q = scf.group_quantiles(x, group, 5, [0.1, 0.5, 0.9])
+  for g in range(5):
+    np.testing.assert_allclose(q[g].T, np.nanquantile(x[group == g],
+      [0.1, 0.5, 0.9], axis = 0))
+
+
+def test_mahalanobis_matches_the_group_covariance():
+  rng = np.random.default_rng(6)
+  x = rng.normal(size = (60, 3)) * [1.0, 2.0, 0.5]
+  x[10] = [6.0, -8.0, 2.0]
+  group = np.repeat([0, 1], 30)
+  k = np.full(60, 3)
+  # one row of group 1 only has two real features (NaN padding), one row has
+  # a missing real feature
+  x[40, 2] = np.nan
+  k[40] = 2
+  x[41, 0] = np.nan
+  d2 = scf.mahalanobis(x, group, 3, k)
+  assert np.isnan(d2[41])
+  assert np.nanargmax(d2[:30]) == 10
+  rows = np.arange(30)
+  d = x[rows] - x[rows].mean(axis = 0)
+  inv = np.linalg.inv(np.cov(x[rows], rowvar = False))
+  np.testing.assert_allclose(d2[rows], np.einsum('ni,ij,nj->n', d, inv, d))
+  # group 1 without the incomplete row, the padding counted as 0
+  rows = np.setdiff1d(np.arange(30, 60), [41])
+  z = np.where(np.isnan(x[rows]), 0, x[rows])
+  d = z - z.mean(axis = 0)
+  inv = np.linalg.pinv(np.cov(z, rowvar = False), hermitian = True)
+  np.testing.assert_allclose(d2[rows], np.einsum('ni,ij,nj->n', d, inv, d))
+  # a group with a single complete row has no covariance
+  single = scf.mahalanobis(x[:2], np.array([0, 1]), 2, k[:2])
+  assert np.isnan(single).all()
+
+
+def test_chi2_quantile_tolerance():
+  # exact chi-square 0.999 quantiles for k = 1, 5 and 9
+  exact = np.array([10.828, 20.515, 27.877])
+  approx = scf.chi2_quantile(0.999, [1, 5, 9])
+  assert (np.abs(approx / exact - 1) < [0.031, 0.013, 0.008]).all()
+
+
+def test_qa_flags():
+  labels = pd.DataFrame({
+    'mission': ['LS8', 'LS8', 'LS8', 'LS5', 'LS5', 'SEN2', 'SEN2'],
+    'class': ['openWater', 'openWater', 'cloud', 'openWater',
+      'offShoreSediment', 'openWater', 'cloud'],
+    'cloud_conf': [3, 2, 3, 2, 1, np.nan, np.nan],
+    'aero_level': [0, 3, 3, np.nan, np.nan, np.nan, np.nan],
+    'cirrus': [np.nan] * 5 + [1, 1]})
+  flags = scf.qa_flags(labels)
+  # LS8 flags at confidence 3, LS5 at 2; cloud labels are never flagged and
+  # rules of missing columns (SR_ATMOS_OPACITY, SCL bands) are skipped
+  assert flags['qa_cloud_conf'].tolist() == [True, False, False, True, False,
+    False, False]
+  assert flags['qa_aero_level'].tolist() == [False, True, False, False, False,
+    False, False]
+  assert flags['qa_cirrus'].tolist() == [False] * 5 + [True, False]
+  assert flags['qa'].tolist() == [True, True, False, True, False, True, False]
+  assert 'qa_SR_ATMOS_OPACITY' not in flags
+
+
+def test_screen_labels_flags_the_known_outlier():
+  rng = np.random.default_rng(7)
+  n = 40
+  labels = pd.DataFrame(rng.normal(0.05, 0.005, (n, 6)),
+    columns = gtb.ls89_input_feat)
+  labels['mission'] = 'LS8'
+  labels['class'] = 'openWater'
+  labels['cloud_conf'] = 0
+  # label 5 is bright in four bands, label 8 has high cloud confidence
+  labels.loc[5, ['SR_B2', 'SR_B3', 'SR_B4', 'SR_B5']] = 0.4
+  labels.loc[8, 'cloud_conf'] = 3
+  table = scf.screen_labels(labels)
+  assert np.flatnonzero(table['flag_spectral']).tolist() == [5]
+  assert table.loc[5, 'bands_extreme'] == 'SR_B2; SR_B3; SR_B4; SR_B5'
+  assert np.flatnonzero(table['flag_qa']).tolist() == [8]
+  assert table['mahalanobis'].idxmax() == 5
@@ -0,0 +1,37 @@
+# modules
+import resource
+
+import numpy as np
+
+import store_functions as sf
+
+
+def test_many_chunks_within_file_limit(tmp_path):
+  soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+  resource.setrlimit(resource.RLIMIT_NOFILE, (256, hard))
+  try:
+    # 40 x 40 = 1600 chunks, far more than the 256 allowed open files
+    store = sf.ReclassStore.create(str(tmp_path / 'store'), 320, 320,
+      chunks = (4, 8, 8))
+    rng = np.random.default_rng(0)
+    bands = [rng.integers(1, 6, (320, 320)).astype(np.int8) for _ in range(2)]
+    store.append('LANDSAT_8_2020-08-11', bands[0])
+    store.append('LANDSAT_8_2020-08-27', bands[1])
+    assert len(store._open) <= store.max_open
+    np.testing.assert_array_equal(store.read(), np.stack(bands))
+    reopened = sf.ReclassStore(store.path)
+    np.testing.assert_array_equal(reopened.read_date('LANDSAT_8_2020-08-27'),
+      bands[1])
+  finally:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+def test_nodata_chunks_are_not_created(tmp_path):
+  store = sf.ReclassStore.create(str(tmp_path / 'store'), 16, 16,
+    chunks = (2, 8, 8))
+  band = np.full((16, 16), sf.NODATA, dtype = np.int8)
+  band[:8, :8] = 3
+  store.append('LANDSAT_5_1984-06-01', band)
+  assert sorted(p.name for p in (tmp_path / 'store' / 'chunks').iterdir()) == [
+    '0.0.0.npy']
+  np.testing.assert_array_equal(store.read_pixel(12, 12), [sf.NODATA])
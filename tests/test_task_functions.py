@@ -0,0 +1,91 @@
+# modules
+import pytest
+
+from conftest import load
+
+
+class CountingBackend(object):
+  # wraps a FakeTaskBackend and records the most tasks active at once
+
+  def __init__(self, backend, active):
+    self.backend = backend
+    self.active = active
+    self.most_active = 0
+
+  def list_states(self):
+    states = self.backend.list_states()
+    n = sum(1 for s in states.values() if s in self.active)
+    self.most_active = max(self.most_active, n)
+    return states
+
+  def start(self, task):
+    return self.backend.start(task)
+
+
+def _scheduler(tf, backend, max_active = 3):
+  return tf.TaskScheduler(max_active = max_active, min_wait = 1, max_wait = 8,
+    backend = backend, sleep = lambda s: None)
+
+
+def test_scheduler_keeps_at_most_max_active(fake_ee):
+  tf = load('task_functions')
+  backend = CountingBackend(tf.FakeTaskBackend(), tf.ACTIVE_STATES)
+  scheduler = _scheduler(tf, backend)
+  failed = scheduler.run(['task_' + str(i) for i in range(10)])
+  assert failed == []
+  assert backend.backend.started == ['task_' + str(i) for i in range(10)]
+  assert backend.most_active <= 3
+  assert scheduler.slept > 0
+
+
+def test_scheduler_waits_for_existing_tasks(fake_ee):
+  tf = load('task_functions')
+  backend = tf.FakeTaskBackend(existing = 5)
+  scheduler = _scheduler(tf, backend)
+  job = scheduler.submit('task')
+  assert job['id'] is None
+  assert scheduler.run([]) == []
+  assert backend.started == ['task']
+  assert scheduler.jobs['task']['state'] == 'COMPLETED'
+
+
+def test_cancel_requested_holds_a_slot(fake_ee):
+  tf = load('task_functions')
+  assert 'CANCEL_REQUESTED' in tf.ACTIVE_STATES
+  assert 'CANCEL_REQUESTED' not in tf.FAILED_STATES
+  backend = tf.FakeTaskBackend()
+  backend.tasks['other'] = {'state': 'CANCEL_REQUESTED', 'age': 0,
+    'description': None}
+  scheduler = _scheduler(tf, backend, max_active = 1)
+  scheduler.submit('task')
+  assert backend.started == []
+
+
+def test_duplicate_keys_are_rejected_until_failed(fake_ee):
+  tf = load('task_functions')
+  backend = tf.FakeTaskBackend(fail = ['bad'])
+  scheduler = _scheduler(tf, backend)
+  scheduler.submit('good')
+  with pytest.raises(ValueError):
+    scheduler.submit('good')
+  scheduler.submit('bad')
+  assert [j['key'] for j in scheduler.wait()] == ['bad']
+  scheduler.submit('bad')
+  assert backend.started == ['good', 'bad', 'bad']
+
+
+def test_failed_exports_are_retried(fake_ee, tmp_path):
+  tf = load('task_functions')
+  ef = load('export_functions')
+  manifest = ef.ExportManifest(str(tmp_path / 'manifest.jsonl'),
+    max_retries = 2, retry_wait = 0)
+  backend = tf.FakeTaskBackend(fail = ['bad'])
+  good = manifest.key('LS5', 'LANDSAT_5_2000-06-01', 'v')
+  bad = manifest.key('LS5', 'LANDSAT_5_2000-06-02', 'v')
+  failed = ef.run_manifest(manifest, _scheduler(tf, backend),
+    {good: lambda: 'good', bad: lambda: 'bad'}, sleep = lambda s: None)
+  assert failed == [bad]
+  assert backend.started.count('good') == 1
+  assert backend.started.count('bad') == 3
+  assert manifest.entries[bad]['failures'] == 3
+  assert manifest.state(good) == 'completed'